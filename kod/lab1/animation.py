@@ -0,0 +1,183 @@
+"""LED animations for the lab panels.
+
+The same file is in lab1/ and lab2/, as repeater.py is, so that each lab runs
+from its own directory; a change to one goes into both.
+"""
+from bisect import bisect_right
+
+
+FRAME_INTERVAL = 1 / 60
+# Slack when cutting time into whole periods: 0.3 / 0.1 is 2.9999999999999996
+PHASE_EPSILON = 1e-9
+
+################################################################################
+
+
+class Animation:
+    """An animation is a pure function of time: frame(t) returns the states
+    of the LEDs it controls at time t (seconds since it started). Once t
+    reaches the duration, the animation is finished and all its LEDs are off.
+    """
+
+    def __init__(self, leds, duration):
+        self.leds = tuple(leds)
+        self.duration = duration
+
+    def frame(self, t):
+        raise NotImplementedError
+
+
+class Blink(Animation):
+    """Toggles all the LEDs every `period` seconds, `repeats` times in total,
+    the last toggle turning them off (same semantics as the old Blinker)."""
+
+    def __init__(self, leds, period, repeats, start=False):
+        super().__init__(leds, max(repeats - 1, 0) * period)
+        self.period = period
+        self.repeats = repeats
+        self.start = start
+
+    def frame(self, t):
+        # Whole periods elapsed, as an integer tick count
+        k = int(t / self.period + PHASE_EPSILON) + 1
+        value = k < self.repeats and (self.start != (k % 2 == 1))
+        return {led: value for led in self.leds}
+
+
+class Run(Animation):
+    """A light running over `lights` with each step shorter than the previous
+    one by `step` seconds (same timing as the old Runner)."""
+
+    def __init__(self, lights, repeats, step):
+        self.starts, self.ends = [], []
+        t = 0
+        for num in range(repeats):
+            self.starts.append(t)
+            self.ends.append(t + (repeats - num) * step)
+            t += (repeats - num - 1) * step
+        super().__init__(lights, t)
+        self.lights = tuple(lights)
+
+    def frame(self, t):
+        states = dict.fromkeys(self.leds, False)
+        num = bisect_right(self.starts, t) - 1
+        for i in (num - 1, num):
+            if 0 <= i < len(self.starts) and self.starts[i] <= t < self.ends[i]:
+                states[self.lights[i % len(self.lights)]] = True
+        return states
+
+
+class Keyframes(Animation):
+    """Explicit keyframes: a list of (time, {led: value}) pairs, each holding
+    until the next one."""
+
+    def __init__(self, leds, keyframes, duration):
+        super().__init__(leds, duration)
+        self.times = [t for t, _ in keyframes]
+        self.states = [states for _, states in keyframes]
+
+    def frame(self, t):
+        states = dict.fromkeys(self.leds, False)
+        i = bisect_right(self.times, t) - 1
+        if i >= 0:
+            states.update(self.states[i])
+        return states
+
+
+class Sequence(Animation):
+
+    def __init__(self, *animations):
+        leds = {led for animation in animations for led in animation.leds}
+        super().__init__(sorted(leds), sum(animation.duration for animation in animations))
+        self.animations = animations
+
+    def frame(self, t):
+        states = dict.fromkeys(self.leds, False)
+        for animation in self.animations:
+            if t < animation.duration:
+                states.update(animation.frame(t))
+                break
+            t -= animation.duration
+        return states
+
+
+class Parallel(Animation):
+
+    def __init__(self, *animations):
+        leds = {led for animation in animations for led in animation.leds}
+        super().__init__(sorted(leds), max(animation.duration for animation in animations))
+        self.animations = animations
+
+    def frame(self, t):
+        states = dict.fromkeys(self.leds, False)
+        for animation in self.animations:
+            if t < animation.duration:
+                for led, value in animation.frame(t).items():
+                    states[led] = states[led] or value
+        return states
+
+
+################################################################################
+
+
+class Animator:
+    """Plays one animation at a time, evaluating it from a single shared frame
+    callback. Playing a new animation preempts the current one."""
+
+    def __init__(self, action, frame_interval=FRAME_INTERVAL):
+        self.action = action
+        self.frame_interval = frame_interval
+        self.animation = None
+        self.on_finish = None
+        self.event = None
+        self.frames = 0
+        self.elapsed = 0
+        self.current = {}
+
+    def play(self, animation, on_finish=None):
+        self.stop()
+        self.animation = animation
+        self.on_finish = on_finish
+        self.frames = 0
+        self.elapsed = 0
+        self._apply(animation.frame(0))
+        if self.event is None:
+            from kivy.clock import Clock
+            self.event = Clock.schedule_interval(self._frame, self.frame_interval)
+
+    def stop(self):
+        if self.animation is None:
+            return
+        self._apply(dict.fromkeys(self.animation.leds, False))
+        self.animation = None
+        self.on_finish = None
+        self.current = {}
+
+    @property
+    def running(self):
+        return self.animation is not None
+
+    def _frame(self, dt):
+        if self.animation is None:
+            self.event = None
+            return False
+
+        # Time in whole frames, so it does not drift by summing float deltas;
+        # a late callback counts for the frames it missed
+        self.frames += max(1, round(dt / self.frame_interval))
+        self.elapsed = self.frames * self.frame_interval
+        if self.elapsed >= self.animation.duration:
+            on_finish = self.on_finish
+            self.stop()
+            self.event = None
+            if on_finish is not None:
+                on_finish()
+            return False
+
+        self._apply(self.animation.frame(self.elapsed))
+
+    def _apply(self, states):
+        for led, value in states.items():
+            if self.current.get(led) != value:
+                self.current[led] = value
+                self.action(led, value)
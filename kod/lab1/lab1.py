@@ -1,8 +1,7 @@
 import random
 import time
 
-from kivy.clock import Clock
-from repeater import Repeater
+from animation import Animator, Blink
 
 
 class Game:
@@ -14,21 +13,14 @@ class Game:
     ERROR = 4
 
     def __init__(self):
-        self.repeater = Repeater()
+        self.repeater = None
         self.state = Game.IDLE
 
         self.debug_mode = False
 
         self.btns = {1: 'sw6', 2: 'sw7', 3: 'sw8', 4: 'sw2', 5: 'sw3', 6: 'sw4'}
-        self.rbtns = {v: k for k, v in self.btns.items()}
         self.leds = {1: 'ds3', 2: 'ds6', 3: 'ds9', 4: 'ds1', 5: 'ds4', 6: 'ds7', 7: 'ds2', 8: 'ds5', 9: 'ds8'}
 
-        self.repeater.register_handler('sw5', self.start_handler)
-        self.repeater.register_handler('sw1', self.reset_handler)
-
-        for btn in self.rbtns:
-            self.repeater.register_handler(btn, self.btn_handler)
-
         self.len = 0
         self.sequence = []
         self.input_pos = 0
@@ -38,11 +30,22 @@ class Game:
 
         self._start_time = time.time()
 
-        self.blinker = None
+        self.animator = Animator(self._set)
 
     def play(self):
+        self._build_ui()
         self.repeater.run()
 
+    def _build_ui(self):
+        from repeater import Repeater
+
+        self.repeater = Repeater()
+        self.repeater.register_handler('sw5', self.start_handler)
+        self.repeater.register_handler('sw1', self.reset_handler)
+
+        for num, btn in self.btns.items():
+            self.repeater.register_handler(btn, self.btn_handler, num)
+
     def start_handler(self, _, value):
         if self.state != Game.IDLE or not value:
             return
@@ -57,11 +60,10 @@ class Game:
 
         self._schedule(lambda: self.start(1), 0, name='start')
 
-    def btn_handler(self, btn, value):
-        if self.state != Game.INPUT or not value:
+    def btn_handler(self, value, pressed):
+        if self.state != Game.INPUT or not pressed:
             return
 
-        value = self.rbtns[btn]
         print('Handling user input: %d.' % value)
 
         self._set_all(False)
@@ -71,7 +73,7 @@ class Game:
         self.btn_events[value] = self._schedule(lambda: self._set_all(False), 0.5, name='clear_clicked_light')
 
         if self.timeout_event is not None:
-            Clock.unschedule(self.timeout_event)
+            self.timeout_event.cancel()
             self.timeout_event = None
 
         if self.sequence[self.input_pos] == value:
@@ -97,8 +99,7 @@ class Game:
         self._clear_btn_events()
         self._disable_btns()
 
-        self.blinker = Blinker(2, 2, self._set_all)
-        self.blinker.blink()
+        self.animator.play(Blink(self.leds, 2, 2))
 
         self._schedule(lambda: self._set_state(Game.SHOW), 3.9, name='enter_show_state')
         self._schedule(lambda: self.display_item(0), 4, name='display_first_item')
@@ -130,8 +131,7 @@ class Game:
 
     def display_error(self, msg):
         print('An error occurred: %s.' % msg)
-        self.blinker = Blinker(0.1, 20, self._set_all)
-        self.blinker.blink()
+        self.animator.play(Blink(self.leds, 0.1, 20))
         self._schedule(lambda: self.start(1), 2, name='start_from_scratch(error)')
 
     # =========================================================================
@@ -143,6 +143,7 @@ class Game:
                       (getattr(fn, '__qualname__', None) if name is None else name,
                        time.time() - self._start_time, by))
             fn(*args)
+        from kivy.clock import Clock
         return Clock.schedule_once(f, by)
 
     def _blink_once(self, val):
@@ -176,42 +177,11 @@ class Game:
 
     def _clear_btn_events(self):
         for evnt in self.btn_events.values():
-            Clock.unschedule(evnt)
+            evnt.cancel()
 
     def _dbg(self, dt):
         print('> Debug after %s :: state = %s, seq = %s, pos = %s, len = %s.' % (dt, self.state, self.sequence, self.pos, self.len))
 
 
-class Blinker:
-
-    def __init__(self, duration, repeats, action, start=False, debug_mode=False):
-        self.duration = duration
-        self.repeats = repeats
-        self.action = action
-        self.state = start
-        self.debug_mode = debug_mode
-
-    def blink(self):
-        if self.debug_mode:
-            print('Running a blinker!')
-        self._blink()
-        self.event = Clock.schedule_interval(lambda dt: self._blink(), self.duration)
-
-    def destroy(self):
-        Clock.unschedule(self.event)
-
-    def _blink(self):
-        if self.debug_mode:
-            print('Blink ;)')
-        self.repeats -= 1
-        self.state = not self.state
-
-        if self.repeats <= 0:
-            self.action(False)
-            return False
-        else:
-            self.action(self.state)
-
-
 if __name__ == '__main__':
     Game().play()
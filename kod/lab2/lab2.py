@@ -1,8 +1,8 @@
+import asyncio
 import random
 import time
 
-from kivy.clock import Clock
-from repeater import Repeater
+from animation import Animator, Blink, Parallel, Run
 
 
 class Game:
@@ -15,21 +15,14 @@ class Game:
     SCORE = 5
 
     def __init__(self):
-        self.repeater = Repeater()
+        self.repeater = None
         self.debug_mode = True
 
         self.btns = {1: 'sw6', 2: 'sw7', 3: 'sw8', 4: 'sw2', 5: 'sw3', 6: 'sw4'}
-        self.rbtns = {v: k for k, v in self.btns.items()}
         self.leds = {1: 'ds3', 2: 'ds6', 3: 'ds9', 4: 'ds1', 5: 'ds4', 6: 'ds7', 7: 'ds2', 8: 'ds5', 9: 'ds8'}
 
         self.state = Game.IDLE
 
-        self.repeater.register_handler('sw5', self.start_handler)
-        self.repeater.register_handler('sw1', self.reset_handler)
-
-        for btn in self.rbtns:
-            self.repeater.register_handler(btn, self.btn_handler)
-
         self.num_players = 0
         self.curr_player = 0
         self.players = []
@@ -39,16 +32,37 @@ class Game:
         self.sequence = []
         self.input_pos = 0
 
-        self.timeout_event = None
-        self.btn_events = {}
+        self.inputs = None
+        self.game_task = None
+        self.clear_event = None
 
         self._start_time = time.time()
 
-        self.blinker = None
-        self.runner = None
+        self.animator = Animator(self._set)
 
     def play(self):
-        self.repeater.run()
+        asyncio.run(self.run())
+
+    async def run(self):
+        """Runs the Kivy app and the game on the same asyncio loop; closing the
+        window cancels whatever the game is doing."""
+        self.inputs = asyncio.Queue()
+        self._build_ui()
+        app = asyncio.ensure_future(self.repeater.async_run(async_lib='asyncio'))
+        try:
+            await app
+        finally:
+            self._cancel_game()
+
+    def _build_ui(self):
+        from repeater import Repeater
+
+        self.repeater = Repeater()
+        self.repeater.register_handler('sw5', self.start_handler)
+        self.repeater.register_handler('sw1', self.reset_handler)
+
+        for num, btn in self.btns.items():
+            self.repeater.register_handler(btn, self.btn_handler, num)
 
     # Handlers
 
@@ -58,7 +72,7 @@ class Game:
             return
 
         self._set_all(False)
-        self._schedule(lambda: self.init_game(), 0, name='init_game')
+        self._new_game()
 
     def reset_handler(self, _, value):
         if self.state == Game.IDLE or not value:
@@ -66,69 +80,91 @@ class Game:
 
         print('=' * 40 + '\nResetting the game.')
 
-        self._schedule(lambda: self.init_game(), 0, name='init_game')
+        self._new_game()
 
-    def btn_handler(self, btn, value):
-        if self.state not in (Game.INPUT_SINGLE, Game.INIT) or not value:
+    def btn_handler(self, value, pressed):
+        if self.state not in (Game.INPUT_SINGLE, Game.INIT) or not pressed:
             return
 
-        value = self.rbtns[btn]
         print('Handling user input: %d.' % value)
 
         self._set_all(False)
-        self._clear_btn_events()
-
         self._set(value, True)
-        self.btn_events[value] = self._schedule(lambda: self._set_all(False), 0.5, name='clear_clicked_light')
-
-        if self.timeout_event is not None:
-            Clock.unschedule(self.timeout_event)
-            self.timeout_event = None
-
-        if self.state == Game.INPUT_SINGLE:
-            if self.sequence[self.input_pos] == value:
-                self.input_pos += 1
-                print('A correct guess <%d>!' % value)
-
-                if self.input_pos == self.len:
-                    print('Correctly finished a sequence! Increasing game difficulty.')
-                    self._schedule(lambda: self.start_single(self.curr_player, self.len + 1), 1, name='starting_next_level')
-                else:
-                    self.timeout_event = self._schedule(lambda: self.display_error('Waited too long (over 3s), game over!'), 3, name='input_timeout_error')
-            else:
-                self._schedule(lambda: self.display_error('Wrong guess: %d != %d!' % (value, self.sequence[self.input_pos])),
-                               0, name='wrong_input_error')
-
-        elif self.state == Game.INIT and value not in self.players:
-            self.num_players += 1
-            self.players.append(value)
-            self.scores.append(0)
-            self.timeout_event = self._schedule(lambda: self.init_single(0), 3, name='finished_player_count')
+        if self.clear_event is not None:
+            self.clear_event.cancel()
+        self.clear_event = asyncio.get_running_loop().call_later(0.5, self._set_all, False)
+
+        self.inputs.put_nowait(value)
 
     # Game steps
 
-    def init_game(self):
+    async def game(self):
+        await self.init_game()
+
+        for player in range(self.num_players):
+            await self.init_single(player)
+
+            length = 1
+            error = await self.play_single(player, length)
+            while error is None:
+                await asyncio.sleep(1)
+                length += 1
+                error = await self.play_single(player, length)
+
+            await self.display_error(error)
+
+        await self.display_winner()
+
+    async def init_game(self):
         self.num_players = 0
         self.curr_player = 0
         self.scores = []
         self.players = []
 
         self._enable_btns()
-
-        self._schedule(lambda: self._set_state(Game.INIT), 0, name='start_player_count')
-
-    def init_single(self, player):
+        self._set_state(Game.INIT)
+
+        while True:
+            value = await self._next_input(3 if self.players else None)
+            if value is None:
+                break
+            if value not in self.players:
+                self.num_players += 1
+                self.players.append(value)
+                self.scores.append(0)
+
+    async def init_single(self, player):
         self.curr_player = player
         print('SELECTING PLAYER %d <%d/%d>' % (self.players[player], player + 1, self.num_players))
 
-        self._clear_btn_events()
         self._disable_btns()
 
         self._set(self.players[player], True)
-        self._schedule(lambda: self._set(self.players[player], False), 2, name='clear_player_light')
-        self._schedule(lambda: self.start_single(player, 1), 3, name='start_player_game')
-
-    def start_single(self, player, length):
+        await asyncio.sleep(2)
+        self._set(self.players[player], False)
+        await asyncio.sleep(1)
+
+    async def play_single(self, player, length):
+        """Plays one level, returns None if the player repeated the sequence
+        and the error message otherwise."""
+        await self.start_single(player, length)
+        await self.display_sequence()
+        await self.init_clicks()
+
+        while self.input_pos < self.len:
+            value = await self._next_input(3 if self.input_pos > 0 else None)
+            if value is None:
+                return 'Waited too long (over 3s), game over!'
+            if value != self.sequence[self.input_pos]:
+                return 'Wrong guess: %d != %d!' % (value, self.sequence[self.input_pos])
+
+            self.input_pos += 1
+            print('A correct guess <%d>!' % value)
+
+        print('Correctly finished a sequence! Increasing game difficulty.')
+        return None
+
+    async def start_single(self, player, length):
         print('Starting a new game for player %d with len=%d.' % (player + 1, length))
         self.scores[player] = length - 1
 
@@ -136,54 +172,51 @@ class Game:
         self.sequence = [random.randint(1, 6) for _ in range(self.len)]
         self.state = Game.START_SINGLE
 
-        self._clear_btn_events()
         self._disable_btns()
+        self.animator.play(Blink(self.leds, 2, 2))
 
-        self.blinker = Blinker(2, 2, self._set_all)
-        self.blinker.blink()
-
-        self._schedule(lambda: self._set_state(Game.SHOW_SINGLE), 3.9, name='enter_show_state')
-        self._schedule(lambda: self.display_item(0), 4, name='display_first_item')
+        await asyncio.sleep(3.9)
+        self._set_state(Game.SHOW_SINGLE)
+        await asyncio.sleep(0.1)
 
-    def display_item(self, pos):
-        item = self.sequence[pos]
+    async def display_sequence(self):
+        for pos, item in enumerate(self.sequence):
+            print('Displaying an item <%s> (%d/%d).' % (item, pos + 1, self.len))
 
-        print('Displaying an item <%s> (%d/%d).' % (item, pos + 1, self.len))
+            self._set(item, True)
+            await asyncio.sleep(0.5)
+            self._set(item, False)
+            await asyncio.sleep(0.25 if pos < self.len - 1 else 2)
 
-        self._set(item, True)
-        self._schedule(lambda: self._set(item, False), 0.5, name='clear_displayed_led')
+        print('Whole sequence shown, will proceed to input.')
 
-        if pos < self.len - 1:
-            self._schedule(lambda: self.display_item(pos + 1), 0.75, name='display_next_item')
-        else:
-            print('Whole sequence shown, will proceed to input.')
-            self._schedule(lambda: self.init_clicks(), 2.5, name='init_clicks')
-
-    def init_clicks(self):
+    async def init_clicks(self):
         print('Initializing user input state.')
 
-        self._schedule(lambda: self._set_all(True), 0, name='light_all')
-        self._schedule(lambda: self._set_all(False), 1, name='clear_all')
+        self._set_all(True)
+        await asyncio.sleep(1)
+        self._set_all(False)
 
         self.input_pos = 0
+        self._drain_inputs()
 
-        self._schedule(lambda: self._set_state(Game.INPUT_SINGLE), 1, name='start_input_mode')
-        self._schedule(lambda: self._enable_btns(), 1, name='enable_btns')
+        self._set_state(Game.INPUT_SINGLE)
+        self._enable_btns()
 
-    def display_error(self, msg):
+    async def display_error(self, msg):
         print('An error occurred: %s.' % msg)
-        self.blinker = Blinker(0.1, 20, self._set_all)
-        self.blinker.blink()
+        self._disable_btns()
+
+        error_blink = Blink(self.leds, 0.1, 20)
         print('Status :: num_players = %d, curr_player = %d, players = %s, scores = %s\n' % (self.num_players, self.curr_player, self.players, self.scores))
         if self.curr_player < self.num_players - 1:
-            self._schedule(lambda: self.init_single(self.curr_player + 1), 2, name='start_next_player(error)')
+            self.animator.play(error_blink)
+            await asyncio.sleep(2)
         else:
             print('Final player played his game, ROUND OVER!!!')
-            self.runner = Runner((7, 8, 9), 40, 0.0125, self._set)
-            self.runner.run()
-            self._schedule(lambda: self.display_winner(), 20 * 39 * 0.0125, name='display_winner')
+            await self._animate(Parallel(error_blink, Run((7, 8, 9), 40, 0.0125)))
 
-    def display_winner(self):
+    async def display_winner(self):
         print('<< And the winner is... >>')
         winner = max(range(self.num_players), key=lambda i: self.scores[i])
         print('<< PLAYER %d <%d/%d> with score %d! >>' % (self.players[winner], winner + 1, self.num_players, self.scores[winner]))
@@ -192,19 +225,37 @@ class Game:
 
     # =========================================================================
 
-    def _schedule(self, fn, by, *args, name=None):
-        def f(dt):
-            if self.debug_mode:
-                print('> Executing <%s> at %.2f (delayed by %s).' %
-                      (getattr(fn, '__qualname__', None) if name is None else name,
-                       time.time() - self._start_time, by))
-            fn(*args)
-        return Clock.schedule_once(f, by)
-
-    def _blink_once(self, val):
-        def f(dt):
-            self._set_all(val)
-        return f
+    def _new_game(self):
+        self._cancel_game()
+        self.game_task = asyncio.ensure_future(self.game())
+
+    def _cancel_game(self):
+        if self.game_task is not None:
+            self.game_task.cancel()
+            self.game_task = None
+        if self.clear_event is not None:
+            self.clear_event.cancel()
+            self.clear_event = None
+        self.animator.stop()
+        self._drain_inputs()
+
+    async def _next_input(self, timeout):
+        try:
+            return await asyncio.wait_for(self.inputs.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _drain_inputs(self):
+        while not self.inputs.empty():
+            self.inputs.get_nowait()
+
+    async def _animate(self, animation):
+        done = asyncio.get_running_loop().create_future()
+        self.animator.play(animation, on_finish=lambda: done.done() or done.set_result(None))
+        try:
+            await done
+        finally:
+            self.animator.stop()
 
     # ==========================================================================
 
@@ -216,6 +267,8 @@ class Game:
             self.repeater.set(id, value)
 
     def _set_state(self, state):
+        if self.debug_mode:
+            print('> State %d -> %d at %.2f.' % (self.state, state, time.time() - self._start_time))
         self.state = state
 
     def _disable_btns(self):
@@ -228,64 +281,8 @@ class Game:
         for btn in self.btns.values():
             self.repeater.interface.ids[btn].disabled = False
 
-    # ==========================================================================
-
-    def _clear_btn_events(self):
-        for evnt in self.btn_events.values():
-            Clock.unschedule(evnt)
-
-    def _dbg(self, dt):
-        print('> Debug after %s :: state = %s, seq = %s, pos = %s, len = %s.' % (dt, self.state, self.sequence, self.pos, self.len))
-
-
-class Blinker:
-
-    def __init__(self, duration, repeats, action, start=False, debug_mode=False):
-        self.duration = duration
-        self.repeats = repeats
-        self.action = action
-        self.state = start
-        self.debug_mode = debug_mode
-
-    def blink(self):
-        if self.debug_mode:
-            print('Running a blinker!')
-        self._blink()
-        self.event = Clock.schedule_interval(lambda dt: self._blink(), self.duration)
-
-    def destroy(self):
-        Clock.unschedule(self.event)
-
-    def _blink(self):
-        if self.debug_mode:
-            print('Blink ;)')
-        self.repeats -= 1
-        self.state = not self.state
-
-        if self.repeats <= 0:
-            self.action(False)
-            return False
-        else:
-            self.action(self.state)
-
-
-class Runner:
-
-    def __init__(self, lights, repeats, step, action):
-        self.lights = lights
-        self.repeats = repeats
-        self.step = step
-        self.action = action
-
-    def run(self, num=0):
-        if num < self.repeats:
-            dt = (self.repeats - num) * self.step
-            Clock.schedule_once(lambda dt: self.action(self.lights[num % len(self.lights)], True), 0)
-            Clock.schedule_once(lambda dt: self.action(self.lights[num % len(self.lights)], False), dt)
-            Clock.schedule_once(lambda dt: self.run(num + 1), dt - self.step)
-        else:
-            for light in self.lights:
-                self.action(light, False)
+    def _dbg(self):
+        print('> Debug :: state = %s, seq = %s, pos = %s, len = %s.' % (self.state, self.sequence, self.input_pos, self.len))
 
 
 if __name__ == '__main__':
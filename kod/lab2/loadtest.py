@@ -0,0 +1,97 @@
+"""Load test for server.py: opens many concurrent game sessions, each of which
+starts a game, registers a few players and checks the LED echo of every
+press. Reports established sessions per second and the press -> LED latency.
+
+Usage: python loadtest.py [--sessions 2000] [--concurrency 500] [--presses 3]
+                          [--unix PATH | --host HOST --port PORT | --local]
+"""
+import argparse
+import asyncio
+import time
+
+from server import GameServer, DEFAULT_HOST, DEFAULT_PORT
+
+
+################################################################################
+
+
+async def open_connection(args):
+    if args.unix is not None:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+
+async def read_until(reader, expected):
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('server closed the session')
+        if line.rstrip() == expected:
+            return
+
+
+async def run_session(args, latencies):
+    reader, writer = await open_connection(args)
+    try:
+        writer.write(b'START\n')
+        await read_until(reader, b'STATE INIT')
+
+        for btn in range(1, args.presses + 1):
+            sent = time.perf_counter()
+            writer.write(b'PRESS %d\n' % btn)
+            await read_until(reader, b'LED %d 1' % btn)
+            latencies.append(time.perf_counter() - sent)
+
+        writer.write(b'QUIT\n')
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def run(args):
+    server = None
+    if args.local:
+        server = GameServer(asyncio.get_running_loop())
+        await server.start(args.host, args.port, args.unix)
+
+    latencies = []
+    failures = 0
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def bounded():
+        nonlocal failures
+        async with limit:
+            try:
+                await run_session(args, latencies)
+            except (OSError, ConnectionError):
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded() for _ in range(args.sessions)))
+    elapsed = time.perf_counter() - started
+
+    if server is not None:
+        server.close()
+
+    report(args.sessions - failures, failures, elapsed, latencies)
+
+
+def report(done, failures, elapsed, latencies):
+    print('sessions: %d ok, %d failed in %.2fs -> %.1f sessions/s' % (done, failures, elapsed, done / elapsed))
+    if latencies:
+        latencies.sort()
+        pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+        print('event latency (ms): mean %.3f, p50 %.3f, p90 %.3f, p99 %.3f, max %.3f'
+              % (sum(latencies) / len(latencies) * 1000, pick(0.5), pick(0.9), pick(0.99), latencies[-1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test for the repeater game server.')
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--presses', type=int, default=3, choices=range(1, 7))
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', default=None)
+    parser.add_argument('--local', action='store_true', help='run the server in this process')
+    asyncio.run(run(parser.parse_args()))
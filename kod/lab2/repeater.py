@@ -1,3 +1,5 @@
+from functools import partial
+
 from kivy.app import App
 from kivy.properties import NumericProperty, ReferenceListProperty
 from kivy.uix.widget import Widget
@@ -54,23 +56,30 @@ class Repeater(App):
         super().__init__()
         self.devices = {}
         self.handlers = {}
+        self.slots = {}
+        self.dispatch_table = []
 
-    def update(self, id):
-        def f(pin_state):
-            self.devices[id].pin_state = pin_state
-            self.trigger_event(id)
-        return f
-
-    def register_handler(self, id, handler):
-        self.handlers[id] = handler
+    def register_handler(self, id, handler, key=None):
+        """Binds a handler to the device `id`; it is called as handler(key,
+        pin_state), with key defaulting to the id itself."""
+        self.handlers[id] = (handler, id if key is None else key)
+        if id in self.slots:
+            self._bind(id)
 
     def unregister_handler(self, id):
-        self.handlers[id] = None
+        self.handlers.pop(id, None)
+        if id in self.slots:
+            self._bind(id)
 
     def trigger_event(self, id):
-        if id not in self.handlers:
-            return
-        self.handlers[id](id, self.get(id))
+        if id in self.slots:
+            self.dispatch_input(self.slots[id], self.get(id))
+
+    def dispatch_input(self, slot, pin_state):
+        device, handler, key = self.dispatch_table[slot]
+        device.pin_state = pin_state
+        if handler is not None:
+            handler(key, pin_state)
 
     def get(self, id):
         return self.devices[id].pin_state
@@ -84,10 +93,17 @@ class Repeater(App):
         self.devices = self.interface.ids
         for id, device in self.interface.ids.items():
             if hasattr(device, 'on_state_changed'):
-                device.on_state_changed = self.update(id)
+                self.slots[id] = len(self.dispatch_table)
+                self.dispatch_table.append(None)
+                self._bind(id)
+                device.on_state_changed = partial(self.dispatch_input, self.slots[id])
 
         return self.interface
 
+    def _bind(self, id):
+        handler, key = self.handlers.get(id, (None, None))
+        self.dispatch_table[self.slots[id]] = (self.devices[id], handler, key)
+
 
 if __name__ == '__main__':
     r = Repeater()
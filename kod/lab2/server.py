@@ -0,0 +1,133 @@
+"""Hosts many independent repeater games on one asyncio event loop.
+
+Every connection gets its own GameSession with a virtual device. The protocol
+is line based, one command per line:
+
+    client -> server:   START | RESET | PRESS <1-6> | QUIT
+    server -> client:   LED <1-9> <0|1> | BUTTONS <0|1> | ANIM <name> <args..>
+                        STATE <name> | ERROR <reason> | WINNER <player> <score>
+
+Usage: python server.py [--unix PATH | --host HOST --port PORT]
+"""
+import argparse
+import asyncio
+
+from session import GameSession, VirtualDevice, NUM_BTNS
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8642
+
+################################################################################
+
+
+class SessionHandler(asyncio.Protocol):
+
+    def __init__(self, server):
+        self.server = server
+        self.loop = server.loop
+        self.transport = None
+        self.buffer = b''
+        self.timer = None
+        self.timer_at = None
+        self.session = GameSession(VirtualDevice(self.send))
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.sessions.add(self)
+        self.server.total_sessions += 1
+
+    def connection_lost(self, exc):
+        self.server.sessions.discard(self)
+        if self.timer is not None:
+            self.timer.cancel()
+        self.session.device.listener = None
+
+    def data_received(self, data):
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+
+        now = self.loop.time()
+        for line in lines:
+            self.handle(line.split(), now)
+        self._rearm()
+
+    def handle(self, cmd, now):
+        if not cmd:
+            return
+        self.server.total_events += 1
+
+        if cmd[0] == b'PRESS' and len(cmd) == 2 and cmd[1].isdigit() and 1 <= int(cmd[1]) <= NUM_BTNS:
+            self.session.press(int(cmd[1]), now)
+        elif cmd[0] == b'START':
+            self.session.start(now)
+        elif cmd[0] == b'RESET':
+            self.session.reset(now)
+        elif cmd[0] == b'QUIT':
+            self.transport.close()
+        else:
+            self.send('ERROR', 'bad-command')
+
+    def send(self, kind, *args):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write((' '.join([kind] + [str(arg) for arg in args]) + '\n').encode())
+
+    def _wake(self):
+        self.timer = None
+        self.timer_at = None
+        self.session.advance(self.loop.time())
+        self._rearm()
+
+    def _rearm(self):
+        at = self.session.next_deadline()
+        if at == self.timer_at:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = None if at is None else self.loop.call_at(at, self._wake)
+        self.timer_at = at
+
+
+class GameServer:
+
+    def __init__(self, loop=None):
+        self.loop = asyncio.get_event_loop() if loop is None else loop
+        self.sessions = set()
+        self.total_sessions = 0
+        self.total_events = 0
+        self.server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        factory = lambda: SessionHandler(self)
+        if path is not None:
+            self.server = await self.loop.create_unix_server(factory, path)
+        else:
+            self.server = await self.loop.create_server(factory, host, port)
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        for handler in list(self.sessions):
+            handler.transport.close()
+
+
+################################################################################
+
+
+async def main(args):
+    server = GameServer(asyncio.get_running_loop())
+    await server.start(args.host, args.port, args.unix)
+    print('Serving games on %s.' % (args.unix or '%s:%d' % (args.host, args.port)))
+    await server.server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-session repeater game server.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', default=None, help='serve on a Unix socket instead of TCP')
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
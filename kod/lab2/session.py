@@ -0,0 +1,242 @@
+import heapq
+import random
+
+
+IDLE = 0
+INIT = 1
+START_SINGLE = 2
+SHOW_SINGLE = 3
+INPUT_SINGLE = 4
+SCORE = 5
+
+STATE_NAMES = ('IDLE', 'INIT', 'START_SINGLE', 'SHOW_SINGLE', 'INPUT_SINGLE', 'SCORE')
+
+NUM_BTNS = 6
+NUM_LEDS = 9
+
+# Timer kinds, each one can be cancelled as a whole
+FLOW = 0
+BTN = 1
+TIMEOUT = 2
+
+################################################################################
+
+
+class VirtualDevice:
+    """LEDs 1-9 and buttons 1-6 of a repeater, reporting every visible change
+    to `listener(kind, *args)`. Animations are reported by name, rendering them
+    is up to the client."""
+
+    def __init__(self, listener=None):
+        self.leds = [False] * (NUM_LEDS + 1)
+        self.buttons_enabled = False
+        self.listener = listener
+
+    def set(self, led, value):
+        if self.leds[led] != value:
+            self.leds[led] = value
+            self._notify('LED', led, int(value))
+
+    def set_all(self, value):
+        for led in range(1, NUM_LEDS + 1):
+            self.set(led, value)
+
+    def enable_buttons(self, value):
+        if self.buttons_enabled != value:
+            self.buttons_enabled = value
+            self._notify('BUTTONS', int(value))
+
+    def play(self, animation, *args):
+        self._notify('ANIM', animation, *args)
+
+    def report(self, kind, *args):
+        self._notify(kind, *args)
+
+    def _notify(self, kind, *args):
+        if self.listener is not None:
+            self.listener(kind, *args)
+
+
+class GameSession:
+    """The lab2 game as a plain state machine, without any I/O or clock of its
+    own: inputs come in through start/reset/press with the current time, and
+    the owner calls advance(now) whenever next_deadline() comes due.
+
+    Timers are kept in a heap as (time, seq, kind, token, step, arg) tuples;
+    cancelling a kind only bumps its token, stale timers are dropped when they
+    come up."""
+
+    def __init__(self, device, rng=None):
+        self.device = device
+        self.rng = random.Random() if rng is None else rng
+        self.state = IDLE
+
+        self.num_players = 0
+        self.curr_player = 0
+        self.players = []
+        self.scores = []
+
+        self.len = 0
+        self.sequence = []
+        self.input_pos = 0
+
+        self.now = 0
+        self.timers = []
+        self.tokens = [0, 0, 0]
+        self._seq = 0
+
+    # Inputs
+
+    def start(self, now):
+        self.advance(now)
+        if self.state != IDLE:
+            return
+
+        self.device.set_all(False)
+        self.init_game()
+
+    def reset(self, now):
+        self.advance(now)
+        if self.state == IDLE:
+            return
+
+        self.init_game()
+
+    def press(self, btn, now):
+        self.advance(now)
+        if self.state not in (INPUT_SINGLE, INIT) or not self.device.buttons_enabled:
+            return
+        if self.state == INPUT_SINGLE and self.input_pos >= self.len:
+            return
+
+        self.device.set_all(False)
+        self._cancel(BTN)
+        self.device.set(btn, True)
+        self._schedule(0.5, BTN, GameSession._set_all, False)
+
+        self._cancel(TIMEOUT)
+
+        if self.state == INPUT_SINGLE:
+            if self.sequence[self.input_pos] == btn:
+                self.input_pos += 1
+
+                if self.input_pos == self.len:
+                    self._schedule(1, FLOW, GameSession.start_single, self.len + 1)
+                else:
+                    self._schedule(3, TIMEOUT, GameSession.display_error, 'timeout')
+            else:
+                self.display_error('wrong')
+
+        elif self.state == INIT and btn not in self.players:
+            self.num_players += 1
+            self.players.append(btn)
+            self.scores.append(0)
+            self._schedule(3, TIMEOUT, GameSession.init_single, 0)
+
+    def next_deadline(self):
+        while self.timers and self.timers[0][3] != self.tokens[self.timers[0][2]]:
+            heapq.heappop(self.timers)
+        return self.timers[0][0] if self.timers else None
+
+    def advance(self, now):
+        while self.timers and self.timers[0][0] <= now:
+            at, _, kind, token, step, arg = heapq.heappop(self.timers)
+            if token == self.tokens[kind]:
+                self.now = at
+                step(self, arg)
+        self.now = now
+
+    # Game steps
+
+    def init_game(self):
+        for kind in (FLOW, BTN, TIMEOUT):
+            self._cancel(kind)
+
+        self.num_players = 0
+        self.curr_player = 0
+        self.scores = []
+        self.players = []
+
+        self.device.enable_buttons(True)
+        self._set_state(INIT)
+
+    def init_single(self, player):
+        self.curr_player = player
+
+        self._cancel(BTN)
+        self.device.enable_buttons(False)
+
+        self.device.set(self.players[player], True)
+        self._schedule(2, FLOW, GameSession._clear, self.players[player])
+        self._schedule(3, FLOW, GameSession.start_single, 1)
+
+    def start_single(self, length):
+        self.scores[self.curr_player] = length - 1
+
+        self.len = length
+        self.sequence = [self.rng.randint(1, NUM_BTNS) for _ in range(self.len)]
+        self._set_state(START_SINGLE)
+
+        self._cancel(BTN)
+        self.device.enable_buttons(False)
+        self.device.play('BLINK', 2, 2)
+
+        self._schedule(3.9, FLOW, GameSession._set_state, SHOW_SINGLE)
+        self._schedule(4, FLOW, GameSession.display_item, 0)
+
+    def display_item(self, pos):
+        item = self.sequence[pos]
+
+        self.device.set(item, True)
+        self._schedule(0.5, FLOW, GameSession._clear, item)
+
+        if pos < self.len - 1:
+            self._schedule(0.75, FLOW, GameSession.display_item, pos + 1)
+        else:
+            self._schedule(2.5, FLOW, GameSession.init_clicks, None)
+
+    def init_clicks(self, _):
+        self.device.set_all(True)
+        self._schedule(1, FLOW, GameSession.begin_input, None)
+
+    def begin_input(self, _):
+        self.device.set_all(False)
+        self.input_pos = 0
+        self._set_state(INPUT_SINGLE)
+        self.device.enable_buttons(True)
+
+    def display_error(self, reason):
+        self.device.report('ERROR', reason)
+        self.device.enable_buttons(False)
+        if self.curr_player < self.num_players - 1:
+            self.device.play('BLINK', 0.1, 20)
+            self._schedule(2, FLOW, GameSession.init_single, self.curr_player + 1)
+        else:
+            self._set_state(SCORE)
+            self.device.play('RUN', 40, 0.0125)
+            self._schedule(20 * 39 * 0.0125, FLOW, GameSession.display_winner, None)
+
+    def display_winner(self, _):
+        winner = max(range(self.num_players), key=lambda i: self.scores[i])
+        self.device.report('WINNER', self.players[winner], self.scores[winner])
+        self.device.set(self.players[winner], True)
+        self._set_state(IDLE)
+
+    # Auxilliaries
+
+    def _schedule(self, by, kind, step, arg):
+        self._seq += 1
+        heapq.heappush(self.timers, (self.now + by, self._seq, kind, self.tokens[kind], step, arg))
+
+    def _cancel(self, kind):
+        self.tokens[kind] += 1
+
+    def _set_state(self, state):
+        self.state = state
+        self.device.report('STATE', STATE_NAMES[state])
+
+    def _set_all(self, value):
+        self.device.set_all(value)
+
+    def _clear(self, led):
+        self.device.set(led, False)
@@ -1,9 +1,7 @@
 import sys
 import time
 
-from kivy.clock import Clock
-
-from lift import *
+from constants import *
 
 
 DEBUG_MODE = False
@@ -191,14 +189,10 @@ class Elevator:
 
 class LiftSimulator:
 
-    def __init__(self):
-        self.lift = Lift()
-
-        for i in range(N):
-            self.lift.register_handler('f_%d' % (i + 1), self.floor_btn_handler)
-
-        for n in range(M):
-            self.lift.register_handler('l%d_p' % (n + 1), self.lift_btn_handler)
+    def __init__(self, ui=True):
+        self.lift = None
+        if ui:
+            self._build_ui()
 
         self.ctrl_loop_count = 0
         self.requests = [[False] * N for _ in range(2)]
@@ -217,13 +211,25 @@ class LiftSimulator:
     def simulate(self):
         global _START_TIME
         _START_TIME = time.time()
+        if self.lift is None:
+            self._build_ui()
         schedule_interval(self.control_loop, CONTROL_INTERVAL, name='CONTROL_LOOP', debug=False)
         self.lift.run()
 
+    def _build_ui(self):
+        from lift import Lift
+
+        self.lift = Lift()
+
+        for i in range(N):
+            self.lift.register_handler('f_%d' % (i + 1), self.floor_btn_handler, i)
+
+        for n in range(M):
+            self.lift.register_handler('l%d_p' % (n + 1), self.lift_btn_handler, n)
+
     # Handlers
 
-    def floor_btn_handler(self, id, value):
-        floor = int(id[2]) - 1
+    def floor_btn_handler(self, floor, value):
         if value:
             self.floor_last_pressed[floor] = time.time()
         else:
@@ -235,8 +241,7 @@ class LiftSimulator:
             else:
                 self.requests[DIRECTION_DOWN][floor] = True
 
-    def lift_btn_handler(self, id, value):
-        elevator = int(id[1]) - 1
+    def lift_btn_handler(self, elevator, value):
         if value:
             self.lift_last_pressed[elevator] = time.time()
         else:
@@ -245,7 +250,7 @@ class LiftSimulator:
             if dt < 1:
                 self.lift_clicks[elevator] += 1
                 if self.lift_events[elevator] is not None:
-                    Clock.unschedule(self.lift_events[elevator])
+                    self.lift_events[elevator].cancel()
                 self.lift_events[elevator] = schedule_event(lambda: self.finalize_lift_click(elevator), 1)
             else:   # A stop!
                 pass
@@ -313,6 +318,9 @@ class LiftSimulator:
         self.update_ui()
 
     def update_ui(self):
+        if self.lift is None:
+            return
+
         for i, elevator in enumerate(self.elevators):
             updated = set()
             if elevator.state == LIFT_STOPPED:
@@ -369,6 +377,7 @@ def schedule_event(fn, by, *args, name=None, debug=True):
                   (getattr(fn, '__qualname__', None) if name is None else name,
                    time.time() - _START_TIME, by))
         fn(*args)
+    from kivy.clock import Clock
     return Clock.schedule_once(f, by)
 
 
@@ -379,6 +388,7 @@ def schedule_interval(fn, interval, *args, name=None, debug=True):
                   (getattr(fn, '__qualname__', None) if name is None else name,
                    time.time() - _START_TIME, interval))
         fn(*args)
+    from kivy.clock import Clock
     return Clock.schedule_interval(f, interval)
 
 
@@ -1,3 +1,5 @@
+from functools import partial
+
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.properties import ListProperty, DictProperty
@@ -6,6 +8,8 @@ from kivy.uix.label import Label
 from kivy.uix.button import Button
 # from kivy.graphics import *
 
+from constants import *
+
 
 class PushButton(Button):
     def __init__(self, *args, **kwargs):
@@ -24,11 +28,6 @@ class PushButton(Button):
             self.on_state_changed(self.item_state)
 
 
-DIRECTION_NONE = -1
-DIRECTION_UP = 0
-DIRECTION_DOWN = 1
-
-
 class DirectionLED(Label):
 
     VISIBLE_COLOR = (1.0, 1.0, 1.0, 1.0)
@@ -54,13 +53,6 @@ class DirectionLED(Label):
         self.dir_colors[self._item_state] = self.VISIBLE_COLOR
 
 
-STATE_FAR = 0
-STATE_NEAR = 1
-STATE_AT_CLOSED = 2
-STATE_AT_CHANGING = 3
-STATE_AT_OPEN = 4
-
-
 class StateLED(Label):
 
     st_colors = {
@@ -114,17 +106,30 @@ class Lift(App):
         super().__init__()
         self.devices = {}
         self.handlers = {}
+        self.slots = {}
+        self.dispatch_table = []
 
-    def register_handler(self, id, handler):
-        self.handlers[id] = handler
+    def register_handler(self, id, handler, key=None):
+        """Binds a handler to the device `id`; it is called as handler(key,
+        item_state), with key defaulting to the id itself."""
+        self.handlers[id] = (handler, id if key is None else key)
+        if id in self.slots:
+            self._bind(id)
 
     def unregister_handler(self, id):
-        self.handlers[id] = None
+        self.handlers.pop(id, None)
+        if id in self.slots:
+            self._bind(id)
 
     def trigger_event(self, id):
-        if id not in self.handlers:
-            return
-        self.handlers[id](id, self.get(id))
+        if id in self.slots:
+            self.dispatch_input(self.slots[id], self.get(id))
+
+    def dispatch_input(self, slot, item_state):
+        device, handler, key = self.dispatch_table[slot]
+        device.item_state = item_state
+        if handler is not None:
+            handler(key, item_state)
 
     def get(self, id):
         return self.devices[id].item_state
@@ -132,19 +137,16 @@ class Lift(App):
     def set(self, id, item_state):
         self.devices[id].item_state = item_state
 
-    def update(self, id):
-        def f(item_state):
-            self.devices[id].item_state = item_state
-            self.trigger_event(id)
-        return f
-
     def build(self):
         self.interface = LiftInterface()
 
         self.devices = self.interface.ids
         for id, device in self.interface.ids.items():
             if hasattr(device, 'on_state_changed'):
-                device.on_state_changed = self.update(id)
+                self.slots[id] = len(self.dispatch_table)
+                self.dispatch_table.append(None)
+                self._bind(id)
+                device.on_state_changed = partial(self.dispatch_input, self.slots[id])
 
         # self.interface.ids['l1_2'].item_state = STATE_NEAR
         # self.interface.ids['l1_3'].item_state = StateLED.AT_CLOSED
@@ -152,3 +154,7 @@ class Lift(App):
         # self.interface.ids['l1_5'].item_state = StateLED.AT_OPEN
 
         return self.interface
+
+    def _bind(self, id):
+        handler, key = self.handlers.get(id, (None, None))
+        self.dispatch_table[self.slots[id]] = (self.devices[id], handler, key)
@@ -0,0 +1,367 @@
+"""Shared-memory state bridge between a controller process and any number of
+viewer processes.
+
+The controller publishes a fixed-layout frame into a named shared memory
+block after every tick; viewers attach by name and decode the fields
+straight from the mapping, with no pickling and no socket in between. A read
+still copies out the values it decodes, on every attempt. Consistency is
+kept seqlock-style: the writer makes the sequence counter odd before writing
+a frame and even again afterwards, a reader retries whenever it saw an odd
+counter or the counter changed while it was reading. The writer never waits
+for readers. The panel viewer is laid out for the floors and lifts in the
+header.
+
+Layout (little endian):
+
+    header   4s magic, u16 version, u16 floors, u16 lifts, u32 pid, 2x,
+             u64 sequence, u64 tick                                 32 bytes
+    per car  f32 position, i8 state, i8 direction, i8 doors,
+             u8 flags (1 idle, 2 stopped), floors x u8 LED state,
+             padded to 8 bytes
+    requests floors x u8 UP calls, floors x u8 DOWN calls
+
+Viewers can send button edges back over a Unix datagram socket; the
+controller feeds them into its InputQueue as if the buttons were its own.
+
+The header names the controller's process. A controller only takes over a
+block name that is already taken if that process is gone.
+
+Usage: python bridge.py controller [--name lift] [--inputs PATH] [--traffic RATE]
+       python bridge.py watch [--name lift]
+       python bridge.py panel [--name lift] [--inputs PATH]
+"""
+import argparse
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import traffic
+from inputs import *
+from lab4 import *
+
+
+MAGIC = b'LIFT'
+VERSION = 2
+
+HEADER = struct.Struct('<4sHHHI2xQQ')
+SEQUENCE_OFFSET = 16
+SEQUENCE = struct.Struct('<Q')
+CAR = struct.Struct('<fbbbB')
+
+FLAG_IDLE = 1
+FLAG_STOPPED = 2
+
+INPUT = struct.Struct('<BHBd')
+
+DEFAULT_NAME = 'lift'
+READ_RETRIES = 1000
+
+Car = namedtuple('Car', 'position state direction doors idle stopped leds')
+Frame = namedtuple('Frame', 'tick cars up down')
+
+################################################################################
+
+
+class Layout:
+
+    def __init__(self, floors, lifts):
+        self.floors = floors
+        self.lifts = lifts
+        self.car_size = (CAR.size + floors + 7) // 8 * 8
+        self.cars = HEADER.size
+        self.requests = self.cars + lifts * self.car_size
+        self.size = self.requests + 2 * floors
+
+    def car(self, i):
+        return self.cars + i * self.car_size
+
+
+class StateWriter:
+    """Publishes a simulator's state; attach it as `sim.bridge`, the
+    simulator calls publish() at the end of every tick."""
+
+    def __init__(self, config, name=DEFAULT_NAME):
+        self.layout = Layout(config.floors, config.lifts)
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=self.layout.size)
+        except FileExistsError:
+            self.unlink_stale(name)
+            self.shm = shared_memory.SharedMemory(name, create=True, size=self.layout.size)
+        self.buf = self.shm.buf
+        self.sequence = 0
+        HEADER.pack_into(self.buf, 0, MAGIC, VERSION, config.floors, config.lifts, os.getpid(), 0, 0)
+
+    @staticmethod
+    def unlink_stale(name):
+        """Unlinks a block left over by a controller that did not shut down
+        cleanly. Raises FileExistsError if it may still be in use."""
+        block = shared_memory.SharedMemory(name)
+        pid = 0
+        if block.size >= HEADER.size:
+            magic, version, _, _, pid, _, _ = HEADER.unpack_from(block.buf, 0)
+            if magic != MAGIC or version != VERSION:
+                pid = 0
+        if pid and not alive(pid):
+            block.close()
+            block.unlink()
+            return
+        resource_tracker.unregister(block._name, 'shared_memory')
+        block.close()
+        raise FileExistsError('Shared memory block "%s" is in use%s' % (name, ' by process %d' % pid if pid else ''))
+
+    def publish(self, sim):
+        buf, layout = self.buf, self.layout
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET + 8, sim.ctrl_loop_count)
+        for i, elevator in enumerate(sim.elevators):
+            offset = layout.car(i)
+            CAR.pack_into(buf, offset, elevator.position, elevator.state, elevator.direction, elevator.doors,
+                          FLAG_IDLE * elevator.idle | FLAG_STOPPED * elevator.stopped)
+            offset += CAR.size
+            buf[offset:offset + layout.floors] = bytes(sim.led_states(elevator))
+        buf[layout.requests:layout.requests + layout.floors] = bytes(sim.requests[DIRECTION_UP])
+        buf[layout.requests + layout.floors:layout.size] = bytes(sim.requests[DIRECTION_DOWN])
+
+        self.sequence += 1
+        SEQUENCE.pack_into(buf, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StateReader:
+    """Attaches to a running controller's frames; any number of readers can
+    attach to one writer."""
+
+    def __init__(self, name=DEFAULT_NAME):
+        self.shm = shared_memory.SharedMemory(name)
+        # Attaching must not make this process the owner: without this the
+        # resource tracker would unlink the block when the viewer exits
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.buf = self.shm.buf
+
+        magic, version, floors, lifts, _, _, _ = HEADER.unpack_from(self.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a lift state block' % name)
+        self.layout = Layout(floors, lifts)
+        self.last = None
+
+    def sequence(self):
+        return SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0]
+
+    def read(self):
+        """The latest consistent frame. If the writer kept changing it for
+        READ_RETRIES attempts, the last frame read before, None if none was."""
+        buf, layout = self.buf, self.layout
+        for attempt in range(READ_RETRIES):
+            if attempt:
+                time.sleep(0)   # let a preempted writer finish
+            before = self.sequence()
+            if before & 1:
+                continue
+
+            tick = SEQUENCE.unpack_from(buf, SEQUENCE_OFFSET + 8)[0]
+            cars = []
+            for i in range(layout.lifts):
+                offset = layout.car(i)
+                position, state, direction, doors, flags = CAR.unpack_from(buf, offset)
+                offset += CAR.size
+                cars.append(Car(position, state, direction, doors, bool(flags & FLAG_IDLE),
+                                bool(flags & FLAG_STOPPED), tuple(buf[offset:offset + layout.floors])))
+            up = tuple(map(bool, buf[layout.requests:layout.requests + layout.floors]))
+            down = tuple(map(bool, buf[layout.requests + layout.floors:layout.size]))
+
+            if self.sequence() == before:
+                self.last = Frame(tick, tuple(cars), up, down)
+                return self.last
+        return self.last
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+
+################################################################################
+
+
+class InputReceiver:
+    """Button edges sent by viewers, as (kind, key, pressed, stamp) datagrams.
+    Stamps are clock() readings, which on Linux all processes share; with
+    `time`, the controller's clock, they are moved onto it by their age."""
+
+    def __init__(self, path, queue, time=None):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.path = path
+        self.queue = queue
+        self.time = time
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        self.sock.setblocking(False)
+
+    def poll(self):
+        while True:
+            try:
+                data = self.sock.recv(INPUT.size)
+            except BlockingIOError:
+                return
+            if len(data) == INPUT.size:
+                kind, key, pressed, stamp = INPUT.unpack(data)
+                if self.time is not None:
+                    stamp = self.time() - (clock() - stamp)
+                self.queue.push(kind, key, bool(pressed), stamp)
+
+    def close(self):
+        self.sock.close()
+        os.unlink(self.path)
+
+
+class InputSender:
+
+    def __init__(self, path):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+    def send(self, kind, key, pressed, stamp):
+        try:
+            self.sock.sendto(INPUT.pack(kind, key, pressed, stamp), self.path)
+        except OSError:
+            pass    # no controller listening, the press is lost like on a dead panel
+
+
+################################################################################
+
+
+def run_controller(args):
+    sim = LiftSimulator(ui=False, config=Config(floors=args.floors, lifts=args.lifts))
+    try:
+        sim.bridge = StateWriter(sim.config, args.name)
+    except FileExistsError as e:
+        sys.exit(e)
+    # Ticked directly, the simulator runs on its own clock
+    receiver = None if args.inputs is None else InputReceiver(args.inputs, sim.inputs, sim.now)
+    driver = None
+    if args.traffic:
+        driver = traffic.TrafficDriver(sim, traffic.generate(
+            random.Random(1), args.floors, traffic.INTERFLOOR, args.traffic, 24 * 3600))
+
+    interval = sim.config.control_interval
+    print('Publishing %d floors, %d lifts as "%s" (%d bytes)' % (args.floors, args.lifts, args.name,
+                                                                 sim.bridge.layout.size))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    started = clock()
+    try:
+        tick = 0
+        while True:
+            if receiver is not None:
+                receiver.poll()
+            if driver is not None:
+                driver.tick()
+            else:
+                sim.control_loop()
+            tick += 1
+            delay = started + tick * interval - clock()
+            if delay > 0:
+                time.sleep(delay)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        sim.bridge.close()
+        if receiver is not None:
+            receiver.close()
+
+
+def run_watch(args):
+    reader = StateReader(args.name)
+    names = {DOORS_CLOSED: 'closed', DOORS_OPENING: 'opening', DOORS_OPEN: 'open', DOORS_CLOSING: 'closing'}
+    arrows = {DIRECTION_UP: '^', DIRECTION_DOWN: 'v'}
+    try:
+        while True:
+            frame = reader.read()
+            if frame is None:
+                time.sleep(0.5)
+                continue
+            cars = '  '.join('%d@%-4g %-7s%s' % (i + 1, car.position, names[car.doors], arrows.get(car.direction, ' '))
+                             for i, car in enumerate(frame.cars))
+            calls = ' '.join('%d%s%s' % (f + 1, '^' if up else '', 'v' if down else '')
+                             for f, (up, down) in enumerate(zip(frame.up, frame.down)) if up or down)
+            print('tick %6d  %s  calls: %s' % (frame.tick, cars, calls or '-'))
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+def run_panel(args):
+    """The Kivy panel as a viewer: renders frames from shared memory and sends
+    its buttons to the controller."""
+    from lift import Lift
+    from kivy.clock import Clock
+
+    reader = StateReader(args.name)
+    sender = InputSender(args.inputs) if args.inputs is not None else None
+    app = Lift(reader.layout.floors, reader.layout.lifts)
+
+    def button(kind):
+        return lambda key, pressed, stamp: sender is not None and sender.send(kind, key, pressed, stamp)
+
+    for i in range(reader.layout.floors):
+        app.register_handler('f_%d' % (i + 1), button(INPUT_HALL), i)
+    for n in range(reader.layout.lifts):
+        app.register_handler('l%d_p' % (n + 1), button(INPUT_CAR), n)
+
+    rendered = [None]
+
+    def render(dt):
+        frame = reader.read()
+        if frame is None or frame.tick == rendered[0]:
+            return
+        for i, car in enumerate(frame.cars):
+            for f, value in enumerate(car.leds):
+                lid = 'l%d_%d' % (i + 1, f + 1)
+                if app.get(lid) != value:
+                    app.set(lid, value)
+            app.set('l%d_d' % (i + 1), car.direction)
+        rendered[0] = frame.tick
+
+    Clock.schedule_interval(render, 1 / 30)
+    try:
+        app.run()
+    finally:
+        reader.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Shared-memory bridge between a lift controller and its viewers.')
+    parser.add_argument('role', choices=('controller', 'watch', 'panel'))
+    parser.add_argument('--name', default=DEFAULT_NAME, help='shared memory block name')
+    parser.add_argument('--inputs', default=None, metavar='PATH', help='Unix socket for viewer button presses')
+    parser.add_argument('-n', '--floors', type=int, default=5)
+    parser.add_argument('-m', '--lifts', type=int, default=2)
+    parser.add_argument('--traffic', type=float, default=0, metavar='RATE',
+                        help='controller: simulated passengers per minute')
+    args = parser.parse_args()
+
+    {'controller': run_controller, 'watch': run_watch, 'panel': run_panel}[args.role](args)
+    sys.exit(0)
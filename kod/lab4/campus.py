@@ -0,0 +1,232 @@
+"""Campus runs: many buildings under passenger traffic, sharded over worker
+processes on one machine.
+
+Every worker simulates its shard of buildings one after the other and puts a
+summary of each on a shared queue as soon as it is done. The coordinator
+merges the summaries as they come in; waiting and journey times are merged
+as histograms, so percentiles over the whole campus come out without
+shipping individual passengers around.
+
+Usage: python campus.py [--buildings 24] [-j JOBS] [--floors 8 40] [--lifts 2 8]
+                        [--pattern up-peak] [--rate 20] [--duration 1800]
+                        [--motion] [--seed 1]
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import random
+import time
+
+import traffic
+import zones as zoning
+from lab4 import Config
+from motion import MotionProfile
+
+
+HISTOGRAM_BIN = 5       # seconds
+HISTOGRAM_BINS = 240    # the last bin takes everything over 20 minutes
+
+DONE = None
+
+################################################################################
+
+
+class Building:
+    """What a worker needs to simulate a building; plain data, so that it
+    pickles cheaply."""
+
+    def __init__(self, name, floors, lifts, zones, pattern, rate, duration, seed, motion=False):
+        self.name = name
+        self.floors = floors
+        self.lifts = lifts
+        self.zones = zones
+        self.pattern = pattern
+        self.rate = rate
+        self.duration = duration
+        self.seed = seed
+        self.motion = motion
+
+    def config(self):
+        return Config(floors=self.floors, lifts=self.lifts, zones=zoning.PRESETS[self.zones](self.floors, self.lifts),
+                      motion=MotionProfile() if self.motion else None)
+
+    def __repr__(self):
+        return '<Building %s: %d floors, %d lifts, %s>' % (self.name, self.floors, self.lifts, self.zones)
+
+
+def histogram(values):
+    counts = [0] * HISTOGRAM_BINS
+    for value in values:
+        counts[min(int(value / HISTOGRAM_BIN), HISTOGRAM_BINS - 1)] += 1
+    return counts
+
+
+def summarize(building, driver, wall):
+    delivered = driver.delivered
+    return {
+        'building': building.name,
+        'delivered': len(delivered),
+        'waiting': sum(len(queue) for queues in driver.waiting for queue in queues),
+        'riding': sum(len(riding) for riding in driver.riding),
+        'wait_sum': sum(p.boarded - p.arrival for p in delivered),
+        'journey_sum': sum(p.delivered - p.arrival for p in delivered),
+        'wait_histogram': histogram(p.boarded - p.arrival for p in delivered),
+        'journey_histogram': histogram(p.delivered - p.arrival for p in delivered),
+        'distance': sum(elevator.odometer.distance for elevator in driver.sim.elevators),
+        'starts': sum(elevator.odometer.starts for elevator in driver.sim.elevators),
+        'energy': sum(elevator.odometer.energy for elevator in driver.sim.elevators),
+        'simulated': driver.now,
+        'wall': wall,
+    }
+
+
+def worker(shard, results):
+    """Simulates a shard of buildings, one summary per building, then DONE.
+    A failing building is reported as an error and does not stop the shard."""
+    for building in shard:
+        try:
+            driver, wall = traffic.simulate(building.config(), building.pattern, building.rate,
+                                            building.duration, building.seed)
+            results.put(summarize(building, driver, wall))
+        except Exception as e:
+            results.put({'building': building.name, 'error': '%s: %s' % (type(e).__name__, e)})
+    results.put(DONE)
+
+
+################################################################################
+
+
+class CampusSummary:
+    """Incremental merge of building summaries."""
+
+    SUMS = ('delivered', 'waiting', 'riding', 'wait_sum', 'journey_sum', 'distance', 'starts', 'energy',
+            'simulated', 'wall')
+
+    def __init__(self):
+        self.buildings = 0
+        self.errors = []
+        self.totals = dict.fromkeys(CampusSummary.SUMS, 0)
+        self.wait_histogram = [0] * HISTOGRAM_BINS
+        self.journey_histogram = [0] * HISTOGRAM_BINS
+
+    def merge(self, summary):
+        if 'error' in summary:
+            self.errors.append((summary['building'], summary['error']))
+            return
+        self.buildings += 1
+        for key in CampusSummary.SUMS:
+            self.totals[key] += summary[key]
+        for i, count in enumerate(summary['wait_histogram']):
+            self.wait_histogram[i] += count
+        for i, count in enumerate(summary['journey_histogram']):
+            self.journey_histogram[i] += count
+
+    def mean_wait(self):
+        return self.totals['wait_sum'] / self.totals['delivered'] if self.totals['delivered'] else 0
+
+    def mean_journey(self):
+        return self.totals['journey_sum'] / self.totals['delivered'] if self.totals['delivered'] else 0
+
+    @staticmethod
+    def percentile(counts, q):
+        """Upper edge of the bin holding the q-th quantile."""
+        total = sum(counts)
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if total and seen >= q * total:
+                return (i + 1) * HISTOGRAM_BIN
+        return 0
+
+
+def run(buildings, jobs, progress=None):
+    """Simulates the buildings on `jobs` worker processes, returns the merged
+    CampusSummary. `progress(summary, campus)` is called on every arrival."""
+    jobs = max(1, min(jobs, len(buildings)))
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker, args=(buildings[i::jobs], results), daemon=True)
+               for i in range(jobs)]
+    for process in workers:
+        process.start()
+
+    campus = CampusSummary()
+    running = jobs
+    while running:
+        try:
+            summary = results.get(timeout=1)
+        except queue.Empty:
+            if not any(process.is_alive() for process in workers):
+                campus.errors.append((None, 'workers exited without finishing their shards'))
+                break
+            continue
+
+        if summary is DONE:
+            running -= 1
+            continue
+        campus.merge(summary)
+        if progress is not None:
+            progress(summary, campus)
+
+    for process in workers:
+        process.join()
+    return campus
+
+
+def generate(rng, count, floors, lifts, pattern, rate, duration, motion):
+    """A campus of `count` random buildings, sizes drawn from the given
+    (low, high) ranges, each with a zoning preset that fits it."""
+    buildings = []
+    for i in range(count):
+        n, m = rng.randint(*floors), rng.randint(*lifts)
+        presets = ['single'] + (['banks', 'shuttle'] if m >= 2 else [])
+        buildings.append(Building('B%02d' % (i + 1), n, m, rng.choice(presets), pattern, rate, duration,
+                                  rng.randrange(1 << 30), motion))
+    return buildings
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parallel campus simulation.')
+    parser.add_argument('--buildings', type=int, default=24)
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes (default: all cores)')
+    parser.add_argument('--floors', type=int, nargs=2, default=(8, 40), metavar=('LOW', 'HIGH'))
+    parser.add_argument('--lifts', type=int, nargs=2, default=(2, 8), metavar=('LOW', 'HIGH'))
+    parser.add_argument('--pattern', choices=traffic.PATTERNS, default=traffic.UP_PEAK)
+    parser.add_argument('--rate', type=float, default=20, help='arrivals per minute and building')
+    parser.add_argument('--duration', type=float, default=1800, help='simulated seconds')
+    parser.add_argument('--motion', action='store_true', help='jerk-limited trips instead of half-floor steps')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    buildings = generate(random.Random(args.seed), args.buildings, args.floors, args.lifts,
+                         args.pattern, args.rate, args.duration, args.motion)
+    specs = {building.name: building for building in buildings}
+
+    def progress(summary, campus):
+        if 'error' in summary:
+            print('ERROR %s: %s' % (summary['building'], summary['error']))
+            return
+        print('%3d/%d %-4s %-32s %5d delivered, wait avg %6.1fs (campus: %6.1fs)' %
+              (campus.buildings + len(campus.errors), len(buildings), summary['building'],
+               specs[summary['building']], summary['delivered'],
+               summary['wait_sum'] / summary['delivered'] if summary['delivered'] else 0, campus.mean_wait()))
+
+    started = time.perf_counter()
+    campus = run(buildings, args.jobs, progress)
+    elapsed = time.perf_counter() - started
+
+    totals = campus.totals
+    print('%d buildings in %.2fs on %d workers (%.1fs of simulation work, %.0f simulated seconds per second)' %
+          (campus.buildings, elapsed, min(args.jobs, len(buildings)), totals['wall'], totals['simulated'] / elapsed))
+    print('delivered %d, left waiting %d, riding %d' % (totals['delivered'], totals['waiting'], totals['riding']))
+    print('wait avg %.1fs, p50 <= %ds, p90 <= %ds; journey avg %.1fs, p90 <= %ds' %
+          (campus.mean_wait(), campus.percentile(campus.wait_histogram, 0.5),
+           campus.percentile(campus.wait_histogram, 0.9), campus.mean_journey(),
+           campus.percentile(campus.journey_histogram, 0.9)))
+    print('lifts travelled %.1f km in %d starts, %.1f MJ' %
+          (totals['distance'] / 1000, totals['starts'], totals['energy'] / 1e6))
+    if campus.errors:
+        print('%d buildings failed' % len(campus.errors))
@@ -0,0 +1,9 @@
+DIRECTION_NONE = -1
+DIRECTION_UP = 0
+DIRECTION_DOWN = 1
+
+STATE_FAR = 0
+STATE_NEAR = 1
+STATE_AT_CLOSED = 2
+STATE_AT_CHANGING = 3
+STATE_AT_OPEN = 4
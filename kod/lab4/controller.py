@@ -0,0 +1,57 @@
+"""Runs a LiftSimulator's control loop on a thread of its own.
+
+The UI thread and the controller share exactly two things, neither of them
+locked:
+
+    - sim.inputs, the InputQueue the button handlers append raw edges to
+      and the controller drains (a deque, safe for one producer and one
+      consumer)
+
+    - sim.view, an immutable snapshot of everything the panel shows. The
+      controller builds a new one at the end of each tick and swaps the
+      reference; the UI renders whichever one is current on its own clock.
+      A view is never modified once published, so the reader can't see a
+      half-written one and no second buffer is needed.
+
+A slow redraw thus only delays the next render, and a slow tick only delays
+the next view.
+"""
+import threading
+
+from inputs import clock
+
+
+RENDER_INTERVAL = 1 / 30
+
+################################################################################
+
+
+class ControllerThread(threading.Thread):
+
+    def __init__(self, sim, on_error=None):
+        super().__init__(name='controller', daemon=True)
+        self.sim = sim
+        self.on_error = on_error
+        self.error = None
+        self.stopping = threading.Event()
+
+    def run(self):
+        sim = self.sim
+        interval = sim.config.control_interval
+        try:
+            while not self.stopping.is_set():
+                sim.advance(clock())
+                delay = sim.first_deadline + sim.deadline * interval - clock()
+                if delay > 0:
+                    self.stopping.wait(delay)
+        except BaseException as e:
+            # Including the SystemExit of sim._die, which would otherwise
+            # only end this thread
+            self.error = e
+            if self.on_error is not None:
+                self.on_error(e)
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
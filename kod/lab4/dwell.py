@@ -0,0 +1,48 @@
+"""Adaptive door dwell times.
+
+With a fixed OPEN time every stop costs the same, whether a crowd boards or
+nobody does. A DwellPolicy sizes the OPEN phase from what the controller
+knows when the doors open:
+
+    - whether the stop serves a hall call (someone waits to board), and how
+      much of the building's hall traffic this floor has seen, as a guess at
+      how many
+    - whether it serves a car call (someone gets off)
+
+A stop for neither (a lift parking with its doors open) gets the minimum.
+The defaults keep most stops shorter than the fixed OPEN time and only a
+busy floor longer.
+
+With reopen set, a lift closing its doors opens them again, from wherever
+they are, for a car call to its floor or for a hall call there in its
+direction, instead of leaving the call to the next lift. A stop reopens at
+most `max_reopens` times, so a stream of arrivals cannot hold a lift for
+ever. It is off by default: in traffic.py, under heavy interfloor traffic
+the held lifts cost more than the passengers picked up save.
+"""
+
+
+class DwellPolicy:
+
+    def __init__(self, minimum=1.0, boarding=0.5, alighting=0.5, crowd=2.0, maximum=4.0,
+                 reopen=False, max_reopens=1):
+        self.minimum = minimum
+        self.boarding = boarding
+        self.alighting = alighting
+        self.crowd = crowd
+        self.maximum = maximum
+        self.reopen = reopen
+        self.max_reopens = max_reopens
+
+    def open_time(self, hall_call, car_call, share):
+        """Seconds the doors stay open; `share` is the fraction of all hall
+        calls so far made at this floor."""
+        t = self.minimum
+        if hall_call:
+            t += self.boarding + self.crowd * share
+        if car_call:
+            t += self.alighting
+        return min(t, self.maximum)
+
+    def __repr__(self):
+        return '<DwellPolicy %g-%gs>' % (self.minimum, self.maximum)
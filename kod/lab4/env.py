@@ -0,0 +1,200 @@
+"""Reset/step environments for learning and evaluating dispatch policies on
+the headless LiftSimulator, with passengers from traffic.py.
+
+A step runs `decision_ticks` control ticks. Before them, the action assigns
+hall calls to cars: an int array of shape (2, floors), indexed by direction
+and floor, holding a car for each call or -1. Only pending calls that no car
+holds yet are assigned, and only to a candidate car that is in service and
+not STOPped; anything else in the action is ignored. With greedy=True the
+built-in dispatcher assigns the calls the policy leaves alone, with
+greedy=False calls wait until the policy assigns them.
+
+Observations are dicts of numpy arrays:
+
+    position   float32 (lifts,)          floors from 0, halves while moving
+    direction  int8 (lifts,)             DIRECTION_UP/DOWN/NONE
+    doors      int8 (lifts,)             DOORS_*
+    load       int16 (lifts,)            passengers riding
+    calls      int8 (2, floors)          pending hall calls
+    assigned   int8 (2, floors)          car holding each call, -1 for none
+    waiting    int16 (2, floors)         passengers waiting per call
+
+The reward is minus the passenger seconds spent waiting for a lift during the
+step. An episode ends after `duration` simulated seconds.
+
+VectorEnv steps many environments in one call, with a leading axis on every
+array, and resets finished ones on the spot.
+
+Usage: python env.py [-n 16] [-m 4] [--pattern up-peak] [--rate 30]
+                     [--envs 16] [--steps 20000] [--decision-ticks 1]
+"""
+import argparse
+import random
+import time
+
+import numpy
+
+import traffic
+import zones as zoning
+from lab4 import *
+
+
+OBSERVATION_KEYS = ('position', 'direction', 'doors', 'load', 'calls', 'assigned', 'waiting')
+
+################################################################################
+
+
+class LiftEnv:
+
+    def __init__(self, config, pattern=traffic.UP_PEAK, rate=30, duration=1800, seed=1,
+                 decision_ticks=1, greedy=True):
+        self.config = config
+        self.pattern = pattern
+        self.rate = rate
+        self.duration = duration
+        self.decision_ticks = decision_ticks
+        self.greedy = greedy
+        self.rng = random.Random(seed)
+
+        self.sim = None
+        self.driver = None
+        self.episodes = 0
+
+    def reset(self):
+        self.sim = LiftSimulator(ui=False, config=self.config)
+        if not self.greedy:
+            self.sim.assign_requests = lambda: None
+        self.driver = traffic.TrafficDriver(self.sim, traffic.generate(self.rng, self.config.floors, self.pattern,
+                                                                       self.rate, self.duration))
+        self.episodes += 1
+        return self.observe()
+
+    def step(self, action):
+        """Returns (observation, reward, done, info)."""
+        sim, driver = self.sim, self.driver
+        if action is not None:
+            self.apply(action)
+
+        interval = self.config.control_interval
+        waited = 0
+        for _ in range(self.decision_ticks):
+            driver.tick()
+            waited += sum(len(queue) for queues in driver.waiting for queue in queues) * interval
+
+        done = driver.now >= self.duration
+        return self.observe(), -waited, done, {'delivered': len(driver.delivered), 'time': driver.now}
+
+    def apply(self, action):
+        sim = self.sim
+        action = numpy.asarray(action)
+        for d, floor in zip(*numpy.nonzero(action >= 0)):
+            d, floor, car = int(d), int(floor), int(action[d, floor])
+            if not sim.requests[d][floor] or car >= self.config.lifts:
+                continue
+            if any(elevator.assigned_requests[d][floor] for elevator in sim.candidates[floor]):
+                continue
+            elevator = sim.elevators[car]
+            if elevator not in sim.candidates[floor]:
+                continue
+            if elevator.in_service and not elevator.stopped and not elevator.pending_stop:
+                sim.assign(elevator, d, floor)
+
+    def observe(self):
+        sim, driver = self.sim, self.driver
+        n = self.config.floors
+        elevators = sim.elevators
+
+        assigned = numpy.full((2, n), -1, dtype=numpy.int8)
+        for elevator in elevators:
+            for d in (DIRECTION_UP, DIRECTION_DOWN):
+                held = elevator.assigned_requests[d]
+                if True in held:
+                    assigned[d][numpy.array(held, dtype=bool)] = elevator.id
+
+        return {
+            'position': numpy.array([elevator.position for elevator in elevators], dtype=numpy.float32),
+            'direction': numpy.array([elevator.direction for elevator in elevators], dtype=numpy.int8),
+            'doors': numpy.array([elevator.doors for elevator in elevators], dtype=numpy.int8),
+            'load': numpy.array([len(riding) for riding in driver.riding], dtype=numpy.int16),
+            'calls': numpy.array(sim.requests, dtype=numpy.int8),
+            'assigned': assigned,
+            'waiting': numpy.array([[len(driver.waiting[floor][d]) for floor in range(n)] for d in range(2)],
+                                   dtype=numpy.int16),
+        }
+
+
+class VectorEnv:
+    """Steps a list of environments together. Finished environments are reset
+    within the step; their last observation is in info['final'] then."""
+
+    def __init__(self, envs):
+        self.envs = envs
+
+    def reset(self):
+        return self.stack([env.reset() for env in self.envs])
+
+    def step(self, actions):
+        observations, rewards, dones, infos = [], numpy.zeros(len(self.envs)), numpy.zeros(len(self.envs), bool), []
+        for i, env in enumerate(self.envs):
+            observation, rewards[i], dones[i], info = env.step(None if actions is None else actions[i])
+            if dones[i]:
+                info['final'] = observation
+                observation = env.reset()
+            observations.append(observation)
+            infos.append(info)
+        return self.stack(observations), rewards, dones, infos
+
+    @staticmethod
+    def stack(observations):
+        return {key: numpy.stack([observation[key] for observation in observations]) for key in OBSERVATION_KEYS}
+
+
+def nearest_car(observations):
+    """A baseline policy for VectorEnv: every unassigned call goes to the
+    nearest car, whichever way it is heading, but not to a car closing its
+    doors at that floor, which would open them again for ever as long as
+    passengers keep coming."""
+    calls = (observations['calls'] == 1) & (observations['assigned'] < 0)
+    floors = numpy.arange(calls.shape[2], dtype=numpy.float32)
+    distance = numpy.abs(observations['position'][:, :, None] - floors[None, None, :])
+    leaving = numpy.isin(observations['doors'], (DOORS_OPEN, DOORS_CLOSING))[:, :, None] & (distance == 0)
+    nearest = numpy.where(leaving, numpy.inf, distance).argmin(axis=1)
+    return numpy.where(calls, nearest[:, None, :], -1)
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Step rate of vectorised lift environments.')
+    parser.add_argument('-n', type=int, default=16, help='number of floors')
+    parser.add_argument('-m', type=int, default=4, help='number of lifts')
+    parser.add_argument('--pattern', choices=traffic.PATTERNS, default=traffic.UP_PEAK)
+    parser.add_argument('--rate', type=float, default=30, help='arrivals per minute')
+    parser.add_argument('--duration', type=float, default=1800, help='episode length in simulated seconds')
+    parser.add_argument('--zones', choices=sorted(zoning.PRESETS), default='single')
+    parser.add_argument('--envs', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=20000, help='environment steps in total')
+    parser.add_argument('--decision-ticks', type=int, default=1)
+    parser.add_argument('--policy', choices=('greedy', 'nearest'), default='greedy')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    config = Config(floors=args.n, lifts=args.m, zones=zoning.PRESETS[args.zones](args.n, args.m))
+    envs = VectorEnv([LiftEnv(config, args.pattern, args.rate, args.duration, args.seed + i,
+                              args.decision_ticks, greedy=args.policy == 'greedy') for i in range(args.envs)])
+
+    observations = envs.reset()
+    total = 0
+    started = time.perf_counter()
+    for _ in range(max(1, args.steps // args.envs)):
+        actions = None if args.policy == 'greedy' else nearest_car(observations)
+        observations, rewards, dones, infos = envs.step(actions)
+        total += rewards.sum()
+    elapsed = time.perf_counter() - started
+
+    steps = max(1, args.steps // args.envs) * args.envs
+    print('%d steps of %d environments in %.2fs: %.0f steps/s, %.0f simulated seconds/s' %
+          (steps, args.envs, elapsed, steps / elapsed,
+           steps * args.decision_ticks * config.control_interval / elapsed))
+    print('reward per step %.2f, delivered %d' % (total / steps, sum(info['delivered'] for info in infos)))
@@ -0,0 +1,284 @@
+"""Breadth-first exploration of the lift controller's reachable states.
+
+The headless LiftSimulator is treated as a transition system whose labels
+are discrete inputs (hall calls, car calls, STOP presses, at most `budget` of
+them per trace) and `run`, which ticks the control loop until something other
+than a timer changes. Every state reached is checked against a set of
+invariants; since the search is breadth-first, every distinct violation is
+reported with a shortest trace leading to it.
+
+States are compared by their exact snapshot, call statistics and timers
+included: two states are only merged when every input leads them to the same
+successor. Keys are stored marshalled, and every state is expanded exactly
+once. Transitions do not depend on the remaining input budget and are
+memoized across it.
+
+Usage: python explore.py [-n 5] [-m 2] [--budget 3] [--max-states 2000000]
+"""
+import argparse
+import marshal
+import sys
+import time
+from collections import deque
+
+from lab4 import *
+
+
+MAX_RUN_TICKS = 10000
+
+RUN = ('run', None, None)
+
+################################################################################
+
+
+class Violation(Exception):
+    pass
+
+
+def _raise(msg):
+    raise Violation(msg)
+
+
+def untimed(snapshot):
+    return snapshot[:4] + (tuple(e[:-1] for e in snapshot[4]),)
+
+
+class Explorer:
+
+    def __init__(self, n, m, budget):
+        self.n, self.m = n, m
+        self.budget = budget
+
+        self.sim = LiftSimulator(ui=False, config=Config(floors=n, lifts=m))
+        self.interval = self.sim.config.control_interval
+        self.sim._die = _raise
+        for elevator in self.sim.elevators:
+            elevator._die = _raise
+
+        self.labels = ([('hall', d, f) for d in (DIRECTION_UP, DIRECTION_DOWN) for f in range(n)] +
+                       [('car', e, f) for e in range(m) for f in range(n)] +
+                       [('stop', e, None) for e in range(m)])
+
+        self.parents = {}
+        self.memo = {}
+        self.memo_hits = 0
+        self.expanded = 0
+        self.transitions = 0
+
+    # Transitions
+
+    def apply(self, label):
+        """Applies an input to the current simulator state, returns False if
+        it would not change anything."""
+        kind, a, b = label
+        sim = self.sim
+        if kind == 'hall':
+            if sim.requests[a][b]:
+                return False
+            sim.handle_event(Event(EVENT_HALL_UP if a == DIRECTION_UP else EVENT_HALL_DOWN, b, None, 0))
+        elif kind == 'car':
+            if sim.elevators[a].internal_requests[b]:
+                return False
+            sim.handle_event(Event(EVENT_CAR_CALL, a, b, 0))
+        else:
+            sim.handle_event(Event(EVENT_STOP, a, None, 0))
+        sim.control_loop()
+        return True
+
+    def run(self):
+        """Ticks until something other than a timer changes; returns False if
+        the simulator is quiescent."""
+        sim = self.sim
+        before = untimed(sim.snapshot())
+        for _ in range(MAX_RUN_TICKS):
+            quiescent = all(elevator.next_event is None for elevator in sim.elevators)
+            sim.control_loop()
+            if untimed(sim.snapshot()) != before:
+                return True
+            if quiescent:
+                return False
+            self.fast_forward()
+        raise Violation('No progress in %d ticks' % MAX_RUN_TICKS)
+
+    def fast_forward(self):
+        """Skips the ticks of a stable state that only count timers down,
+        stopping one tick before the earliest timer fires. Timers are counted
+        down the same way control_loop does, so they fire on the same tick."""
+        timers = [e.next_event_time for e in self.sim.elevators if e.next_event_time is not None]
+        if not timers:
+            return
+
+        ticks = MAX_RUN_TICKS
+        for t in timers:
+            k = 1
+            while t - self.interval > 0:
+                t -= self.interval
+                k += 1
+            ticks = min(ticks, k)
+
+        for elevator in self.sim.elevators:
+            for _ in range(ticks - 1):
+                if elevator.next_event_time is not None:
+                    elevator.next_event_time -= self.interval
+
+    def step(self, snapshot, phys_key, label):
+        """Memoized transition: (changed, next snapshot, violation). The
+        result does not depend on the remaining input budget, so states that
+        only differ in it share their transitions."""
+        memo_key = (phys_key, label)
+        if memo_key in self.memo:
+            self.memo_hits += 1
+            return self.memo[memo_key]
+
+        self.sim.restore(snapshot)
+        try:
+            if label[0] == 'run':
+                changed = self.run()
+                self.check(quiescent=not changed)
+            else:
+                changed = self.apply(label)
+                if changed:
+                    self.check(quiescent=False)
+            result = (changed, self.sim.snapshot() if changed else None, None)
+        except Violation as e:
+            result = (False, None, str(e))
+
+        self.memo[memo_key] = result
+        return result
+
+    # State encoding
+
+    @staticmethod
+    def key(snapshot):
+        """The snapshot itself: anything coarser, such as the ranking of the
+        call counts or timers in whole ticks, merges states whose successors
+        differ, and the memoized transitions of one would be replayed for the
+        other."""
+        return marshal.dumps(snapshot)
+
+    # Invariants
+
+    def check(self, quiescent):
+        sim = self.sim
+        for elevator in sim.elevators:
+            if not 0 <= elevator.position <= self.n - 1:
+                raise Violation('Lift %d outside the shaft at %.1f' % (elevator.id + 1, elevator.position))
+            if elevator.state == LIFT_MOVING and elevator.doors != DOORS_CLOSED:
+                raise Violation('Lift %d moving with doors not closed' % (elevator.id + 1))
+            if elevator.doors != DOORS_CLOSED and not integer(elevator.position):
+                raise Violation('Lift %d has doors open between floors' % (elevator.id + 1))
+            for d in (DIRECTION_UP, DIRECTION_DOWN):
+                for f in range(self.n):
+                    if elevator.assigned_requests[d][f] and not sim.requests[d][f]:
+                        raise Violation('Lift %d assigned to a cleared call %s' % (elevator.id + 1, call_name(d, f)))
+            sim.led_states(elevator)
+
+        for d in (DIRECTION_UP, DIRECTION_DOWN):
+            for f in range(self.n):
+                if sum(elevator.assigned_requests[d][f] for elevator in sim.elevators) > 1:
+                    raise Violation('Call %s assigned to several lifts' % call_name(d, f))
+
+        if quiescent:
+            for d in (DIRECTION_UP, DIRECTION_DOWN):
+                for f in range(self.n):
+                    if sim.requests[d][f] and not any(e.stopped for e in sim.elevators):
+                        raise Violation('Call %s left unserved' % call_name(d, f))
+            for elevator in sim.elevators:
+                if any(elevator.internal_requests) and not elevator.stopped:
+                    raise Violation('Lift %d left car calls unserved' % (elevator.id + 1))
+
+    # Search
+
+    def explore(self, max_states):
+        """Returns {violation: shortest trace} and whether the search was cut
+        short by max_states. States violating an invariant are not expanded."""
+        self.sim.control_loop()
+        snapshot = self.sim.snapshot()
+        phys_key = self.key(snapshot)
+        self.parents[(phys_key, self.budget)] = (None, None)
+
+        violations = {}
+        queue = deque([(snapshot, phys_key, self.budget)])
+        while queue:
+            snapshot, phys_key, budget = queue.popleft()
+            self.expanded += 1
+
+            for label in self.labels if budget > 0 else ():
+                self._expand(snapshot, phys_key, budget, label, budget - 1, queue, violations)
+            self._expand(snapshot, phys_key, budget, RUN, budget, queue, violations)
+
+            if len(self.parents) >= max_states:
+                return violations, True
+        return violations, False
+
+    def _expand(self, snapshot, phys_key, budget, label, next_budget, queue, violations):
+        changed, next_snapshot, violation = self.step(snapshot, phys_key, label)
+        if violation is not None:
+            if violation not in violations:
+                violations[violation] = self.trace((phys_key, budget)) + [label]
+            return
+        if not changed:
+            return
+
+        self.transitions += 1
+        next_phys_key = self.key(next_snapshot)
+        if (next_phys_key, next_budget) not in self.parents:
+            self.parents[(next_phys_key, next_budget)] = ((phys_key, budget), label)
+            queue.append((next_snapshot, next_phys_key, next_budget))
+
+    def trace(self, key):
+        labels = []
+        parent, label = self.parents[key]
+        while parent is not None:
+            labels.append(label)
+            parent, label = self.parents[parent]
+        return labels[::-1]
+
+
+def call_name(d, floor):
+    return '%d %s' % (floor + 1, 'UP' if d == DIRECTION_UP else 'DOWN')
+
+
+def format_label(label):
+    kind, a, b = label
+    if kind == 'hall':
+        return 'hall %s' % call_name(a, b)
+    elif kind == 'car':
+        return 'car%d floor %d' % (a + 1, b + 1)
+    elif kind == 'stop':
+        return 'stop car%d' % (a + 1)
+    return 'run'
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exhaustive state-space explorer for the lift controller.')
+    parser.add_argument('-n', type=int, default=5, help='number of floors')
+    parser.add_argument('-m', type=int, default=2, help='number of lifts')
+    parser.add_argument('--budget', type=int, default=3, help='inputs per trace')
+    parser.add_argument('--max-states', type=int, default=2000000)
+    args = parser.parse_args()
+
+    explorer = Explorer(args.n, args.m, args.budget)
+    started = time.perf_counter()
+    violations, truncated = explorer.explore(args.max_states)
+    elapsed = time.perf_counter() - started
+
+    print('%d states, %d expanded, %d transitions (%d memoized) in %.1fs%s' %
+          (len(explorer.parents), explorer.expanded, explorer.transitions, explorer.memo_hits, elapsed,
+           ', INCOMPLETE (state limit reached)' if truncated else ''))
+    for violation, trace in violations.items():
+        print('INVARIANT VIOLATED: %s' % violation)
+        steps = []
+        for label in trace:
+            if steps and label == RUN and steps[-1][0] == RUN:
+                steps[-1][1] += 1
+            else:
+                steps.append([label, 1])
+        for i, (label, count) in enumerate(steps):
+            print('  %2d. %s' % (i + 1, format_label(label) + (' x%d' % count if count > 1 else '')))
+    if not violations:
+        print('No violations.')
+    sys.exit(1 if violations else 2 if truncated else 0)
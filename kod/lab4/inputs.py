@@ -0,0 +1,146 @@
+import time
+from collections import deque, namedtuple
+
+
+clock = time.perf_counter
+
+INPUT_HALL = 0
+INPUT_CAR = 1
+
+EVENT_HALL_UP = 0
+EVENT_HALL_DOWN = 1
+EVENT_CAR_CALL = 2
+EVENT_STOP = 3
+
+HALL_LONG_PRESS = 0.5
+CAR_LONG_PRESS = 1
+CAR_CLICK_TIMEOUT = 1
+
+# Hall presses each floor button, and calls each car may make to one floor,
+# in a burst, and at what rate per second they come back; presses over the
+# limit are dropped with their releases, car calls over it as a whole click
+# sequence
+HALL_BURST = 3
+HALL_RATE = 2
+CAR_BURST = 3
+CAR_RATE = 0.2
+
+RawInput = namedtuple('RawInput', 'kind key pressed stamp')
+Event = namedtuple('Event', 'type key value stamp')
+
+################################################################################
+
+
+class InputQueue:
+    """Raw button edges, stamped at capture. A deque is safe to append to from
+    one thread and pop from another without taking a lock."""
+
+    def __init__(self):
+        self.items = deque()
+
+    def push(self, kind, key, pressed, stamp=None):
+        self.items.append(RawInput(kind, key, pressed, clock() if stamp is None else stamp))
+
+    def drain(self):
+        items = self.items
+        drained = []
+        while items:
+            drained.append(items.popleft())
+        return drained
+
+    def __len__(self):
+        return len(self.items)
+
+
+class InputClassifier:
+    """Turns press/release pairs into semantic events:
+
+        - a hall button released within HALL_LONG_PRESS is an UP call,
+          a longer press is a DOWN call (key = floor)
+
+        - car button clicks shorter than CAR_LONG_PRESS are counted and,
+          CAR_CLICK_TIMEOUT after the last one, reported as a call to floor
+          (count - 1) (key = car, value = floor)
+
+        - a long car button press is a STOP (key = car)
+
+    Every button is rate limited by a token bucket: a hall button by its
+    presses, HALL_RATE per second after a burst of HALL_BURST, a car button by
+    the calls its click sequences make to each floor, CAR_RATE per second
+    after a burst of CAR_BURST. Riders sharing a car pick different floors
+    without taking from each other's budget; only repeating one floor is
+    limited. Single clicks are never dropped, as that would turn a call into
+    one for a lower floor; a sequence over the limit is dropped as a whole.
+    A stuck or spammed button thus costs a bounded number of events however
+    many edges it produces.
+
+    It only looks at the stamps, so it gives the same result for a synthetic
+    event stream as for a live one.
+    """
+
+    def __init__(self, num_floors, num_cars):
+        self.num_floors = num_floors
+        self.hall_pressed = [None] * num_floors
+        self.car_pressed = [None] * num_cars
+        self.car_clicks = [0] * num_cars
+        self.car_last_click = [None] * num_cars
+
+        self.hall_tokens = [(HALL_BURST, None)] * num_floors
+        self.car_tokens = [[(CAR_BURST, None)] * num_floors for _ in range(num_cars)]
+        self.dropped = 0
+
+    def classify(self, inputs, now):
+        events = []
+        for raw in inputs:
+            self.feed(raw, events)
+        self.poll(now, events)
+        return events
+
+    def feed(self, raw, events):
+        if raw.kind == INPUT_HALL:
+            self._feed_hall(raw, events)
+        elif raw.kind == INPUT_CAR:
+            self._feed_car(raw, events)
+
+    def poll(self, now, events):
+        for car, last_click in enumerate(self.car_last_click):
+            if last_click is not None and now - last_click >= CAR_CLICK_TIMEOUT:
+                floor = self.car_clicks[car] - 1
+                self.car_clicks[car] = 0
+                self.car_last_click[car] = None
+                if floor < self.num_floors and self._admit(self.car_tokens[car], floor, last_click, CAR_BURST, CAR_RATE):
+                    events.append(Event(EVENT_CAR_CALL, car, floor, last_click + CAR_CLICK_TIMEOUT))
+
+    def _admit(self, tokens, key, stamp, burst, rate):
+        available, last = tokens[key]
+        if last is not None:
+            available = min(burst, available + (stamp - last) * rate)
+        if available < 1:
+            self.dropped += 1
+            tokens[key] = (available, stamp)
+            return False
+        tokens[key] = (available - 1, stamp)
+        return True
+
+    def _feed_hall(self, raw, events):
+        floor = raw.key
+        if raw.pressed:
+            if self._admit(self.hall_tokens, floor, raw.stamp, HALL_BURST, HALL_RATE):
+                self.hall_pressed[floor] = raw.stamp
+        elif self.hall_pressed[floor] is not None:
+            dt = raw.stamp - self.hall_pressed[floor]
+            self.hall_pressed[floor] = None
+            events.append(Event(EVENT_HALL_UP if dt < HALL_LONG_PRESS else EVENT_HALL_DOWN, floor, None, raw.stamp))
+
+    def _feed_car(self, raw, events):
+        car = raw.key
+        if raw.pressed:
+            self.car_pressed[car] = raw.stamp
+        elif self.car_pressed[car] is not None:
+            dt = raw.stamp - self.car_pressed[car]
+            self.car_pressed[car] = None
+            if dt < CAR_LONG_PRESS:
+                self.car_clicks[car] += 1
+                self.car_last_click[car] = raw.stamp
+            else:
+                events.append(Event(EVENT_STOP, car, None, raw.stamp))
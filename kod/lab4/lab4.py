@@ -1,13 +1,15 @@
+import argparse
 import sys
 import time
 
-from kivy.clock import Clock
-
-from lift import *
+from inputs import *
+from constants import *
+import zones as zoning
+from motion import MotionProfile, Odometer
+import tracefile
 
 
 DEBUG_MODE = False
-_START_TIME = None
 
 OO = 100000
 
@@ -15,6 +17,9 @@ N = 5
 M = 2
 
 CONTROL_INTERVAL = 0.1
+# How far past its deadline, in control intervals, a tick may run before it
+# counts as missed
+LATE_TOLERANCE = 0.5
 
 LIFT_STOPPED = 0
 LIFT_MOVING = 1
@@ -33,6 +38,32 @@ ACTION_TIMES = {
     'MOVE': 2       # 5
 }
 
+# Used for energy estimates of lifts moving in half-floor steps
+DEFAULT_MOTION = MotionProfile()
+
+################################################################################
+
+
+class Config:
+    """Parameters of one simulated building, so that simulators of different
+    buildings can live side by side. Unset parameters take the module
+    defaults above; zones default to a single zone, lifts without a motion
+    profile move in half-floor steps and without a dwell.DwellPolicy keep
+    their doors open for OPEN at every stop."""
+
+    def __init__(self, floors=N, lifts=M, action_times=None, control_interval=CONTROL_INTERVAL,
+                 zones=None, motion=None, dwell=None):
+        self.floors = floors
+        self.lifts = lifts
+        self.action_times = dict(ACTION_TIMES, **(action_times or {}))
+        self.control_interval = control_interval
+        self.zones = zoning.single(floors, lifts) if zones is None else zones
+        self.motion = motion
+        self.dwell = dwell
+
+    def __repr__(self):
+        return '<Config %d floors, %d lifts>' % (self.floors, self.lifts)
+
 ################################################################################
 
 
@@ -44,12 +75,37 @@ def other(x):
     return OTHER_DIR[x]
 
 
+def floors(flags):
+    return [i for i, flag in enumerate(flags) if flag]
+
+
+def _exit(msg):
+    print(msg)
+    sys.exit(1)
+
+
 ################################################################################
 
 
 class Elevator:
 
-    def __init__(self, i, global_requests):
+    __slots__ = ('id', 'state', 'direction', 'doors', 'position', 'idle', 'stopped', 'in_service',
+                 'pending_idle', 'pending_stop',
+                 'stops', 'idle_stop', 'internal_requests', 'global_requests', 'assigned_requests',
+                 'next_event_time', 'next_event', 'serves', 'motion', 'odometer',
+                 'trip_origin', 'trip_target', 'trip_time', 'reopens', 'call_counts', 'config', '_die')
+
+    # Scheduled actions are snapshotted by their index in this tuple
+    EVENTS = ('action_move', 'action_open', 'action_close', 'action_proceed', 'action_arrive')
+
+    DOOR_NAMES = {DOORS_OPEN: 'open', DOORS_CLOSED: 'closed', DOORS_OPENING: 'opening', DOORS_CLOSING: 'closing'}
+    STATE_NAMES = {LIFT_MOVING: 'MOVING', LIFT_STOPPED: 'STOPPED'}
+    DIRECTION_NAMES = {DIRECTION_UP: ' UP', DIRECTION_DOWN: ' DOWN', DIRECTION_NONE: ''}
+
+    def __init__(self, i, global_requests, config=None):
+        self.config = Config() if config is None else config
+        n = self.config.floors
+
         self.id = i
         self.state = LIFT_STOPPED
         self.direction = DIRECTION_NONE
@@ -57,45 +113,86 @@ class Elevator:
         self.position = 0
         self.idle = True
         self.stopped = False
+        self.in_service = True
         self.pending_idle = False
         self.pending_stop = False
 
-        self.stops = [False] * N
+        self.stops = [False] * n
         self.idle_stop = None
-        self.internal_requests = [False] * N
+        self.internal_requests = [False] * n
         self.global_requests = global_requests
-        self.assigned_requests = [[False] * N for _ in range(2)]
+        self.assigned_requests = [[False] * n for _ in range(2)]
 
         self.next_event_time = None
         self.next_event = None
 
+        # Floors of the lift's zones, the others are passed without stopping
+        self.serves = [True] * n
+
+        # Without a motion profile the lift moves half a floor per MOVE time,
+        # with one it travels to its next stop in a single trip
+        self.motion = self.config.motion
+        self.odometer = Odometer(DEFAULT_MOTION if self.motion is None else self.motion)
+        self.trip_origin = None
+        self.trip_target = None
+        self.trip_time = None
+
+        # Times the doors reopened at this stop, and the simulator's hall call
+        # counts per floor, for the dwell policy
+        self.reopens = 0
+        self.call_counts = [0] * n
+
+        self._die = _exit
+
     # Actions
 
     def action_move(self):
-        if self.position < 0 or self.position >= N:
+        if self.position < 0 or self.position >= self.config.floors:
             self._die('Moving to impossible position!')
 
         self.position += MOVEMENT[self.direction]
+        self.odometer.move(0.5)
 
         if integer(self.position):
             self.position = int(self.position)
 
         if integer(self.position) and self.stops[self.position]:
-            if self.pending_stop and not self.internal_requests[self.position]:
-                self.pending_stop = False
-                self.stopped = True
-                self.stops[self.position] = False
-                self.set_state(LIFT_STOPPED, DIRECTION_NONE, DOORS_CLOSED, None, None, idle=True)
-            elif self.pending_idle and self.position == self.idle_stop:
-                self.unset_pending_idle()
-                self.set_state(LIFT_STOPPED, DIRECTION_NONE, DOORS_CLOSED, None, None, idle=True)
-            else:
-                self.set_state(LIFT_STOPPED, self.direction, DOORS_OPENING, self.action_open, ACTION_TIMES['OPENING'])
+            self.arrive()
         else:
-            self.set_state(LIFT_MOVING, self.direction, DOORS_CLOSED, self.action_move, ACTION_TIMES['MOVE'])
+            self.start_moving(self.direction)
+
+    def action_arrive(self):
+        self.odometer.move(abs(self.trip_target - self.trip_origin))
+        self.position = self.trip_target
+        self.trip_origin = self.trip_target = self.trip_time = None
+
+        if not self.stops[self.position] and not self.pending_stop and self.has_direction_stops():
+            # The stop this trip was planned for got cancelled on the way
+            self.start_moving(self.direction)
+        else:
+            # Lifts do not stop between floors, so a lift with nowhere else to
+            # go halts here all the same
+            self.stops[self.position] = True
+            self.arrive()
+
+    def arrive(self):
+        self.reopens = 0
+        if self.pending_stop and not self.internal_requests[self.position]:
+            self.pending_stop = False
+            self.stopped = True
+            self.stops[self.position] = False
+            self.set_state(LIFT_STOPPED, DIRECTION_NONE, DOORS_CLOSED, None, None, idle=True)
+        elif self.pending_idle and self.position == self.idle_stop:
+            self.unset_pending_idle()
+            self.set_state(LIFT_STOPPED, DIRECTION_NONE, DOORS_CLOSED, None, None, idle=True)
+        else:
+            self.set_state(LIFT_STOPPED, self.direction, DOORS_OPENING,
+                           self.action_open, self.config.action_times['OPENING'])
+        self.odometer.stop()
 
     def action_open(self):
         direction = self.direction
+        hall_call = True
         if self.assigned_requests[DIRECTION_UP][self.position]:
             self.assigned_requests[DIRECTION_UP][self.position] = False
             self.global_requests[DIRECTION_UP][self.position] = False
@@ -104,23 +201,97 @@ class Elevator:
             self.assigned_requests[DIRECTION_DOWN][self.position] = False
             self.global_requests[DIRECTION_DOWN][self.position] = False
             direction = DIRECTION_DOWN
+        else:
+            hall_call = False
+        car_call = self.internal_requests[self.position]
 
         self.stops[self.position] = False
         self.internal_requests[self.position] = False
-        self.set_state(LIFT_STOPPED, direction, DOORS_OPEN, self.action_close, ACTION_TIMES['OPEN'])
+        self.set_state(LIFT_STOPPED, direction, DOORS_OPEN, self.action_close, self.open_time(hall_call, car_call))
+
+    def open_time(self, hall_call, car_call):
+        dwell = self.config.dwell
+        if dwell is None:
+            return self.config.action_times['OPEN']
+        total = sum(self.call_counts)
+        return dwell.open_time(hall_call, car_call, self.call_counts[self.position] / total if total else 0)
+
+    def reopen(self):
+        """Opens closing doors again, which takes as long as they have been
+        closing."""
+        self.reopens += 1
+        self.set_state(LIFT_STOPPED, self.direction, DOORS_OPENING, self.action_open,
+                       self.config.action_times['CLOSING'] - self.next_event_time)
+
+    def can_reopen(self, floor):
+        dwell = self.config.dwell
+        return (dwell is not None and dwell.reopen and self.reopens < dwell.max_reopens and
+                self.doors == DOORS_CLOSING and self.position == floor)
 
     def action_close(self):
         self.set_state(LIFT_STOPPED, self.direction, DOORS_CLOSING,
-                       self.action_proceed, ACTION_TIMES['CLOSING'])
+                       self.action_proceed, self.config.action_times['CLOSING'])
 
     def action_proceed(self):
         if self.stops[self.position]:
-            self.set_state(LIFT_STOPPED, self.direction, DOORS_OPENING, self.action_open, ACTION_TIMES['OPENING'])
+            self.set_state(LIFT_STOPPED, self.direction, DOORS_OPENING,
+                           self.action_open, self.config.action_times['OPENING'])
         elif self.has_direction_stops():
-            self.set_state(LIFT_MOVING, self.direction, DOORS_CLOSED, self.action_move, ACTION_TIMES['MOVE'])
+            self.start_moving(self.direction)
         else:
             self.set_state(LIFT_STOPPED, DIRECTION_NONE, DOORS_CLOSED, None, None, idle=True)
 
+    # Motion
+
+    def start_moving(self, direction):
+        if self.state != LIFT_MOVING:
+            self.odometer.start()
+        self.reopens = 0
+
+        if self.motion is None:
+            self.set_state(LIFT_MOVING, direction, DOORS_CLOSED, self.action_move, self.config.action_times['MOVE'])
+            return
+
+        step = 1 if direction == DIRECTION_UP else -1
+        target = self.position + step
+        ahead = range(self.position + 1, self.config.floors) if step > 0 else range(self.position - 1, -1, -1)
+        for floor in ahead:
+            if self.stops[floor]:
+                target = floor
+                break
+
+        self.trip_origin, self.trip_target = self.position, target
+        self.trip_time = self.motion.travel_time(abs(target - self.position))
+        self.set_state(LIFT_MOVING, direction, DOORS_CLOSED, self.action_arrive, self.trip_time)
+
+    def update_trip(self):
+        """Moves a lift on a trip to the last half floor it has passed, and
+        cuts the trip short if a stop came up on the way while the lift is
+        still on the part of its trip the trip to that stop shares, so that
+        the shortened trip, timed from the start, is what the lift does (see
+        motion.py)."""
+        elapsed = self.trip_time - self.next_event_time
+        step = 1 if self.direction == DIRECTION_UP else -1
+        length = abs(self.trip_target - self.trip_origin)
+
+        half_floors = self.motion.half_floors(length, elapsed)
+        self.position = self.trip_origin + step * (half_floors // 2 if half_floors % 2 == 0 else half_floors / 2)
+
+        if step > 0:
+            on_the_way = True in self.stops[self.trip_origin + 1:self.trip_target]
+        else:
+            on_the_way = True in self.stops[self.trip_target + 1:self.trip_origin]
+        if not on_the_way:
+            return
+
+        for floor in range(self.trip_origin + step, self.trip_target, step):
+            if self.stops[floor]:
+                shorter = abs(floor - self.trip_origin)
+                if elapsed <= self.motion.common_time(length, shorter):
+                    self.trip_target, self.trip_time = floor, self.motion.travel_time(shorter)
+                    self.next_event_time = self.trip_time - elapsed
+                    break
+
     # Auxilliaries
 
     def set_state(self, state, direction, doors, next_event=None, next_event_time=None, idle=False):
@@ -141,18 +312,18 @@ class Elevator:
 
         if self.position == floor:
             if open_doors:
-                self.set_state(LIFT_STOPPED, direction, DOORS_OPENING, next_event=self.action_open, next_event_time=ACTION_TIMES['OPENING'])
+                self.set_state(LIFT_STOPPED, direction, DOORS_OPENING, next_event=self.action_open, next_event_time=self.config.action_times['OPENING'])
             else:
                 self.set_state(LIFT_STOPPED, DIRECTION_NONE, DOORS_CLOSED, None, None, idle=True)
         else:
-            self.set_state(LIFT_MOVING, direction, DOORS_CLOSED, next_event=self.action_move, next_event_time=ACTION_TIMES['MOVE'])
+            self.start_moving(direction)
 
     def has_stops(self):
         return any(self.stops)
 
     def has_direction_stops(self):
         if self.direction == DIRECTION_UP:
-            return any(self.stops[i] for i in range(self.position, N))
+            return any(self.stops[i] for i in range(self.position, self.config.floors))
         elif self.direction == DIRECTION_DOWN:
             return any(self.stops[i] for i in range(0, self.position))
         else:
@@ -170,6 +341,16 @@ class Elevator:
         else:
             return self.position
 
+    def next_served_floor(self):
+        """The next floor in the direction of travel the lift may stop at, or
+        just the next floor if there is none."""
+        floor = self.next_floor()
+        step = 1 if self.direction == DIRECTION_UP else -1
+        n = self.config.floors
+        while 0 <= floor < n and not self.serves[floor]:
+            floor += step
+        return floor if 0 <= floor < n else self.next_floor()
+
     def reachable(self, floor):
         """A floor is reachable if:
 
@@ -179,9 +360,14 @@ class Elevator:
             b) The lift is moving UP and the floor is above the lift
 
             c) The lift is moving DOWN and the floor is below the lift
+
+            d) The lift is closing its doors at that floor and its dwell
+            policy lets it open them again
             """
         if self.position == floor and self.state == LIFT_STOPPED and self.doors in (DOORS_OPENING, DOORS_CLOSED):
             return True
+        elif self.can_reopen(floor):
+            return True
         elif self.direction == DIRECTION_UP:
             return floor > self.position
         elif self.direction == DIRECTION_DOWN:
@@ -199,117 +385,391 @@ class Elevator:
         self.stops[self.idle_stop] = False
         self.idle_stop = None
 
+    def snapshot(self):
+        """The whole state of the lift as one flat, hashable tuple. Request
+        flags are copied into tuples, so the cost does not depend on how many
+        of them are set; the shared global requests are not included."""
+        return (self.state, self.direction, self.doors, self.position, self.idle, self.stopped, self.in_service,
+                self.pending_idle, self.pending_stop, self.idle_stop, self.reopens,
+                self.trip_origin, self.trip_target, self.trip_time,
+                tuple(self.stops), tuple(self.internal_requests),
+                tuple(self.assigned_requests[DIRECTION_UP]), tuple(self.assigned_requests[DIRECTION_DOWN]),
+                -1 if self.next_event is None else Elevator.EVENTS.index(self.next_event.__name__),
+                self.next_event_time)
+
+    def restore(self, snapshot):
+        (self.state, self.direction, self.doors, self.position, self.idle, self.stopped, self.in_service,
+         self.pending_idle, self.pending_stop, self.idle_stop, self.reopens,
+         self.trip_origin, self.trip_target, self.trip_time,
+         stops, internal_requests, assigned_up, assigned_down, event, self.next_event_time) = snapshot
+
+        self.stops[:] = stops
+        self.internal_requests[:] = internal_requests
+        self.assigned_requests[DIRECTION_UP][:] = assigned_up
+        self.assigned_requests[DIRECTION_DOWN][:] = assigned_down
+        self.next_event = None if event < 0 else getattr(self, Elevator.EVENTS[event])
+
     def __str__(self):
         return ('Lift %d@(%.1f) [%s] :: %s%s, stops = %s, internals = %s, assigned = %s'
-                % (self.id, self.position,
-                   {DOORS_OPEN: 'open', DOORS_CLOSED: 'closed', DOORS_OPENING: 'opening', DOORS_CLOSING: 'closing'}[self.doors],
-                   {LIFT_MOVING: 'MOVING', LIFT_STOPPED: 'STOPPED'}[self.state],
-                   {DIRECTION_UP: ' UP', DIRECTION_DOWN: ' DOWN', DIRECTION_NONE: ''}[self.direction],
-                   [i for i in range(N) if self.stops[i]],
-                   [i for i in range(N) if self.internal_requests[i]],
-                   [[i for i in range(N) if self.assigned_requests[d][i]] for d in range(2)]))
+                % (self.id, self.position, Elevator.DOOR_NAMES[self.doors],
+                   Elevator.STATE_NAMES[self.state], Elevator.DIRECTION_NAMES[self.direction],
+                   floors(self.stops), floors(self.internal_requests),
+                   [floors(self.assigned_requests[d]) for d in range(2)]))
 
     def __repr__(self):
-        return str(self)
+        return '<Lift %d@(%.1f)>' % (self.id, self.position)
 
 ################################################################################
 
 
 class LiftSimulator:
 
-    def __init__(self):
-        self.lift = Lift()
+    def __init__(self, ui=True, config=None):
+        self.config = Config() if config is None else config
+        n, m = self.config.floors, self.config.lifts
 
-        for i in range(N):
-            self.lift.register_handler('f_%d' % (i + 1), self.floor_btn_handler)
+        self.lift = None
+        self.verbose = ui
+        self.start_time = None
 
-        for n in range(M):
-            self.lift.register_handler('l%d_p' % (n + 1), self.lift_btn_handler)
+        # With a controller thread, the latest published view and the one the
+        # UI thread rendered last
+        self.controller = None
+        self.view = None
+        self.rendered = None
+        if ui:
+            self._build_ui()
 
         self.ctrl_loop_count = 0
-        self.requests = [[False] * N for _ in range(2)]
-        self.elevators = [Elevator(i, self.requests) for i in range(M)]
+        self.first_deadline = None
+        self.deadline = 0
+        self.missed_deadlines = 0
+        self.tick_deadline = None
+        self.requests = [[False] * n for _ in range(2)]
+        self.requests_count = [0] * n
+        self.elevators = [Elevator(i, self.requests, self.config) for i in range(m)]
+
+        for elevator in self.elevators:
+            elevator._die = self._die
+            elevator.call_counts = self.requests_count
 
+        candidates, serves = zoning.candidates(self.config.zones, n, m)
+        self.candidates = [[self.elevators[i] for i in lifts] for lifts in candidates]
         for elevator in self.elevators:
-            elevator._die = lambda: self._die()
+            elevator.serves = serves[elevator.id]
 
-        self.floor_last_pressed = [None] * N
-        self.lift_last_pressed = [None] * M
-        self.lift_clicks = [0] * M
-        self.lift_events = [None] * M
+        self.inputs = InputQueue()
+        self.classifier = InputClassifier(n, m)
 
-        self.requests_count = [0] * N
+        self.coalesced_calls = 0
         self.idle_lifts = [elevator for elevator in self.elevators]
 
-    def simulate(self):
-        global _START_TIME
-        _START_TIME = time.time()
-        schedule_interval(self.control_loop, CONTROL_INTERVAL, name='CONTROL_LOOP', debug=False)
-        self.lift.run()
+        # A metrics.Metrics collector and a tracefile.TraceWriter, if attached
+        self.metrics = None
+        self.tracer = None
+        self.bridge = None
+
+    def simulate(self, threaded=True):
+        """Runs the panel. The control loop runs on a thread of its own
+        (see controller.py), or with threaded=False on the Kivy clock."""
+        self.start_time = time.time()
+        if self.lift is None:
+            self._build_ui()
+
+        if not threaded:
+            schedule_interval(lambda: self.advance(clock()), self.config.control_interval, name='CONTROL_LOOP',
+                              debug=False, start_time=self.start_time)
+            self.lift.run()
+            return
+
+        from controller import ControllerThread, RENDER_INTERVAL
+
+        self.controller = ControllerThread(self, on_error=lambda e: schedule_event(self.lift.stop, 0, debug=False))
+        schedule_interval(lambda: self.render(self.view), RENDER_INTERVAL, name='RENDER', debug=False,
+                          start_time=self.start_time)
+        self.controller.start()
+        try:
+            self.lift.run()
+        finally:
+            self.controller.stop()
+        if self.controller.error is not None:
+            sys.exit(1)
+
+    def _build_ui(self):
+        from lift import Lift
+
+        self.lift = Lift(self.config.floors, self.config.lifts)
+
+        for i in range(self.config.floors):
+            self.lift.register_handler('f_%d' % (i + 1), self.floor_btn_handler, i)
+
+        for n in range(self.config.lifts):
+            self.lift.register_handler('l%d_p' % (n + 1), self.lift_btn_handler, n)
 
     # Handlers
 
-    def floor_btn_handler(self, id, value):
-        floor = int(id[2]) - 1
-        if value:
-            self.floor_last_pressed[floor] = time.time()
-        else:
-            dt = time.time() - self.floor_last_pressed[floor]
-            self.floor_last_pressed[floor] = None
+    def floor_btn_handler(self, floor, value, stamp):
+        self.inputs.push(INPUT_HALL, floor, value, stamp)
+
+    def lift_btn_handler(self, elevator, value, stamp):
+        self.inputs.push(INPUT_CAR, elevator, value, stamp)
+
+    def handle_event(self, event):
+        if event.type in (EVENT_HALL_UP, EVENT_HALL_DOWN):
+            floor = event.key
+            d = DIRECTION_UP if event.type == EVENT_HALL_UP else DIRECTION_DOWN
+            if self.requests[d][floor]:
+                # Pending or assigned already: nothing to do, and pressing
+                # again must not weigh the floor more for parking
+                self.coalesced_calls += 1
+                return
             self.requests_count[floor] += 1
-            if dt < 0.5:
-                self.requests[DIRECTION_UP][floor] = True
-            else:
-                self.requests[DIRECTION_DOWN][floor] = True
+            self.requests[d][floor] = True
+            if self.metrics is not None:
+                self.metrics.hall_call(d, floor)
+            if self.tracer is not None:
+                self.tracer.event(self.now(), -1, floor, d, 0, tracefile.EVENT_HALL_CALL)
+        elif event.type == EVENT_CAR_CALL:
+            self.car_call(event.key, event.value)
+        elif event.type == EVENT_STOP:
+            self.stop_car(event.key)
+
+    def car_call(self, elevator, floor):
+        if not self.elevators[elevator].serves[floor] or not self.elevators[elevator].in_service:
+            return
+        if self.elevators[elevator].internal_requests[floor]:
+            self.coalesced_calls += 1
+            return
+        if self.tracer is not None:
+            car = self.elevators[elevator]
+            self.tracer.event(self.now(), elevator, floor, car.direction, car.doors, tracefile.EVENT_CAR_CALL)
 
-    def lift_btn_handler(self, id, value):
-        elevator = int(id[1]) - 1
-        if value:
-            self.lift_last_pressed[elevator] = time.time()
-        else:
-            dt = time.time() - self.lift_last_pressed[elevator]
-            self.lift_last_pressed[elevator] = None
-            if dt < 1:
-                self.lift_clicks[elevator] += 1
-                if self.lift_events[elevator] is not None:
-                    Clock.unschedule(self.lift_events[elevator])
-                self.lift_events[elevator] = schedule_event(lambda: self.finalize_lift_click(elevator), 1)
-            else:   # A stop!
-                if self.elevators[elevator].stopped:
-                    self.elevators[elevator].stopped = False
-                else:
-                    self.elevators[elevator].stops = [False] * N
-                    self.elevators[elevator].assigned_requests = [[False] * N for _ in range(2)]
-
-                    if self.elevators[elevator].state == LIFT_MOVING:
-                        self.elevators[elevator].stops[self.elevators[elevator].next_floor()] = True
-                        self.elevators[elevator].pending_stop = True
-                    else:
-                        self.elevators[elevator].stopped = True
-
-    def finalize_lift_click(self, elevator):
-        floor = self.lift_clicks[elevator] - 1
-        self.lift_clicks[elevator] = 0
         self.elevators[elevator].internal_requests[floor] = True
 
         if self.elevators[elevator].idle_stop is not None:
             self.elevators[elevator].unset_pending_idle()
+        if self.elevators[elevator].can_reopen(floor):
+            self.elevators[elevator].reopen()
+
+    def stop_car(self, elevator):
+        if self.tracer is not None:
+            self.tracer.lift_event(self.now(), self.elevators[elevator], tracefile.EVENT_STOP)
+        if not self.elevators[elevator].in_service:
+            return
+        if self.elevators[elevator].stopped:
+            self.elevators[elevator].stopped = False
+        else:
+            self.redispatch(self.halt(self.elevators[elevator]))
+
+    def take_out_of_service(self, elevator):
+        """Takes a car out of service, e.g. on a fault: it halts like on a
+        STOP, at its next floor if it is moving, drops its car calls and stays
+        halted, whatever buttons are pressed, until return_to_service. Its
+        hall calls go to the other cars right away."""
+        car = self.elevators[elevator]
+        if not car.in_service:
+            return
+        if self.tracer is not None:
+            self.tracer.lift_event(self.now(), car, tracefile.EVENT_OUT_OF_SERVICE)
+
+        car.in_service = False
+        car.internal_requests[:] = [False] * self.config.floors
+        if car.pending_idle:
+            car.unset_pending_idle()
+        if car in self.idle_lifts:
+            self.idle_lifts.remove(car)
+
+        orphans = self.halt(car)
+        if self.metrics is not None:
+            self.metrics.out_of_service(orphans)
+        self.redispatch(orphans)
+
+    def return_to_service(self, elevator):
+        car = self.elevators[elevator]
+        if car.in_service:
+            return
+        if self.tracer is not None:
+            self.tracer.lift_event(self.now(), car, tracefile.EVENT_IN_SERVICE)
+        car.in_service = True
+        car.stopped = False
+        car.pending_stop = False
+
+    def halt(self, car):
+        """Drops a car's stops and hall call assignments and halts it, at the
+        next floor if it is moving. Returns the hall calls it held that are
+        still pending."""
+        n = self.config.floors
+        orphans = [(d, floor) for d in range(2) for floor in range(n)
+                   if car.assigned_requests[d][floor] and self.requests[d][floor]]
+
+        car.stops = [False] * n
+        car.assigned_requests = [[False] * n for _ in range(2)]
+        if car.state == LIFT_MOVING:
+            car.stops[car.next_floor()] = True
+            car.pending_stop = True
+        else:
+            car.stopped = True
+        return orphans
+
+    # Snapshots
+
+    def snapshot(self):
+        """Everything the controller decides on, as nested tuples: the hall
+        requests, call statistics, idle lift order and every lift's snapshot.
+        Pending raw inputs and the tick counter are not part of it."""
+        return (tuple(self.requests[DIRECTION_UP]), tuple(self.requests[DIRECTION_DOWN]),
+                tuple(self.requests_count), tuple(elevator.id for elevator in self.idle_lifts),
+                tuple(elevator.snapshot() for elevator in self.elevators))
+
+    def restore(self, snapshot):
+        requests_up, requests_down, requests_count, idle_lifts, elevators = snapshot
+
+        self.requests[DIRECTION_UP][:] = requests_up
+        self.requests[DIRECTION_DOWN][:] = requests_down
+        self.requests_count[:] = requests_count
+        self.idle_lifts[:] = [self.elevators[i] for i in idle_lifts]
+        for elevator, elevator_snapshot in zip(self.elevators, elevators):
+            elevator.restore(elevator_snapshot)
 
     # Internals
 
+    def advance(self, now):
+        """Runs every control tick whose deadline has passed by `now`, a
+        clock() reading, and returns how many ran. Deadlines are absolute, one
+        control interval apart, so late or coalesced callbacks neither stretch
+        the lift timings nor drift: all overdue ticks run back to back, each
+        one handling the lift actions that came due in it. A tick that runs
+        more than LATE_TOLERANCE intervals past its deadline counts as missed;
+        ordinary callback jitter does not."""
+        interval = self.config.control_interval
+        if self.first_deadline is None:
+            self.first_deadline = now
+
+        ran = 0
+        while now >= self.first_deadline + self.deadline * interval:
+            if now - (self.first_deadline + self.deadline * interval) > LATE_TOLERANCE * interval:
+                self.missed_deadlines += 1
+            self.tick_deadline = self.first_deadline + self.deadline * interval
+            # Looked up on every tick, so that a profiler can be swapped in and out
+            self.control_loop()
+            self.deadline += 1
+            ran += 1
+        self.tick_deadline = None
+        return ran
+
+    def now(self):
+        """Controller time: control intervals run so far."""
+        return self.ctrl_loop_count * self.config.control_interval
+
+    def input_time(self):
+        """What button stamps are compared with in this tick: its deadline
+        when advance() runs it on clock() time, controller time when the tick
+        is driven directly on a virtual clock. Raw inputs must be stamped on
+        the same clock."""
+        return self.now() if self.tick_deadline is None else self.tick_deadline
+
     def control_loop(self):
+        started = self.tick_before_assign()
+        self.assign_requests()
+        self.tick_after_assign(started)
+
+    def tick_before_assign(self):
+        """Starts a control tick, running the phases before hall calls are
+        assigned. Returns what tick_after_assign needs to finish it, so that
+        offline dispatchers can assign calls in between themselves."""
+        started = clock() if self.metrics is not None else None
         self.ctrl_loop_count += 1
+        for phase in self.PHASES_BEFORE_ASSIGN:
+            getattr(self, phase)()
+        return started
+
+    def tick_after_assign(self, started):
+        for phase in self.PHASES_AFTER_ASSIGN:
+            getattr(self, phase)()
+        if self.metrics is not None:
+            self.metrics.tick(started, clock())
+
+    # Control loop phases, in order; profiler.Profiler times them one by one
+    PHASES_BEFORE_ASSIGN = ('dispatch_events', 'merge_stops')
+    PHASES_AFTER_ASSIGN = ('park_idle', 'update_ui')
+    PHASES = PHASES_BEFORE_ASSIGN + ('assign_requests',) + PHASES_AFTER_ASSIGN
+
+    def dispatch_events(self):
+        """Handles new inputs and runs the lift actions that came due."""
+        for event in self.classifier.classify(self.inputs.drain(), self.input_time()):
+            self.handle_event(event)
 
         for elevator in self.elevators:
             if elevator.next_event_time is not None:
-                elevator.next_event_time -= CONTROL_INTERVAL
+                elevator.next_event_time -= self.config.control_interval
                 if elevator.next_event_time <= 0:
-                    # print('Performing %d::%s' % (elevator.id, elevator.next_event.__name__))
-                    elevator.next_event()
-
+                    event = elevator.next_event
+                    event()
+                    if self.tracer is not None:
+                        self.tracer.lift_event(self.now(), elevator, Elevator.EVENTS.index(event.__name__))
+            if elevator.trip_target is not None:
+                elevator.update_trip()
+
+    def merge_stops(self):
+        n = self.config.floors
         for elevator in self.elevators:
-            elevator.stops = [elevator.stops[i] | elevator.internal_requests[i] for i in range(N)]
-
+            elevator.stops = [elevator.stops[i] | elevator.internal_requests[i] for i in range(n)]
+
+    def redispatch(self, calls):
+        """Gives hall calls a car dropped to the closest candidate lift that
+        can take them, by the same rule as assign_requests but looking at these
+        calls only, so the work does not grow with the building. Calls no lift
+        can take yet are left to assign_requests."""
+        for d, floor in calls:
+            best_lift, best_dist = None, OO
+            for elevator in self.candidates[floor]:
+                if self.can_take(elevator, d, floor) and elevator.distance(floor) < best_dist:
+                    best_lift, best_dist = elevator, elevator.distance(floor)
+            if best_lift is not None:
+                if self.metrics is not None:
+                    self.metrics.redispatched()
+                self.assign(best_lift, d, floor)
+
+    def can_take(self, elevator, d, floor):
+        if elevator.stopped or elevator.pending_stop or not elevator.in_service:
+            return False
+        return elevator.direction == d and elevator.reachable(floor) or elevator.idle
+
+    def assign(self, elevator, d, floor):
+        elevator.assigned_requests[d][floor] = True
+        elevator.stops[floor] = True
+        if self.metrics is not None:
+            self.metrics.assigned(d, floor)
+        if self.tracer is not None:
+            self.tracer.event(self.now(), elevator.id, floor, d, elevator.doors, tracefile.EVENT_ASSIGN)
+
+        if elevator.pending_idle:
+            elevator.unset_pending_idle()
+        if elevator.can_reopen(floor):
+            elevator.reopen()
+
+        if elevator.idle:
+            if elevator in self.idle_lifts:
+                self.idle_lifts.remove(elevator)
+            elevator.send_idle_to(floor)
+
+    def open_calls(self):
+        """Pending hall calls no lift holds yet that some lift could take, as
+        (direction, floor, lifts) with the lifts that could, closest first; the
+        calls and lifts assign_requests chooses from, in its order."""
+        calls = []
+        for d in (DIRECTION_UP, DIRECTION_DOWN):
+            for floor, pending in enumerate(self.requests[d]):
+                if pending and not any(elevator.assigned_requests[d][floor] for elevator in self.candidates[floor]):
+                    lifts = sorted((elevator for elevator in self.candidates[floor] if self.can_take(elevator, d, floor)),
+                                   key=lambda elevator: elevator.distance(floor))
+                    if lifts:
+                        calls.append((d, floor, lifts))
+        return calls
+
+    def assign_requests(self):
+        """Greedily gives unassigned hall calls to the closest candidate lift
+        that is idle or already heading that way."""
         assigning = True
         while assigning:
             assigning = False
@@ -318,13 +778,12 @@ class LiftSimulator:
             for d, requests in enumerate(self.requests):
                 for floor, _ in filter(lambda x: x[1], enumerate(requests)):
 
-                    if any(self.elevators[i].assigned_requests[d][floor] for i in range(M)):
+                    # Only lifts whose zone covers the floor may take the call
+                    if any(elevator.assigned_requests[d][floor] for elevator in self.candidates[floor]):
                         continue
 
-                    for elevator in self.elevators:
-                        if elevator.stopped or elevator.pending_stop:
-                            continue
-                        if elevator.direction == d and elevator.reachable(floor) or elevator.idle:
+                    for elevator in self.candidates[floor]:
+                        if self.can_take(elevator, d, floor):
                             current_dist = elevator.distance(floor)
                             if current_dist < best_dist:
                                 best_dist = current_dist
@@ -332,70 +791,86 @@ class LiftSimulator:
                                 best_request = (d, floor)
 
             if best_request is not None:
-                best_lift.assigned_requests[best_request[0]][best_request[1]] = True
-                best_lift.stops[best_request[1]] = True
+                self.assign(best_lift, *best_request)
                 assigning = True
 
-                if best_lift.pending_idle:
-                    best_lift.unset_pending_idle()
-
-                if best_lift.idle:
-                    if best_lift in self.idle_lifts:
-                        self.idle_lifts.remove(best_lift)
-                    best_lift.send_idle_to(best_request[1])
-
+    def park_idle(self):
+        """Stops lifts running out of stops and parks idle ones."""
+        n = self.config.floors
         for elevator in self.elevators:
             if elevator.stopped:
                 continue
             if elevator.state == LIFT_MOVING and not elevator.has_stops() and not elevator.pending_stop:
                 # Either stop the lift on the next floor, or send it to the most frequent floor
-                elevator.stops[elevator.next_floor()] = True
+                elevator.stops[elevator.next_served_floor()] = True
 
             elif elevator.idle and elevator.has_stops():
                 elevator.send_idle_to(elevator.closest_stop())
             elif elevator.idle:
                 # Send to most common floor
-                popular_floors = sorted(range(N), key=lambda i: -self.requests_count[i])
+                popular_floors = [i for i in sorted(range(n), key=lambda i: -self.requests_count[i]) if elevator.serves[i]]
 
-                if elevator not in self.idle_lifts:
-                    popular_floor = popular_floors[len(self.idle_lifts)]
-                    print('Sending idle lift %d to %d' % (elevator.id, popular_floor))
+                if elevator not in self.idle_lifts and popular_floors:
+                    popular_floor = popular_floors[min(len(self.idle_lifts), len(popular_floors) - 1)]
+                    if self.verbose:
+                        print('Sending idle lift %d to %d' % (elevator.id, popular_floor))
                     elevator.set_pending_idle(popular_floor)
                     elevator.send_idle_to(popular_floor, False)
                     self.idle_lifts.append(elevator)
 
-        self.update_ui()
-
     def update_ui(self):
-        for i, elevator in enumerate(self.elevators):
-            updated = set()
-            if elevator.state == LIFT_STOPPED:
-                if elevator.doors == DOORS_CLOSED:
-                    self._set_state_led(i, elevator.position, STATE_AT_CLOSED)
-                elif elevator.doors in (DOORS_CLOSING, DOORS_OPENING):
-                    self._set_state_led(i, elevator.position, STATE_AT_CHANGING)
-                elif elevator.doors == DOORS_OPEN:
-                    self._set_state_led(i, elevator.position, STATE_AT_OPEN)
-                updated.add(elevator.position)
+        """Renders the panel, or with a controller thread publishes what it
+        should show for the UI thread to render. A bridge.StateWriter gets
+        every tick's state whether or not there is a panel."""
+        if self.bridge is not None:
+            self.bridge.publish(self)
+        if self.lift is None:
+            return
+
+        view = (tuple(tuple(self.led_states(elevator)) for elevator in self.elevators),
+                tuple(elevator.direction for elevator in self.elevators))
+        if self.controller is None:
+            self.render(view)
+        else:
+            self.view = view
+
+    def render(self, view):
+        if view is None or view is self.rendered:
+            return
+
+        leds, directions = view
+        for i, (states, direction) in enumerate(zip(leds, directions)):
+            for f, value in enumerate(states):
+                self._set_state_led(i, f, value)
+            self._set_dir_led(i, direction)
+        self.rendered = view
+
+    def led_states(self, elevator):
+        leds = [STATE_FAR] * self.config.floors
+        if elevator.state == LIFT_STOPPED:
+            if not integer(elevator.position):
+                self._die('Impossible position for a stopped lift! -> %s' % elevator)
+
+            if elevator.doors == DOORS_CLOSED:
+                leds[int(elevator.position)] = STATE_AT_CLOSED
+            elif elevator.doors in (DOORS_CLOSING, DOORS_OPENING):
+                leds[int(elevator.position)] = STATE_AT_CHANGING
+            elif elevator.doors == DOORS_OPEN:
+                leds[int(elevator.position)] = STATE_AT_OPEN
+        else:
+            if elevator.direction == DIRECTION_UP or elevator.position != int(elevator.position):
+                position_lower, position_upper = int(elevator.position), int(elevator.position + 1)
+            elif elevator.direction == DIRECTION_DOWN and elevator.position == int(elevator.position):
+                position_upper, position_lower = int(elevator.position), int(elevator.position - 1)
             else:
-                if elevator.direction == DIRECTION_UP or elevator.position != int(elevator.position):
-                    position_lower, position_upper = int(elevator.position), int(elevator.position + 1)
-                elif elevator.direction == DIRECTION_DOWN and elevator.position == int(elevator.position):
-                    position_upper, position_lower = int(elevator.position), int(elevator.position - 1)
-                else:
-                    self._die('Impossible lift state for UI update! -> %s' % elevator)
-
-                if position_lower < 0 or position_upper > N - 1:
-                    self._die('Impossible position for NEAR!')
-
-                self._set_state_led(i, position_upper, STATE_NEAR)
-                self._set_state_led(i, position_lower, STATE_NEAR)
-                updated.add(position_upper)
-                updated.add(position_lower)
-            for f in range(N):
-                if f not in updated:
-                    self._set_state_led(i, f, STATE_FAR)
-            self._set_dir_led(i, elevator.direction)
+                self._die('Impossible lift state for UI update! -> %s' % elevator)
+
+            if position_lower < 0 or position_upper > self.config.floors - 1:
+                self._die('Impossible position for NEAR!')
+
+            leds[position_upper] = STATE_NEAR
+            leds[position_lower] = STATE_NEAR
+        return leds
 
     # Auxilliaries
 
@@ -416,23 +891,25 @@ class LiftSimulator:
 ################################################################################
 
 
-def schedule_event(fn, by, *args, name=None, debug=True):
+def schedule_event(fn, by, *args, name=None, debug=None, start_time=0):
     def f(dt):
-        if DEBUG_MODE and debug:
+        if DEBUG_MODE if debug is None else debug:
             print('> Executing <%s> at %.2f (delayed by %s).' %
                   (getattr(fn, '__qualname__', None) if name is None else name,
-                   time.time() - _START_TIME, by))
+                   time.time() - start_time, by))
         fn(*args)
+    from kivy.clock import Clock
     return Clock.schedule_once(f, by)
 
 
-def schedule_interval(fn, interval, *args, name=None, debug=True):
+def schedule_interval(fn, interval, *args, name=None, debug=None, start_time=0):
     def f(dt):
-        if DEBUG_MODE and debug:
+        if DEBUG_MODE if debug is None else debug:
             print('> Executing <%s> at %.2f (delayed by %s).' %
                   (getattr(fn, '__qualname__', None) if name is None else name,
-                   time.time() - _START_TIME, interval))
+                   time.time() - start_time, interval))
         fn(*args)
+    from kivy.clock import Clock
     return Clock.schedule_interval(f, interval)
 
 
@@ -440,5 +917,38 @@ def schedule_interval(fn, interval, *args, name=None, debug=True):
 
 
 if __name__ == '__main__':
-    ls = LiftSimulator()
-    ls.simulate()
+    parser = argparse.ArgumentParser(description='Lift group simulator.')
+    parser.add_argument('--metrics-port', type=int, default=None, help='serve /metrics over HTTP on this port')
+    parser.add_argument('--metrics-socket', default=None, help='serve /metrics on this Unix socket')
+    parser.add_argument('--single-thread', action='store_true', help='run the control loop on the UI thread')
+    parser.add_argument('--profile', default=None, metavar='FILE',
+                        help='profile the control loop, write folded stacks to FILE on exit')
+    parser.add_argument('--rollout', action='store_true', help='assign hall calls by rollouts (see rollout.py)')
+    parser.add_argument('--dwell', choices=('fixed', 'adaptive', 'reopen'), default='fixed',
+                        help='door dwell times (adaptive, reopen: see dwell.py)')
+    args = parser.parse_args()
+
+    config = None
+    if args.dwell != 'fixed':
+        from dwell import DwellPolicy
+
+        config = Config(dwell=DwellPolicy(reopen=args.dwell == 'reopen'))
+    ls = LiftSimulator(config=config)
+    if args.metrics_port is not None or args.metrics_socket is not None:
+        from metrics import Metrics, MetricsServer
+
+        ls.metrics = Metrics(ls)
+        MetricsServer(ls.metrics).start(port=args.metrics_port, path=args.metrics_socket)
+    if args.rollout:
+        from rollout import RolloutDispatcher
+
+        RolloutDispatcher(ls).install()
+    profiler = None
+    if args.profile is not None:
+        from profiler import Profiler
+
+        profiler = Profiler(ls).install()
+    ls.simulate(threaded=not args.single_thread)
+    if profiler is not None:
+        print(profiler.report())
+        profiler.write_folded(args.profile)
@@ -1,11 +1,20 @@
+from functools import partial
+
 from kivy.app import App
 from kivy.clock import Clock
+from kivy.factory import Factory
+from kivy.graphics import Color, Rectangle
 from kivy.properties import ListProperty, DictProperty
 from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.gridlayout import GridLayout
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 # from kivy.graphics import *
 
+from constants import *
+
+from inputs import clock
+
 
 class PushButton(Button):
     def __init__(self, *args, **kwargs):
@@ -14,19 +23,16 @@ class PushButton(Button):
         super().__init__(*args, **kwargs)
 
     def on_press(self):
+        stamp = clock()
         self.item_state = True
         if self.on_state_changed is not None:
-            self.on_state_changed(self.item_state)
+            self.on_state_changed(self.item_state, stamp)
 
     def on_release(self):
+        stamp = clock()
         self.item_state = False
         if self.on_state_changed is not None:
-            self.on_state_changed(self.item_state)
-
-
-DIRECTION_NONE = -1
-DIRECTION_UP = 0
-DIRECTION_DOWN = 1
+            self.on_state_changed(self.item_state, stamp)
 
 
 class DirectionLED(Label):
@@ -54,13 +60,6 @@ class DirectionLED(Label):
         self.dir_colors[self._item_state] = self.VISIBLE_COLOR
 
 
-STATE_FAR = 0
-STATE_NEAR = 1
-STATE_AT_CLOSED = 2
-STATE_AT_CHANGING = 3
-STATE_AT_OPEN = 4
-
-
 class StateLED(Label):
 
     st_colors = {
@@ -105,26 +104,93 @@ class StateLED(Label):
                       else self.st_colors[None])
 
 
+# The building lift.kv lays out
+KV_FLOORS = 5
+KV_LIFTS = 2
+
+
 class LiftInterface(BoxLayout):
     pass
 
 
+def shaded(widget, rgb):
+    with widget.canvas.before:
+        Color(*rgb)
+        rect = Rectangle(pos=widget.pos, size=widget.size)
+    widget.bind(pos=lambda w, pos: setattr(rect, 'pos', pos), size=lambda w, size: setattr(rect, 'size', size))
+    return widget
+
+
+def build_interface(floors, lifts):
+    """The panel of lift.kv for any building: a column of StateLEDs per lift
+    with the hall buttons in the middle. Returns the root and its devices by
+    id, named as in lift.kv."""
+    devices = {}
+    root = BoxLayout(orientation='vertical')
+    left = (lifts + 1) // 2
+
+    def row(padding, rgb, widgets):
+        box = shaded(BoxLayout(orientation='horizontal', padding=padding, size_hint=(1.0, 0.25)), rgb)
+        for i, widget in enumerate(widgets):
+            if i == left:
+                box.add_widget(Factory.Blank())
+            box.add_widget(widget)
+        root.add_widget(box)
+
+    row([50, 0], (0.1, 0.1, 0.1), [Factory.TitleLabel(text='[b]Lift %d[/b]' % (n + 1)) for n in range(lifts)])
+    for n in range(lifts):
+        devices['l%d_d' % (n + 1)] = DirectionLED()
+    row([50, 10], (0.05, 0.05, 0.05), [devices['l%d_d' % (n + 1)] for n in range(lifts)])
+
+    grid = GridLayout(cols=lifts + 1, rows=floors, padding=[50, 25])
+    root.bind(width=lambda w, width: setattr(grid, 'spacing', (width / 10 / max(lifts - 1, 1), 0)))
+    for f in range(floors, 0, -1):
+        devices['f_%d' % f] = PushButton()
+        for n in range(lifts):
+            devices['l%d_%d' % (n + 1, f)] = StateLED()
+        ids = ['l%d_%d' % (n + 1, f) for n in range(lifts)]
+        for id in ids[:left] + ['f_%d' % f] + ids[left:]:
+            grid.add_widget(devices[id])
+    root.add_widget(grid)
+
+    for n in range(lifts):
+        devices['l%d_p' % (n + 1)] = PushButton(size_hint=(0.5, 1.0))
+    row([50, 10], (0.05, 0.05, 0.05), [devices['l%d_p' % (n + 1)] for n in range(lifts)])
+    return root, devices
+
+
 class Lift(App):
-    def __init__(self):
+    def __init__(self, floors=KV_FLOORS, lifts=KV_LIFTS):
         super().__init__()
+        self.floors = floors
+        self.lifts = lifts
         self.devices = {}
         self.handlers = {}
+        self.slots = {}
+        self.dispatch_table = []
 
-    def register_handler(self, id, handler):
-        self.handlers[id] = handler
+    def register_handler(self, id, handler, key=None):
+        """Binds a handler to the device `id`; it is called as handler(key,
+        item_state, stamp), with key defaulting to the id itself and stamp
+        being the input clock time at which the change was captured."""
+        self.handlers[id] = (handler, id if key is None else key)
+        if id in self.slots:
+            self._bind(id)
 
     def unregister_handler(self, id):
-        self.handlers[id] = None
+        self.handlers.pop(id, None)
+        if id in self.slots:
+            self._bind(id)
 
     def trigger_event(self, id):
-        if id not in self.handlers:
-            return
-        self.handlers[id](id, self.get(id))
+        if id in self.slots:
+            self.dispatch_input(self.slots[id], self.get(id), clock())
+
+    def dispatch_input(self, slot, item_state, stamp):
+        device, handler, key = self.dispatch_table[slot]
+        device.item_state = item_state
+        if handler is not None:
+            handler(key, item_state, stamp)
 
     def get(self, id):
         return self.devices[id].item_state
@@ -132,18 +198,22 @@ class Lift(App):
     def set(self, id, item_state):
         self.devices[id].item_state = item_state
 
-    def update(self, id):
-        def f(item_state):
-            self.devices[id].item_state = item_state
-            self.trigger_event(id)
-        return f
-
     def build(self):
-        self.interface = LiftInterface()
+        if (self.floors, self.lifts) == (KV_FLOORS, KV_LIFTS):
+            self.interface = LiftInterface()
+            self.devices = self.interface.ids
+        else:
+            self.interface, self.devices = build_interface(self.floors, self.lifts)
 
-        self.devices = self.interface.ids
-        for id, device in self.interface.ids.items():
+        for id, device in self.devices.items():
             if hasattr(device, 'on_state_changed'):
-                device.on_state_changed = self.update(id)
+                self.slots[id] = len(self.dispatch_table)
+                self.dispatch_table.append(None)
+                self._bind(id)
+                device.on_state_changed = partial(self.dispatch_input, self.slots[id])
 
         return self.interface
+
+    def _bind(self, id):
+        handler, key = self.handlers.get(id, (None, None))
+        self.dispatch_table[self.slots[id]] = (self.devices[id], handler, key)
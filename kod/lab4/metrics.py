@@ -0,0 +1,229 @@
+"""Live metrics of a running LiftSimulator, served over HTTP in the Prometheus
+text format from a background thread.
+
+The controller only touches plain counters and lists it owns; at the end of
+every tick it publishes an immutable snapshot by swapping one reference. The
+server thread formats whatever snapshot is current when a request comes in,
+so it never waits for the controller and the controller never waits for it.
+
+Exposed (car labels are numbered from 1):
+
+    lift_hall_calls_pending{direction}         gauge
+    lift_car_position{car}                     gauge, floors from 0
+    lift_car_moving{car}, lift_car_doors{car}  gauges (doors: 1 closed,
+                                               2 opening, 3 open, 4 closing)
+    lift_car_direction{car}                    gauge (-1 none, 0 up, 1 down)
+    lift_assignment_latency_seconds            histogram, hall call -> lift
+    lift_control_loop_seconds                  histogram, time spent per tick
+    lift_ticks_total, lift_missed_ticks_total  counters (missed: control
+                                               deadlines run late)
+    lift_hall_calls_total, lift_assignments_total
+    lift_calls_coalesced_total                 counter, hall and car calls
+                                               already pending when made
+    lift_inputs_dropped_total                  counter, button presses over
+                                               the rate limit
+    lift_cars_out_of_service                   gauge
+    lift_redispatched_calls_total              counter, hall calls moved off
+                                               a car taken out of service or
+                                               STOPped
+    lift_recovery_seconds                      histogram, car taken out of
+                                               service -> every hall call it
+                                               held served
+
+Usage: metrics = Metrics(sim); MetricsServer(metrics).start(port=9100)
+"""
+import bisect
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from constants import *
+
+
+LATENCY_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+LOOP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+RECOVERY_BUCKETS = (0, 5, 10, 20, 30, 60, 120, 300, 600)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9100
+
+################################################################################
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def freeze(self):
+        return tuple(self.counts), self.sum
+
+
+class Metrics:
+    """Collects metrics of one simulator; attach it as `sim.metrics`. Every
+    call comes from the controller thread."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.interval = sim.config.control_interval
+        self.ticks = 0
+        self.hall_calls = 0
+        self.assignments = 0
+        self.called_at = {}
+        self.redispatches = 0
+
+        # (tick taken out of service, its hall calls not yet served)
+        self.recovering = []
+
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.loop = Histogram(LOOP_BUCKETS)
+        self.recovery = Histogram(RECOVERY_BUCKETS)
+
+        self.snapshot = None
+        self.publish()
+
+    # Controller side
+
+    def hall_call(self, d, floor):
+        self.hall_calls += 1
+        self.called_at.setdefault((d, floor), self.ticks)
+
+    def assigned(self, d, floor):
+        self.assignments += 1
+        called = self.called_at.pop((d, floor), None)
+        if called is not None:
+            self.latency.observe((self.ticks - called) * self.interval)
+
+    def redispatched(self):
+        self.redispatches += 1
+
+    def out_of_service(self, orphans):
+        self.recovering.append((self.ticks, list(orphans)))
+
+    def tick(self, started, finished):
+        """Books one control loop run, `started` and `finished` being clock()
+        readings."""
+        self.ticks += 1
+        self.loop.observe(finished - started)
+        if self.recovering:
+            self.check_recovery()
+        self.publish()
+
+    def check_recovery(self):
+        requests = self.sim.requests
+        recovering = []
+        for since, calls in self.recovering:
+            calls = [(d, floor) for d, floor in calls if requests[d][floor]]
+            if calls:
+                recovering.append((since, calls))
+            else:
+                self.recovery.observe((self.ticks - since) * self.interval)
+        self.recovering = recovering
+
+    def publish(self):
+        sim = self.sim
+        cars = tuple((elevator.position, elevator.state, elevator.doors, elevator.direction)
+                     for elevator in sim.elevators)
+        self.snapshot = (sum(sim.requests[DIRECTION_UP]), sum(sim.requests[DIRECTION_DOWN]), cars,
+                         sum(not elevator.in_service for elevator in sim.elevators),
+                         self.ticks, sim.missed_deadlines, self.hall_calls, self.assignments, self.redispatches,
+                         sim.coalesced_calls, sim.classifier.dropped,
+                         self.latency.freeze(), self.loop.freeze(), self.recovery.freeze())
+
+
+def render(snapshot):
+    """The Prometheus text exposition of a published snapshot."""
+    (pending_up, pending_down, cars, out_of_service, ticks, missed_ticks, hall_calls, assignments, redispatches,
+     coalesced, dropped, latency, loop, recovery) = snapshot
+
+    lines = ['# TYPE lift_hall_calls_pending gauge',
+             'lift_hall_calls_pending{direction="up"} %d' % pending_up,
+             'lift_hall_calls_pending{direction="down"} %d' % pending_down]
+    for name, column in (('position', 0), ('moving', 1), ('doors', 2), ('direction', 3)):
+        lines.append('# TYPE lift_car_%s gauge' % name)
+        for i, car in enumerate(cars):
+            lines.append('lift_car_%s{car="%d"} %s' % (name, i + 1, car[column]))
+    lines.append('# TYPE lift_cars_out_of_service gauge')
+    lines.append('lift_cars_out_of_service %d' % out_of_service)
+    for name, value in (('ticks', ticks), ('missed_ticks', missed_ticks),
+                        ('hall_calls', hall_calls), ('assignments', assignments),
+                        ('redispatched_calls', redispatches), ('calls_coalesced', coalesced),
+                        ('inputs_dropped', dropped)):
+        lines.append('# TYPE lift_%s_total counter' % name)
+        lines.append('lift_%s_total %d' % (name, value))
+    for name, buckets, (counts, total) in (('assignment_latency_seconds', LATENCY_BUCKETS, latency),
+                                           ('control_loop_seconds', LOOP_BUCKETS, loop),
+                                           ('recovery_seconds', RECOVERY_BUCKETS, recovery)):
+        lines.append('# TYPE lift_%s histogram' % name)
+        cumulative = 0
+        for bound, count in zip(buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('lift_%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+        lines.append('lift_%s_sum %r' % (name, total))
+        lines.append('lift_%s_count %d' % (name, cumulative))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+################################################################################
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render(self.server.metrics.snapshot)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('local', 0)
+
+
+class MetricsServer:
+    """Serves GET /metrics from a daemon thread, on TCP or on a Unix socket."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.server = None
+        self.thread = None
+
+    def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.server = UnixHTTPServer(path, MetricsHandler)
+        else:
+            self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+            self.server.daemon_threads = True
+        self.server.metrics = self.metrics
+        self.thread = threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.server, UnixHTTPServer):
+                os.unlink(self.server.server_address)
+            self.server = None
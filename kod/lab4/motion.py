@@ -0,0 +1,161 @@
+"""Jerk-limited lift motion and per-lift odometry.
+
+A trip of a given length follows the usual S-curve: jerk up to the maximal
+acceleration, accelerate, jerk down to the cruising speed, cruise, and the
+same in reverse to brake. Short trips never reach the maximal speed (or even
+the maximal acceleration); their peak speed is found by bisection. Every
+profile is a list of constant-jerk phases, so positions and speeds within a
+trip are evaluated exactly. Profiles are cached per number of floors.
+
+The times at which a trip passes each half floor are precomputed as well, so
+following a lift on its trip costs a bisection per control tick. A trip can
+be cut short for a nearer stop only while the lift is still on the part both
+trips have in common: from there on the shorter trip is exactly what the
+lift does, so its remaining time and energy are exact. Past that point the
+lift would have to re-plan from its speed and acceleration, which this model
+does not do, and the stop waits for a later trip.
+
+Energy is a rough estimate: the kinetic energy of the car at its peak speed
+plus rolling friction over the distance, divided by the drive efficiency.
+The counterweight is assumed to balance the car, so height does not matter.
+"""
+from bisect import bisect_right
+
+
+class MotionProfile:
+
+    def __init__(self, floor_height=3.5, max_speed=2.5, max_acceleration=1.0, max_jerk=1.0,
+                 mass=1500, friction=400, efficiency=0.8):
+        self.floor_height = floor_height
+        self.max_speed = max_speed
+        self.max_acceleration = max_acceleration
+        self.max_jerk = max_jerk
+
+        self.mass = mass
+        self.friction = friction
+        self.efficiency = efficiency
+
+        self._trips = {}
+        self._crossings = {}
+        self._common = {}
+
+    # Trips
+
+    def trip(self, floors):
+        """(phases, peak speed) of a trip over `floors` floors, phases being
+        (duration, jerk) pairs starting and ending at rest."""
+        if floors not in self._trips:
+            distance = floors * self.floor_height
+            speed = self.max_speed
+            if 2 * self._ramp_distance(speed) > distance:
+                low, high = 0, speed
+                for _ in range(60):
+                    speed = (low + high) / 2
+                    if 2 * self._ramp_distance(speed) > distance:
+                        high = speed
+                    else:
+                        low = speed
+                speed = low
+
+            ramp = self._ramp(speed)
+            cruise = (distance - 2 * self._ramp_distance(speed)) / speed if speed > 0 else 0
+            phases = ramp + [(max(cruise, 0), 0)] + [(duration, -jerk) for duration, jerk in ramp]
+            self._trips[floors] = ([phase for phase in phases if phase[0] > 0], speed)
+        return self._trips[floors]
+
+    def travel_time(self, floors):
+        return sum(duration for duration, _ in self.trip(floors)[0])
+
+    def common_time(self, floors, other):
+        """How long trips over `floors` and `other` floors follow the same
+        phases from the start: up to then, a lift on one can switch to the
+        other and stay exactly on it."""
+        if (floors, other) not in self._common:
+            t = 0
+            for (duration, jerk), (other_duration, other_jerk) in zip(self.trip(floors)[0], self.trip(other)[0]):
+                if jerk != other_jerk:
+                    break
+                t += min(duration, other_duration)
+                if duration != other_duration:
+                    break
+            self._common[floors, other] = t
+        return self._common[floors, other]
+
+    def half_floors(self, floors, t):
+        """Number of half floors passed `t` seconds into a trip."""
+        if floors not in self._crossings:
+            crossings = []
+            for k in range(1, 2 * floors):
+                low, high = 0, self.travel_time(floors)
+                for _ in range(50):
+                    mid = (low + high) / 2
+                    if self.position(floors, mid) < k * self.floor_height / 2:
+                        low = mid
+                    else:
+                        high = mid
+                crossings.append(high)
+            self._crossings[floors] = crossings
+        return bisect_right(self._crossings[floors], t)
+
+    def position(self, floors, t):
+        """Distance covered in metres `t` seconds into a trip."""
+        x = v = a = 0
+        for duration, jerk in self.trip(floors)[0]:
+            dt = min(duration, t)
+            x += v * dt + a * dt ** 2 / 2 + jerk * dt ** 3 / 6
+            v += a * dt + jerk * dt ** 2 / 2
+            a += jerk * dt
+            t -= dt
+            if t <= 0:
+                break
+        return x
+
+    def energy(self, floors):
+        """Estimated energy of a trip in joules."""
+        speed = self.trip(floors)[1]
+        return (self.mass * speed ** 2 / 2 + self.friction * floors * self.floor_height) / self.efficiency
+
+    def _ramp(self, speed):
+        """Constant-jerk phases accelerating from rest to `speed`."""
+        a, j = self.max_acceleration, self.max_jerk
+        if speed >= a * a / j:
+            return [(a / j, j), (speed / a - a / j, 0), (a / j, -j)]
+        t = (speed / j) ** 0.5
+        return [(t, j), (t, -j)]
+
+    def _ramp_distance(self, speed):
+        # A symmetric ramp averages half the final speed
+        return speed * sum(duration for duration, _ in self._ramp(speed)) / 2
+
+
+class Odometer:
+    """Distance, starts, stops and estimated energy of one lift. A run lasts
+    from a start to the next stop; its energy is booked when it ends."""
+
+    __slots__ = ('profile', 'distance', 'starts', 'stops', 'energy', 'run')
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.distance = 0
+        self.starts = 0
+        self.stops = 0
+        self.energy = 0
+        self.run = 0
+
+    def start(self):
+        self.starts += 1
+        self.run = 0
+
+    def move(self, floors):
+        self.run += floors
+        self.distance += floors * self.profile.floor_height
+
+    def stop(self):
+        self.stops += 1
+        if self.run:
+            self.energy += self.profile.energy(round(self.run))
+        self.run = 0
+
+    def __repr__(self):
+        return ('<Odometer %.1f m, %d starts, %d stops, %.1f kJ>'
+                % (self.distance, self.starts, self.stops, self.energy / 1000))
@@ -0,0 +1,162 @@
+"""Per-phase profiling of LiftSimulator.control_loop.
+
+Installing a Profiler shadows each phase in LiftSimulator.PHASES with a timed
+wrapper around whatever the simulator runs for it, and control_loop with one
+that records the tick; uninstalling removes them again, so a simulator that
+is not being profiled runs exactly the code it always does.
+
+For every phase the profiler keeps a total and a maximum. The slowest ticks
+are kept with their phase times, the hall calls pending when the tick began
+and the simulator snapshot after it. `write_folded` writes the phase totals
+as folded stacks in microseconds, which flamegraph.pl, speedscope and
+inferno read directly.
+
+Usage: python profiler.py [-n 40] [-m 8] [--pattern up-peak] [--rate 30]
+                          [--duration 3600] [--zones single] [--slowest 5]
+                          [--folded FILE]
+"""
+import argparse
+import heapq
+import random
+
+import traffic
+import zones as zoning
+from inputs import clock
+from lab4 import *
+
+
+PHASES = LiftSimulator.PHASES
+
+################################################################################
+
+
+class SlowTick:
+
+    def __init__(self, duration, tick, phases, pending, snapshot):
+        self.duration = duration
+        self.tick = tick
+        self.phases = phases
+        self.pending = pending
+        self.snapshot = snapshot
+
+    def __lt__(self, other):
+        return self.duration < other.duration
+
+    def __str__(self):
+        up, down = self.pending
+        return ('tick %d: %.3f ms (%s), pending UP %s DOWN %s' %
+                (self.tick, self.duration * 1000,
+                 ', '.join('%s %.3f' % (name, t * 1000) for name, t in zip(PHASES, self.phases)),
+                 floors(up), floors(down)))
+
+
+class Profiler:
+
+    def __init__(self, sim, slowest=10):
+        self.sim = sim
+        self.slowest = slowest
+        self.ticks = 0
+        self.totals = [0.0] * len(PHASES)
+        self.maxima = [0.0] * len(PHASES)
+        self.total = 0.0
+        self.slow = []
+
+        self.phases = [0.0] * len(PHASES)
+        self.shadowed = {}
+
+    def install(self):
+        sim = self.sim
+        for name in PHASES + ('control_loop',):
+            self.shadowed[name] = sim.__dict__.get(name)
+        for i, name in enumerate(PHASES):
+            setattr(sim, name, self.timed(i, getattr(sim, name)))
+        sim.control_loop = self.control_loop
+        return self
+
+    def uninstall(self):
+        sim = self.sim
+        for name, previous in self.shadowed.items():
+            if previous is None:
+                sim.__dict__.pop(name, None)
+            else:
+                setattr(sim, name, previous)
+        self.shadowed = {}
+
+    def timed(self, i, phase):
+        def run():
+            started = clock()
+            phase()
+            self.phases[i] += clock() - started
+        return run
+
+    def control_loop(self):
+        sim = self.sim
+        pending = (tuple(sim.requests[DIRECTION_UP]), tuple(sim.requests[DIRECTION_DOWN]))
+        self.phases = [0.0] * len(PHASES)
+        started = clock()
+        type(sim).control_loop(sim)
+        self.record(clock() - started, pending)
+
+    def record(self, duration, pending):
+        self.ticks += 1
+        phases = self.phases
+        for i, t in enumerate(phases):
+            self.totals[i] += t
+            if t > self.maxima[i]:
+                self.maxima[i] = t
+
+        self.total += duration
+        if len(self.slow) < self.slowest or duration > self.slow[0].duration:
+            tick = SlowTick(duration, self.sim.ctrl_loop_count, phases, pending, self.sim.snapshot())
+            if len(self.slow) < self.slowest:
+                heapq.heappush(self.slow, tick)
+            else:
+                heapq.heapreplace(self.slow, tick)
+
+    # Output
+
+    def report(self):
+        lines = ['%d ticks, %.3f ms per tick on average' % (self.ticks, self.total / max(self.ticks, 1) * 1000),
+                 '%-16s %10s %10s %10s %6s' % ('phase', 'total ms', 'mean us', 'max ms', 'share')]
+        for name, total, maximum in zip(PHASES, self.totals, self.maxima):
+            lines.append('%-16s %10.1f %10.2f %10.3f %5.1f%%' %
+                         (name, total * 1000, total / max(self.ticks, 1) * 1e6, maximum * 1000,
+                          total / self.total * 100 if self.total else 0))
+        if self.slow:
+            lines.append('slowest ticks:')
+            lines.extend('  %s' % tick for tick in sorted(self.slow, reverse=True))
+        return '\n'.join(lines)
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for name, total in zip(PHASES, self.totals):
+                f.write('control_loop;%s %d\n' % (name, round(total * 1e6)))
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Control loop profile under passenger traffic.')
+    parser.add_argument('-n', type=int, default=40, help='number of floors')
+    parser.add_argument('-m', type=int, default=8, help='number of lifts')
+    parser.add_argument('--pattern', choices=traffic.PATTERNS, default=traffic.UP_PEAK)
+    parser.add_argument('--rate', type=float, default=30, help='arrivals per minute')
+    parser.add_argument('--duration', type=float, default=3600, help='simulated seconds')
+    parser.add_argument('--zones', choices=sorted(zoning.PRESETS), default='single')
+    parser.add_argument('--slowest', type=int, default=5)
+    parser.add_argument('--folded', default=None, metavar='FILE', help='write folded stacks for flame graphs')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sim = LiftSimulator(ui=False, config=Config(floors=args.n, lifts=args.m,
+                                                zones=zoning.PRESETS[args.zones](args.n, args.m)))
+    profiler = Profiler(sim, args.slowest).install()
+    driver = traffic.TrafficDriver(sim, traffic.generate(random.Random(args.seed), args.n, args.pattern,
+                                                         args.rate, args.duration))
+    driver.run(args.duration)
+    profiler.uninstall()
+
+    print(profiler.report())
+    if args.folded is not None:
+        profiler.write_folded(args.folded)
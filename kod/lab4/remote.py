@@ -0,0 +1,373 @@
+"""Remote panels: an asyncio server that lets any number of clients (kiosks,
+load-test bots) place calls on a headless LiftSimulator and follow its state,
+and a load generator for it.
+
+Everything runs on one event loop, the control loop included, so there are
+no threads per client and no locks. Calls are collected as they come in and
+handled all together at the next control tick; after every tick the state is
+encoded once and the same bytes are written to every subscriber. A
+subscriber that does not keep up is skipped until its socket drains, it then
+gets the latest state, never a backlog.
+
+The protocol is binary and little endian. Client to server, 8 bytes each:
+
+    u8 type, u8 a, u16 b, u32 sequence
+        HALL       a = direction (0 UP, 1 DOWN), b = floor
+        CAR        a = car, b = floor
+        STOP       a = car
+        SUBSCRIBE  start receiving STATE frames
+        UNSUBSCRIBE
+
+Server to client, each frame prefixed with u8 type, u8 0, u16 payload size:
+
+    HELLO  u16 floors, u16 lifts, f32 control interval, on connect
+    ACK    u32 sequence, u32 tick: the call was handled in that tick
+    STATE  u32 tick, per car f32 position, i8 direction, i8 doors,
+           u8 flags (1 idle, 2 stopped, 4 out of service), 1x,
+           then floors x u8 UP calls, floors x u8 DOWN calls
+
+Floors and cars are numbered from 0. Calls out of range are acknowledged with
+tick 0 and dropped; an unknown message type closes the connection.
+
+Usage: python remote.py serve [-n 5] [-m 2] [--port 9200 | --unix PATH]
+       python remote.py load [--port 9200 | --unix PATH] [--clients 1000]
+                             [--callers 10] [--rate 500] [--duration 10]
+"""
+import argparse
+import asyncio
+import os
+import random
+import struct
+
+from inputs import *
+from lab4 import *
+
+
+MSG_HALL = 1
+MSG_CAR = 2
+MSG_STOP = 3
+MSG_SUBSCRIBE = 4
+MSG_UNSUBSCRIBE = 5
+
+FRAME_HELLO = 1
+FRAME_ACK = 2
+FRAME_STATE = 3
+
+MESSAGE = struct.Struct('<BBHI')
+FRAME = struct.Struct('<BxH')
+HELLO = struct.Struct('<HHf')
+ACK = struct.Struct('<II')
+STATE_TICK = struct.Struct('<I')
+STATE_CAR = struct.Struct('<fbbBx')
+
+FLAG_IDLE = 1
+FLAG_STOPPED = 2
+FLAG_OUT_OF_SERVICE = 4
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9200
+
+################################################################################
+
+
+def frame(kind, payload):
+    return FRAME.pack(kind, len(payload)) + payload
+
+
+def encode_state(sim):
+    parts = [STATE_TICK.pack(sim.ctrl_loop_count)]
+    for elevator in sim.elevators:
+        parts.append(STATE_CAR.pack(elevator.position, elevator.direction, elevator.doors,
+                                    FLAG_IDLE * elevator.idle | FLAG_STOPPED * elevator.stopped |
+                                    FLAG_OUT_OF_SERVICE * (not elevator.in_service)))
+    parts.append(bytes(sim.requests[DIRECTION_UP]))
+    parts.append(bytes(sim.requests[DIRECTION_DOWN]))
+    return frame(FRAME_STATE, b''.join(parts))
+
+
+class PanelProtocol(asyncio.Protocol):
+
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.buffer = b''
+        self.paused = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.connections += 1
+        config = self.server.sim.config
+        transport.write(frame(FRAME_HELLO, HELLO.pack(config.floors, config.lifts, config.control_interval)))
+
+    def connection_lost(self, exc):
+        self.server.connections -= 1
+        self.server.subscribers.discard(self)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+
+    def data_received(self, data):
+        data = self.buffer + data
+        end = len(data) - len(data) % MESSAGE.size
+        for kind, a, b, sequence in MESSAGE.iter_unpack(data[:end]):
+            if kind == MSG_SUBSCRIBE:
+                self.server.subscribers.add(self)
+            elif kind == MSG_UNSUBSCRIBE:
+                self.server.subscribers.discard(self)
+            elif kind in (MSG_HALL, MSG_CAR, MSG_STOP):
+                self.server.pending.append((self, kind, a, b, sequence))
+            else:
+                self.transport.close()
+                return
+        self.buffer = data[end:]
+
+
+class PanelServer:
+    """Runs a simulator's control loop on the event loop and serves panels."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.pending = []
+        self.acks = {}          # client: ACK payloads waiting for a tick to run
+        self.subscribers = set()
+        self.connections = 0
+
+        self.calls = 0
+        self.rejected = 0
+        self.frames = 0
+        self.skipped = 0
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        loop = asyncio.get_running_loop()
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.server = await loop.create_unix_server(lambda: PanelProtocol(self), path)
+        else:
+            self.server = await loop.create_server(lambda: PanelProtocol(self), host, port, backlog=4096)
+        return self
+
+    async def run(self):
+        sim = self.sim
+        interval = sim.config.control_interval
+        while True:
+            if sim.first_deadline is not None:
+                delay = sim.first_deadline + sim.deadline * interval - clock()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.tick()
+
+    def tick(self):
+        sim = self.sim
+        batch, self.pending = self.pending, []
+        for client, kind, a, b, sequence in batch:
+            self.acks.setdefault(client, []).append((sequence, self.handle(kind, a, b)))
+
+        ran = sim.advance(clock())
+        if not ran:
+            return
+        # The calls handled above were seen by the first of the ticks that ran
+        tick = sim.ctrl_loop_count - ran + 1
+        acks, self.acks = self.acks, {}
+        for client, calls in acks.items():
+            if not client.transport.is_closing():
+                client.transport.write(b''.join(frame(FRAME_ACK, ACK.pack(sequence, tick if handled else 0))
+                                                for sequence, handled in calls))
+        self.broadcast(encode_state(sim))
+
+    def handle(self, kind, a, b):
+        sim = self.sim
+        n, m = sim.config.floors, sim.config.lifts
+        if kind == MSG_HALL and a in (DIRECTION_UP, DIRECTION_DOWN) and b < n:
+            sim.handle_event(Event(EVENT_HALL_UP if a == DIRECTION_UP else EVENT_HALL_DOWN, b, None, clock()))
+        elif kind == MSG_CAR and a < m and b < n:
+            sim.handle_event(Event(EVENT_CAR_CALL, a, b, clock()))
+        elif kind == MSG_STOP and a < m:
+            sim.handle_event(Event(EVENT_STOP, a, None, clock()))
+        else:
+            self.rejected += 1
+            return False
+        self.calls += 1
+        return True
+
+    def broadcast(self, data):
+        self.frames += 1
+        for client in self.subscribers:
+            if client.paused:
+                self.skipped += 1
+            else:
+                client.transport.write(data)
+
+    def close(self):
+        self.server.close()
+
+
+################################################################################
+
+
+class LoadClient(asyncio.Protocol):
+
+    def __init__(self, load):
+        self.load = load
+        self.transport = None
+        self.buffer = b''
+        self.ready = asyncio.get_running_loop().create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        if not self.ready.done():
+            self.ready.set_exception(exc or ConnectionError('closed before HELLO'))
+
+    def data_received(self, data):
+        data = self.buffer + data
+        offset = 0
+        while len(data) - offset >= FRAME.size:
+            kind, size = FRAME.unpack_from(data, offset)
+            if len(data) - offset - FRAME.size < size:
+                break
+            payload = data[offset + FRAME.size:offset + FRAME.size + size]
+            offset += FRAME.size + size
+            if kind == FRAME_HELLO:
+                if not self.ready.done():
+                    self.ready.set_result(HELLO.unpack(payload))
+            elif kind == FRAME_ACK:
+                self.load.acked(*ACK.unpack(payload))
+            elif kind == FRAME_STATE:
+                self.load.state(STATE_TICK.unpack_from(payload)[0])
+        self.buffer = data[offset:]
+
+
+class LoadGenerator:
+    """Opens `clients` subscribed connections and places `rate` random calls
+    per second through the first `callers` of them. A call's latency runs
+    from sending it until the first STATE frame of the tick that handled it
+    reaches the load generator."""
+
+    def __init__(self, clients, callers, rate, seed=1):
+        self.clients = clients
+        self.callers = callers
+        self.rate = rate
+        self.rng = random.Random(seed)
+
+        self.sent = {}
+        self.waiting = {}
+        self.sequence = 0
+        self.acks = 0
+        self.rejected = 0
+        self.updates = 0
+        self.latencies = []
+        self.last_tick = 0
+
+    def acked(self, sequence, tick):
+        sent = self.sent.pop(sequence, None)
+        if sent is None:
+            return
+        self.acks += 1
+        if tick == 0:
+            self.rejected += 1
+        elif tick <= self.last_tick:
+            self.latencies.append(clock() - sent)
+        else:
+            self.waiting.setdefault(tick, []).append(sent)
+
+    def state(self, tick):
+        self.updates += 1
+        if tick > self.last_tick:
+            self.last_tick = tick
+            now = clock()
+            for t in [t for t in self.waiting if t <= tick]:
+                self.latencies.extend(now - sent for sent in self.waiting.pop(t))
+
+    async def connect(self, host, port, path):
+        loop = asyncio.get_running_loop()
+        if path is not None:
+            _, client = await loop.create_unix_connection(lambda: LoadClient(self), path)
+        else:
+            _, client = await loop.create_connection(lambda: LoadClient(self), host, port)
+        return client
+
+    async def run(self, duration, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        connections = [await self.connect(host, port, path) for _ in range(self.clients)]
+        floors, lifts, _ = await connections[0].ready
+        for client in connections:
+            client.transport.write(MESSAGE.pack(MSG_SUBSCRIBE, 0, 0, 0))
+        callers = connections[:max(1, self.callers)]
+
+        started = clock()
+        count = 0
+        while clock() - started < duration:
+            # Catch up with the schedule in one go, then sleep a millisecond
+            due = int((clock() - started) * self.rate)
+            while count < due:
+                self.sequence += 1
+                if self.rng.random() < 0.5:
+                    message = MESSAGE.pack(MSG_HALL, self.rng.randrange(2), self.rng.randrange(floors), self.sequence)
+                else:
+                    message = MESSAGE.pack(MSG_CAR, self.rng.randrange(lifts), self.rng.randrange(floors), self.sequence)
+                self.sent[self.sequence] = clock()
+                callers[count % len(callers)].transport.write(message)
+                count += 1
+            await asyncio.sleep(0.001)
+        elapsed = clock() - started
+        await asyncio.sleep(0.5)
+
+        for client in connections:
+            client.transport.close()
+        return count, elapsed
+
+    def report(self, count, elapsed):
+        latencies = sorted(self.latencies)
+        pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0
+        return ('%d clients, %d calls in %.1fs: %.0f calls/s sent, %.0f acknowledged/s (%d rejected, %d unanswered)\n'
+                '%d state frames received, %.0f/s\n'
+                'call -> state latency: p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms' %
+                (self.clients, count, elapsed, count / elapsed, self.acks / elapsed, self.rejected,
+                 len(self.sent) + sum(map(len, self.waiting.values())),
+                 self.updates, self.updates / elapsed,
+                 pick(0.5), pick(0.9), pick(0.99), pick(1)))
+
+
+################################################################################
+
+
+async def serve(args):
+    sim = LiftSimulator(ui=False, config=Config(floors=args.n, lifts=args.m))
+    server = await PanelServer(sim).start(args.host, args.port, args.unix)
+    print('Serving %d floors, %d lifts on %s' % (args.n, args.m, args.unix or '%s:%d' % (args.host, args.port)))
+    try:
+        await server.run()
+    finally:
+        server.close()
+        print('%d calls handled, %d rejected, %d state frames, %d skipped for slow subscribers' %
+              (server.calls, server.rejected, server.frames, server.skipped))
+
+
+async def load(args):
+    generator = LoadGenerator(args.clients, args.callers, args.rate)
+    count, elapsed = await generator.run(args.duration, args.host, args.port, args.unix)
+    print(generator.report(count, elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Network panels for the lift simulator.')
+    parser.add_argument('role', choices=('serve', 'load'))
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--unix', default=None, metavar='PATH', help='use a Unix socket instead of TCP')
+    parser.add_argument('-n', type=int, default=5, help='serve: number of floors')
+    parser.add_argument('-m', type=int, default=2, help='serve: number of lifts')
+    parser.add_argument('--clients', type=int, default=1000, help='load: subscribed connections')
+    parser.add_argument('--callers', type=int, default=10, help='load: connections placing calls')
+    parser.add_argument('--rate', type=float, default=500, help='load: calls per second')
+    parser.add_argument('--duration', type=float, default=10, help='load: seconds')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args) if args.role == 'serve' else load(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,227 @@
+"""Rollout dispatching: each new hall call goes to the car that, simulated a
+little way ahead, keeps passengers waiting least.
+
+Installing a RolloutDispatcher shadows the simulator's assign_requests. It
+assigns calls in the same order as the built-in dispatcher and considers the
+same cars, but when more than one car could take a call it tries each: the
+simulator is snapshotted into a scratch copy, the call is given to the car,
+and the copy runs `horizon` seconds ahead under the built-in dispatcher with
+sampled traffic. Every car is tried on the same samples. The traffic is one
+passenger per pending hall call plus arrivals drawn at the rate, and with the
+floors and directions, of the hall calls seen lately; destinations are
+guessed. The car with the least passenger seconds waited, on average, gets
+the call.
+
+Rollouts run on a coarser control interval than the simulator, and within a
+time budget per tick: calls left when it runs out go to the closest car, as
+they would without rollouts. With jobs > 0 the rollouts of a call are spread
+over a process pool, one at a time per worker, so rollouts abandoned when the
+budget ran out hold up later ones by no more than one rollout.
+
+Usage: python traffic.py --dispatch greedy rollout (compares the two)
+"""
+import multiprocessing
+import random
+from collections import deque
+
+import traffic
+from inputs import clock
+from lab4 import *
+
+
+HORIZON = 30        # seconds simulated ahead
+SAMPLES = 3         # traffic samples per car
+BUDGET = 0.05       # seconds per tick
+INTERVAL = 0.5      # control interval of the rollouts
+WINDOW = 300        # seconds of hall calls the traffic is estimated from
+
+################################################################################
+
+
+def rollout_config(config, interval):
+    return Config(floors=config.floors, lifts=config.lifts, action_times=config.action_times,
+                  control_interval=interval, zones=config.zones, motion=config.motion, dwell=config.dwell)
+
+
+def rollout(sim, snapshot, d, floor, car, passengers, horizon):
+    """Passenger seconds waited over `horizon` seconds, after giving the call
+    to `car` in a copy of the simulator restored into `sim`. `passengers` are
+    (arrival, origin, destination) tuples."""
+    sim.restore(snapshot)
+    sim.assign(sim.elevators[car], d, floor)
+
+    driver = traffic.TrafficDriver(sim, [traffic.Passenger(i, arrival, origin, destination)
+                                         for i, (arrival, origin, destination) in enumerate(passengers)])
+    interval = sim.config.control_interval
+    cost = 0
+    for _ in range(int(horizon / interval)):
+        driver.tick()
+        cost += sum(len(queue) for queues in driver.waiting for queue in queues) * interval
+    return cost
+
+
+# Process pool side: each worker keeps a scratch simulator of its own
+
+_scratch = None
+
+
+def _init_worker(config):
+    global _scratch
+    _scratch = LiftSimulator(ui=False, config=config)
+
+
+def _rollout_worker(snapshot, d, floor, car, passengers, horizon):
+    return rollout(_scratch, snapshot, d, floor, car, passengers, horizon)
+
+
+class RolloutDispatcher:
+
+    def __init__(self, sim, horizon=HORIZON, samples=SAMPLES, budget=BUDGET, interval=INTERVAL, jobs=0, seed=1):
+        self.sim = sim
+        self.horizon = horizon
+        self.samples = samples
+        self.budget = budget
+        self.rng = random.Random(seed)
+
+        config = rollout_config(sim.config, interval)
+        self.scratch = LiftSimulator(ui=False, config=config)
+        self.pool = multiprocessing.Pool(jobs, _init_worker, (config,)) if jobs > 0 else None
+        self.jobs = jobs
+        self.in_flight = []     # pool results not collected yet, abandoned ones included
+
+        # Hall calls seen: when, and how many per direction and floor
+        self.pending = set()
+        self.seen = deque()
+        self.counts = [[0] * sim.config.floors for _ in range(2)]
+
+        self.decided = 0
+        self.fallbacks = 0
+        self.rollouts = 0
+
+    def install(self):
+        self.sim.assign_requests = self.assign_requests
+        return self
+
+    def uninstall(self):
+        if self.sim.__dict__.get('assign_requests') == self.assign_requests:
+            del self.sim.assign_requests
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+            self.in_flight = []
+
+    # Dispatching
+
+    def assign_requests(self):
+        started = clock()
+        sim = self.sim
+        self.observe()
+
+        while True:
+            calls = sim.open_calls()
+            if not calls:
+                return
+            d, floor, cars = min(calls, key=lambda call: call[2][0].distance(call[1]))
+
+            car = cars[0]
+            if len(cars) > 1:
+                chosen = self.choose(d, floor, cars, started + self.budget)
+                if chosen is None:
+                    self.fallbacks += 1
+                else:
+                    car = chosen
+                    self.decided += 1
+            sim.assign(car, d, floor)
+
+    def choose(self, d, floor, cars, deadline):
+        """The car with the least expected wait, or None if the budget ran out
+        before every car was tried on every sample."""
+        if clock() > deadline:
+            return None
+        snapshot = self.sim.snapshot()
+        samples = [self.sample() for _ in range(self.samples)]
+        tasks = [(snapshot, d, floor, car.id, passengers, self.horizon) for passengers in samples for car in cars]
+
+        if self.pool is not None:
+            costs = self.run_pool(tasks, deadline)
+            if costs is None:
+                return None
+        else:
+            costs = []
+            for task in tasks:
+                if clock() > deadline:
+                    return None
+                costs.append(rollout(self.scratch, *task))
+        self.rollouts += len(tasks)
+
+        totals = [sum(costs[i::len(cars)]) for i in range(len(cars))]
+        return cars[totals.index(min(totals))]
+
+    def run_pool(self, tasks, deadline):
+        """The costs of `tasks` from the pool, or None if the deadline came
+        first. A task is only submitted when a worker is free for it."""
+        costs = [None] * len(tasks)
+        queued = deque(enumerate(tasks))
+        running = deque()
+        while queued or running:
+            self.in_flight = [result for result in self.in_flight if not result.ready()]
+            while queued and len(self.in_flight) < self.jobs:
+                i, task = queued.popleft()
+                result = self.pool.apply_async(_rollout_worker, task)
+                self.in_flight.append(result)
+                running.append((i, result))
+
+            oldest = running[0][1] if running else self.in_flight[0]
+            oldest.wait(max(0, deadline - clock()))
+            if not oldest.ready():
+                return None
+            while running and running[0][1].ready():
+                i, result = running.popleft()
+                costs[i] = result.get()
+        return costs
+
+    # Traffic model
+
+    def observe(self):
+        sim = self.sim
+        now = sim.now()
+        pending = {(d, floor) for d in (DIRECTION_UP, DIRECTION_DOWN)
+                   for floor, called in enumerate(sim.requests[d]) if called}
+        for d, floor in pending - self.pending:
+            self.seen.append((now, d, floor))
+            self.counts[d][floor] += 1
+        self.pending = pending
+
+        while self.seen and self.seen[0][0] < now - WINDOW:
+            _, d, floor = self.seen.popleft()
+            self.counts[d][floor] -= 1
+
+    def sample(self):
+        """One guess at the traffic: a passenger per pending call, then
+        arrivals over the horizon."""
+        n = self.sim.config.floors
+        rng = self.rng
+        passengers = [(0, floor, self.destination(d, floor)) for d, floor in sorted(self.pending)
+                      if self.can_go(d, floor)]
+
+        calls = [(d, floor) for d in (DIRECTION_UP, DIRECTION_DOWN) for floor in range(n)
+                 if self.counts[d][floor] and self.can_go(d, floor)]
+        if not calls:
+            return passengers
+        weights = [self.counts[d][floor] for d, floor in calls]
+        rate = len(self.seen) / min(WINDOW, max(self.sim.now(), self.sim.config.control_interval))
+
+        t = rng.expovariate(rate)
+        while t < self.horizon:
+            d, floor = rng.choices(calls, weights)[0]
+            passengers.append((t, floor, self.destination(d, floor)))
+            t += rng.expovariate(rate)
+        return passengers
+
+    def can_go(self, d, floor):
+        return floor + 1 < self.sim.config.floors if d == DIRECTION_UP else floor > 0
+
+    def destination(self, d, floor):
+        if d == DIRECTION_UP:
+            return self.rng.randrange(floor + 1, self.sim.config.floors)
+        return self.rng.randrange(0, floor)
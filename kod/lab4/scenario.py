@@ -0,0 +1,224 @@
+"""Timed lift scenarios run against the headless LiftSimulator on a virtual
+clock, many scripts in parallel.
+
+A scenario is a list of statements separated by newlines or `;`, `#` starts a
+comment. Floors and lifts are numbered from 1, as on the panel:
+
+    t=0 hall 5 UP                   hall call
+    t=2 car2 floor 2                call from inside lift 2
+    t=2 press car2 floor 2          the same, clicked on the car button
+                                    (through the input classifier)
+    t=4 stop car1                   STOP button of lift 1
+    t=6 fault car2                  take lift 2 out of service
+    t=9 repair car2                 ... and back into service
+    t=30 expect car1 at 5 open UP   check a lift (state words are optional:
+                                    open/opening/closed/closing/moving,
+                                    UP/DOWN/NONE, idle, stopped)
+    t=30 expect car1 at 5 within 20 ... or wait up to 20 s for it to hold
+    t=30 expect call 3 DOWN served  check a hall call (served/pending)
+
+Usage: python scenario.py [-j JOBS] FILE...
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+
+from lab4 import *
+
+
+DOOR_WORDS = {'open': DOORS_OPEN, 'opening': DOORS_OPENING, 'closed': DOORS_CLOSED, 'closing': DOORS_CLOSING}
+CLICK = 0.1     # seconds from one click of a pressed car button to the next
+DIRECTION_WORDS = {'UP': DIRECTION_UP, 'DOWN': DIRECTION_DOWN, 'NONE': DIRECTION_NONE}
+
+################################################################################
+
+
+class ScenarioError(Exception):
+    pass
+
+
+class Step:
+
+    def __init__(self, t, line, kind, args, within=0):
+        self.t = t
+        self.line = line
+        self.kind = kind
+        self.args = args
+        self.within = within
+
+    def __repr__(self):
+        return '<Step t=%g %s>' % (self.t, self.line)
+
+
+class Scenario:
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = sorted(steps, key=lambda step: step.t)
+        self.duration = max((step.t + step.within for step in self.steps), default=0)
+
+
+def parse(name, text):
+    steps = []
+    for lineno, raw in enumerate(text.splitlines(), 1):
+        for statement in raw.split('#', 1)[0].split(';'):
+            statement = statement.strip()
+            if statement:
+                try:
+                    steps.append(parse_statement(statement))
+                except (ValueError, IndexError):
+                    raise ScenarioError('%s:%d: cannot parse "%s"' % (name, lineno, statement))
+    return Scenario(name, steps)
+
+
+def parse_statement(statement):
+    words = statement.split()
+    if not words[0].startswith('t='):
+        raise ValueError(statement)
+    t = float(words[0][2:])
+    words = words[1:]
+
+    if words[0] == 'hall':
+        return Step(t, statement, 'hall', (_floor(words[1]), DIRECTION_WORDS[words[2].upper()]))
+    elif words[0] == 'press' and words[2] == 'floor':
+        return Step(t, statement, 'press', (_car(words[1]), _floor(words[3])))
+    elif words[0].startswith('car') and words[1] == 'floor':
+        return Step(t, statement, 'car', (_car(words[0]), _floor(words[2])))
+    elif words[0] in ('stop', 'fault', 'repair'):
+        return Step(t, statement, words[0], (_car(words[1]),))
+    elif words[0] == 'expect':
+        within = 0
+        if 'within' in words:
+            i = words.index('within')
+            within = float(words[i + 1])
+            words = words[:i] + words[i + 2:]
+        if words[1] == 'call':
+            served = {'served': True, 'pending': False}[words[4]]
+            return Step(t, statement, 'expect_call', (_floor(words[2]), DIRECTION_WORDS[words[3].upper()], served), within)
+        return Step(t, statement, 'expect_car', (_car(words[1]), _floor(words[3]), words[4:]), within)
+    raise ValueError(statement)
+
+
+def _floor(word):
+    floor = int(word) - 1
+    if not 0 <= floor < N:
+        raise ValueError(word)
+    return floor
+
+
+def _car(word):
+    car = int(word[3:] if word.startswith('car') else word) - 1
+    if not 0 <= car < M:
+        raise ValueError(word)
+    return car
+
+
+################################################################################
+
+
+def check(sim, step):
+    """Returns None if the expectation holds, a description of what was found
+    otherwise."""
+    if step.kind == 'expect_call':
+        floor, d, served = step.args
+        if sim.requests[d][floor] == served:
+            return 'call is %s' % ('pending' if served else 'served')
+        return None
+
+    car, floor, words = step.args
+    elevator = sim.elevators[car]
+    found = str(elevator)
+    if elevator.position != floor:
+        return found
+    for word in words:
+        if word in DOOR_WORDS and elevator.doors != DOOR_WORDS[word]:
+            return found
+        if word.upper() in DIRECTION_WORDS and elevator.direction != DIRECTION_WORDS[word.upper()]:
+            return found
+        if word == 'moving' and elevator.state != LIFT_MOVING:
+            return found
+        if word == 'idle' and not elevator.idle:
+            return found
+        if word == 'stopped' and not elevator.stopped:
+            return found
+    return None
+
+
+def run(scenario):
+    """Runs a scenario to completion, returns (name, failures, ticks)."""
+    sim = LiftSimulator(ui=False)
+    pending = list(scenario.steps)
+    waiting = []
+    failures = []
+
+    ticks = 0
+    now = 0
+    while pending or waiting:
+        while pending and pending[0].t <= now + 1e-9:
+            step = pending.pop(0)
+            if step.kind == 'hall':
+                floor, d = step.args
+                sim.handle_event(Event(EVENT_HALL_UP if d == DIRECTION_UP else EVENT_HALL_DOWN, floor, None, now))
+            elif step.kind == 'car':
+                sim.handle_event(Event(EVENT_CAR_CALL, step.args[0], step.args[1], now))
+            elif step.kind == 'press':
+                car, floor = step.args
+                for click in range(floor + 1):
+                    sim.inputs.push(INPUT_CAR, car, True, now + click * CLICK)
+                    sim.inputs.push(INPUT_CAR, car, False, now + (click + 0.5) * CLICK)
+            elif step.kind == 'stop':
+                sim.handle_event(Event(EVENT_STOP, step.args[0], None, now))
+            elif step.kind == 'fault':
+                sim.take_out_of_service(step.args[0])
+            elif step.kind == 'repair':
+                sim.return_to_service(step.args[0])
+            else:
+                waiting.append(step)
+
+        for step in list(waiting):
+            found = check(sim, step)
+            if found is None:
+                waiting.remove(step)
+            elif now >= step.t + step.within - 1e-9:
+                waiting.remove(step)
+                failures.append('%s -> %s (at t=%.1f)' % (step.line, found, now))
+
+        if not pending and not waiting:
+            break
+
+        sim.control_loop()
+        ticks += 1
+        now = ticks * CONTROL_INTERVAL
+
+    return scenario.name, failures, ticks
+
+
+def run_file(path):
+    try:
+        with open(path) as f:
+            return run(parse(path, f.read()))
+    except (OSError, ScenarioError) as e:
+        return path, [str(e)], 0
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch runner for lift scenarios.')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    failed = 0
+    with multiprocessing.Pool(args.jobs) as pool:
+        for name, failures, ticks in pool.imap_unordered(run_file, args.files):
+            print('%s %s (%.1f s simulated)' % ('FAIL' if failures else 'PASS', name, ticks * CONTROL_INTERVAL))
+            for failure in failures:
+                print('    %s' % failure)
+            failed += bool(failures)
+
+    print('%d scenarios, %d failed in %.2fs' % (len(args.files), failed, time.perf_counter() - started))
+    sys.exit(1 if failed else 0)
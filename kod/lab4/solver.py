@@ -0,0 +1,291 @@
+"""Offline dispatch: a beam search for the assignment of hall calls to cars
+that keeps passengers waiting least, given the whole traffic in advance. It
+is a baseline to measure online dispatchers against, not a dispatcher.
+
+Every node of the beam is a live headless simulator with its own traffic
+driver, all of them at the same tick. The simulators' own dispatcher is
+switched off; whenever hall calls come up that no car holds, every node
+forks once per car that could take the first of them (any car the built-in
+dispatcher considers, not only the closest), by snapshotting it into a
+pooled simulator.
+The children are then merged, nodes in the same state keeping only the
+cheapest, and pruned to the beam width by their cost so far plus an estimate
+of what the calls still pending will cost.
+
+The cost is what passengers wait for a lift, in passenger seconds, up to the
+point where everyone is delivered or the horizon is reached. Online policies
+are run on the same passengers and scored the same way.
+
+Usage: python solver.py [--width 16] [--scenario up-peak ...]
+       python solver.py [-n 10] [-m 3] [--pattern up-peak] [--rate 12]
+                        [--duration 600] [--seed 1] [--width 16]
+       python solver.py --trace DIR [-n 10] [-m 3] (the passengers of a trace)
+"""
+import argparse
+import random
+import time
+
+import traffic
+from lab4 import *
+
+
+DRAIN = 600     # seconds after the last arrival before giving up on anyone
+
+# name: (floors, lifts, pattern, arrivals per minute, seconds)
+SCENARIOS = {
+    'up-peak': (10, 3, traffic.UP_PEAK, 12, 900),
+    'down-peak': (10, 3, traffic.DOWN_PEAK, 12, 900),
+    'interfloor': (10, 3, traffic.INTERFLOOR, 12, 900),
+    'tower': (20, 4, traffic.INTERFLOOR, 20, 600),
+}
+
+################################################################################
+
+
+class Node:
+
+    __slots__ = ('sim', 'driver', 'cost', 'assignments', 'incumbent', 'started')
+
+    def __init__(self, sim, driver):
+        self.sim = sim
+        self.driver = driver
+        self.cost = 0
+        self.assignments = 0
+        self.started = None     # what tick_after_assign finishes the tick with
+
+        # Whether the node is where always taking the closest car leads, or
+        # at least in the same state and no more expensive
+        self.incumbent = True
+
+
+def copy_passengers(passengers):
+    return [traffic.Passenger(i, p.arrival, p.origin, p.destination) for i, p in enumerate(passengers)]
+
+
+def waiting(driver):
+    return sum(len(queue) for queues in driver.waiting for queue in queues)
+
+
+def finished(driver):
+    return not driver.arrivals and not any(driver.riding) and not waiting(driver)
+
+
+def horizon(passengers):
+    return (passengers[-1].arrival if passengers else 0) + DRAIN
+
+
+class BeamSolver:
+
+    def __init__(self, config, passengers, width=16):
+        self.config = config
+        self.passengers = passengers
+        self.width = width
+        self.pool = []
+
+        motion = config.motion
+        self.floor_time = 2 * config.action_times['MOVE'] if motion is None else motion.travel_time(1)
+
+        self.decisions = 0
+        self.forks = 0
+        self.merged = 0
+
+    def node(self):
+        if self.pool:
+            return self.pool.pop()
+        sim = LiftSimulator(ui=False, config=self.config)
+        sim.assign_requests = lambda: None
+        return Node(sim, traffic.TrafficDriver(sim, copy_passengers(self.passengers)))
+
+    def fork(self, node):
+        self.forks += 1
+        child = self.node()
+        child.sim.restore(node.sim.snapshot())
+        child.sim.ctrl_loop_count = node.sim.ctrl_loop_count
+        child.driver.restore(node.driver.snapshot())
+        child.cost = node.cost
+        child.assignments = node.assignments
+        child.started = node.started
+        child.incumbent = False
+        return child
+
+    # Search
+
+    def solve(self):
+        """Returns the cheapest node at the end."""
+        interval = self.config.control_interval
+        end = horizon(self.passengers)
+        beam = [self.node()]
+
+        while beam[0].driver.now < end:
+            # A control tick split where the dispatcher would assign calls
+            for node in beam:
+                node.driver.move_passengers()
+                node.started = node.sim.tick_before_assign()
+            if any(node.sim.open_calls() for node in beam):
+                beam = self.expand(beam)
+
+            done = True
+            for node in beam:
+                sim, driver = node.sim, node.driver
+                sim.tick_after_assign(node.started)
+                driver.advance()
+                node.cost += waiting(driver) * interval
+                done = done and finished(driver)
+            if done:
+                break
+
+        return min(beam, key=lambda node: node.cost)
+
+    def expand(self, beam):
+        """Assigns every open call in every node, one call at a time, forking
+        for the choice of car and pruning after each round."""
+        while True:
+            children = []
+            expanded = False
+            for node in beam:
+                calls = node.sim.open_calls()
+                if not calls:
+                    children.append(node)
+                    continue
+
+                # The call the built-in dispatcher would assign next, so that
+                # always following the closest car reproduces it exactly
+                expanded = True
+                self.decisions += 1
+                d, floor, cars = min(calls, key=lambda call: call[2][0].distance(call[1]))
+                forks = [self.fork(node) for _ in cars[1:]]
+                node.sim.assign(cars[0], d, floor)
+                node.assignments += 1
+                children.append(node)
+                for child, car in zip(forks, cars[1:]):
+                    child.sim.assign(child.sim.elevators[car.id], d, floor)
+                    child.assignments += 1
+                    children.append(child)
+
+            beam = self.prune(children)
+            if not expanded:
+                return beam
+
+    def prune(self, nodes):
+        """Merges nodes in the same state and keeps the `width` best, the
+        incumbent always among them: the search never ends up worse than the
+        built-in dispatcher."""
+        best = {}
+        for node in nodes:
+            key = self.key(node)
+            other = best.get(key)
+            if other is None:
+                best[key] = node
+                continue
+            self.merged += 1
+            keep, drop = (node, other) if node.cost < other.cost else (other, node)
+            keep.incumbent = keep.incumbent or drop.incumbent
+            best[key] = keep
+            self.pool.append(drop)
+
+        ranked = sorted(best.values(), key=self.score)
+        kept, dropped = ranked[:self.width], ranked[self.width:]
+        for i, node in enumerate(dropped):
+            if node.incumbent:
+                kept[-1], dropped[i] = node, kept[-1]
+                break
+        self.pool.extend(dropped)
+        return kept
+
+    @staticmethod
+    def key(node):
+        driver = node.driver
+        return (node.sim.snapshot(),
+                tuple(tuple(p.id for p in riding) for riding in driver.riding),
+                tuple(tuple(len(queue) for queue in queues) for queues in driver.waiting))
+
+    def score(self, node):
+        """Cost so far, plus the passengers now waiting times how far the car
+        holding their call is from them (the farthest a car can be if none
+        holds it yet)."""
+        sim, driver = node.sim, node.driver
+        estimate = 0
+        for floor, queues in enumerate(driver.waiting):
+            for d, queue in enumerate(queues):
+                if not queue:
+                    continue
+                distance = self.config.floors
+                for elevator in sim.candidates[floor]:
+                    if elevator.assigned_requests[d][floor]:
+                        distance = elevator.distance(floor)
+                        break
+                estimate += len(queue) * distance * self.floor_time
+        return node.cost + estimate
+
+
+################################################################################
+
+
+def online(config, passengers):
+    """The built-in dispatcher on the same passengers, scored the same way."""
+    sim = LiftSimulator(ui=False, config=config)
+    driver = traffic.TrafficDriver(sim, copy_passengers(passengers))
+    interval = config.control_interval
+    end = horizon(passengers)
+    cost = 0
+    while driver.now < end:
+        driver.tick()
+        cost += waiting(driver) * interval
+        if finished(driver):
+            break
+    return cost, driver
+
+
+def load_trace(directory):
+    from tracefile import Trace
+
+    trace = Trace(directory)
+    rows = sorted(zip(*(trace.column('passengers', column).tolist()
+                        for column in ('arrival', 'origin', 'destination'))))
+    return [traffic.Passenger(i, arrival, origin, destination) for i, (arrival, origin, destination) in enumerate(rows)]
+
+
+def compare(name, config, passengers, width):
+    started = time.perf_counter()
+    greedy, greedy_driver = online(config, passengers)
+    greedy_wall = time.perf_counter() - started
+
+    solver = BeamSolver(config, passengers, width)
+    started = time.perf_counter()
+    best = solver.solve()
+    wall = time.perf_counter() - started
+
+    count = max(len(passengers), 1)
+    print('%-11s %5d %6d %9.1fs %9.1fs %6.1f%% %7d %8d %7d %7.2fs %7.1fs' %
+          (name, len(passengers), best.assignments, greedy / count, best.cost / count,
+           (greedy - best.cost) / greedy * 100 if greedy else 0,
+           solver.decisions, solver.forks, solver.merged, greedy_wall, wall))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline beam search baseline for lift dispatching.')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), default=None)
+    parser.add_argument('-n', type=int, default=None, help='number of floors')
+    parser.add_argument('-m', type=int, default=None, help='number of lifts')
+    parser.add_argument('--pattern', choices=traffic.PATTERNS, default=traffic.UP_PEAK)
+    parser.add_argument('--rate', type=float, default=12, help='arrivals per minute')
+    parser.add_argument('--duration', type=float, default=600, help='seconds of arrivals')
+    parser.add_argument('--trace', default=None, metavar='DIR', help='take the passengers of a trace')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--width', type=int, default=16, help='beam width')
+    args = parser.parse_args()
+
+    print('%-11s %5s %6s %10s %10s %7s %7s %8s %7s %8s %8s' %
+          ('scenario', 'pass.', 'calls', 'greedy', 'beam', 'gap', 'decide', 'forks', 'merged', 'greedy', 'beam'))
+    if args.trace is not None or args.n is not None:
+        n, m = args.n or 10, args.m or 3
+        if args.trace is not None:
+            passengers = load_trace(args.trace)
+        else:
+            passengers = traffic.generate(random.Random(args.seed), n, args.pattern, args.rate, args.duration)
+        compare(args.pattern if args.trace is None else 'trace', Config(floors=n, lifts=m), passengers, args.width)
+    else:
+        for name in args.scenario or sorted(SCENARIOS):
+            n, m, pattern, rate, duration = SCENARIOS[name]
+            passengers = traffic.generate(random.Random(args.seed), n, pattern, rate, duration)
+            compare(name, Config(floors=n, lifts=m), passengers, args.width)
@@ -0,0 +1,191 @@
+"""Columnar traces of simulator runs.
+
+Records are buffered per column in `array.array`s and flushed every
+`chunk_rows` rows as one NumPy `.npy` file per column and chunk:
+
+    DIR/manifest.json
+    DIR/events/time.00000.npy, DIR/events/car.00000.npy, ...
+    DIR/passengers/wait.00000.npy, ...
+
+Writing needs nothing but the standard library and never holds more than
+one chunk per table in memory. Reading uses NumPy, if installed: every chunk
+can be memory-mapped, so a day-long trace is analysed a column at a time.
+
+Tables and columns:
+
+    events      time, car, position, direction, doors, event (EVENT_NAMES)
+    passengers  id, arrival, origin, destination, car, boarded, delivered, wait
+
+Usage: python tracefile.py DIR (prints a summary of a trace)
+"""
+import array
+import json
+import os
+import struct
+import sys
+
+
+# Lift actions keep their index in Elevator.EVENTS, controller events follow
+EVENT_NAMES = ('move', 'open', 'close', 'proceed', 'arrive', 'hall_call', 'car_call', 'assign', 'stop',
+               'out_of_service', 'in_service')
+EVENT_HALL_CALL = 5
+EVENT_CAR_CALL = 6
+EVENT_ASSIGN = 7
+EVENT_STOP = 8
+EVENT_OUT_OF_SERVICE = 9
+EVENT_IN_SERVICE = 10
+
+# name: [(column, array typecode, npy descr)]
+TABLES = {
+    'events': [('time', 'd', '<f8'), ('car', 'h', '<i2'), ('position', 'f', '<f4'),
+               ('direction', 'b', '|i1'), ('doors', 'b', '|i1'), ('event', 'b', '|i1')],
+    'passengers': [('id', 'i', '<i4'), ('arrival', 'd', '<f8'), ('origin', 'h', '<i2'),
+                   ('destination', 'h', '<i2'), ('car', 'h', '<i2'), ('boarded', 'd', '<f8'),
+                   ('delivered', 'd', '<f8'), ('wait', 'd', '<f8')],
+}
+
+CHUNK_ROWS = 1 << 16
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+################################################################################
+
+
+def npy_header(descr, rows):
+    """Version 1.0 header of a 1-d array, padded so the data is aligned."""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, rows)
+    padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header
+
+
+class Table:
+
+    def __init__(self, directory, name, columns, chunk_rows):
+        self.directory = os.path.join(directory, name)
+        self.name = name
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.buffers = [array.array(typecode) for _, typecode, _ in columns]
+        self.rows = 0
+        self.chunks = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def append(self, row):
+        for buffer, value in zip(self.buffers, row):
+            buffer.append(value)
+        if len(self.buffers[0]) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        rows = len(self.buffers[0])
+        if not rows:
+            return
+        for (column, _, descr), buffer in zip(self.columns, self.buffers):
+            if sys.byteorder != 'little':
+                buffer.byteswap()
+            with open(os.path.join(self.directory, '%s.%05d.npy' % (column, self.chunks)), 'wb') as f:
+                f.write(npy_header(descr, rows))
+                buffer.tofile(f)
+            del buffer[:]
+        self.rows += rows
+        self.chunks += 1
+
+    def manifest(self):
+        return {'rows': self.rows, 'chunks': self.chunks,
+                'columns': [{'name': column, 'dtype': descr} for column, _, descr in self.columns]}
+
+
+class TraceWriter:
+    """Streams simulator events and passengers to a trace directory; attach
+    it as `sim.tracer`. The simulator calls `event`, a traffic driver calls
+    `passenger` for every delivered passenger."""
+
+    def __init__(self, directory, chunk_rows=CHUNK_ROWS):
+        self.directory = directory
+        self.tables = {name: Table(directory, name, columns, chunk_rows) for name, columns in TABLES.items()}
+        self._events = self.tables['events']
+        self._passengers = self.tables['passengers']
+
+    def event(self, t, car, position, direction, doors, event):
+        self._events.append((t, car, position, direction, doors, event))
+
+    def lift_event(self, t, elevator, event):
+        self._events.append((t, elevator.id, elevator.position, elevator.direction, elevator.doors, event))
+
+    def passenger(self, p):
+        self._passengers.append((p.id, p.arrival, p.origin, p.destination, p.lift, p.boarded, p.delivered,
+                                 p.boarded - p.arrival))
+
+    def close(self):
+        for table in self.tables.values():
+            table.flush()
+        with open(os.path.join(self.directory, 'manifest.json'), 'w') as f:
+            json.dump({'events': EVENT_NAMES, 'tables': {name: table.manifest() for name, table in self.tables.items()}},
+                      f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+################################################################################
+
+
+class Trace:
+    """A written trace, opened for reading. Chunks are memory-mapped, so only
+    the pages actually looked at are read from disk."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.directory = directory
+        self.event_names = self.manifest['events']
+
+    def rows(self, table):
+        return self.manifest['tables'][table]['rows']
+
+    def chunks(self, table, column):
+        """Memory-mapped chunks of one column, in order."""
+        import numpy
+
+        for i in range(self.manifest['tables'][table]['chunks']):
+            yield numpy.load(os.path.join(self.directory, table, '%s.%05d.npy' % (column, i)), mmap_mode='r')
+
+    def column(self, table, column):
+        """A whole column in memory."""
+        import numpy
+
+        chunks = list(self.chunks(table, column))
+        return numpy.concatenate(chunks) if chunks else numpy.empty(0)
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print('Usage: python tracefile.py DIR')
+        sys.exit(2)
+
+    trace = Trace(sys.argv[1])
+    for name, table in trace.manifest['tables'].items():
+        print('%s: %d rows in %d chunks, columns %s' %
+              (name, table['rows'], table['chunks'], ', '.join(column['name'] for column in table['columns'])))
+
+    try:
+        import numpy
+    except ImportError:
+        sys.exit(0)
+
+    counts = numpy.zeros(len(trace.event_names), dtype=numpy.int64)
+    for chunk in trace.chunks('events', 'event'):
+        counts += numpy.bincount(chunk, minlength=len(trace.event_names))
+    print('events: %s' % ', '.join('%s %d' % (name, count) for name, count in zip(trace.event_names, counts)))
+
+    if trace.rows('passengers'):
+        waits = trace.column('passengers', 'wait')
+        print('passengers: wait mean %.1fs, p50 %.1fs, p90 %.1fs, max %.1fs' %
+              (waits.mean(), numpy.percentile(waits, 50), numpy.percentile(waits, 90), waits.max()))
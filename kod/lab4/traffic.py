@@ -0,0 +1,288 @@
+"""Passenger traffic for the headless LiftSimulator on a virtual clock.
+
+Passengers arrive at random (Poisson, `rate` per minute), press the hall
+button for their direction, board a lift that opens at their floor going
+their way (if it has room and serves their destination) and press their
+destination inside. Reports waiting times, journey times and the number of
+passengers delivered per 5 minutes; with more arrivals than the group can
+carry, the latter is its handling capacity. With --motion, lifts travel on
+jerk-limited trips instead of half-floor steps; either way the odometers of
+all lifts are summed up. With --dwell adaptive, doors stay open as long as
+dwell.DwellPolicy makes them, with --dwell reopen they also reopen for late
+calls. With --trace, events and delivered passengers are written to a
+columnar trace (see tracefile.py).
+
+Usage: python traffic.py [-n 16] [-m 4] [--pattern up-peak] [--rate 30]
+                         [--duration 1800] [--zones single banks ...] [--seed 1]
+                         [--motion] [--trace DIR] [--dispatch greedy rollout]
+                         [--dwell fixed adaptive reopen]
+"""
+import argparse
+import os
+import random
+import time
+from collections import deque
+
+import zones as zoning
+from dwell import DwellPolicy
+from lab4 import *
+from motion import MotionProfile
+from tracefile import TraceWriter
+
+
+UP_PEAK = 'up-peak'
+DOWN_PEAK = 'down-peak'
+INTERFLOOR = 'interfloor'
+PATTERNS = (UP_PEAK, DOWN_PEAK, INTERFLOOR)
+
+GREEDY = 'greedy'
+ROLLOUT = 'rollout'
+DISPATCHERS = (GREEDY, ROLLOUT)
+
+FIXED = 'fixed'
+ADAPTIVE = 'adaptive'
+REOPEN = 'reopen'
+DWELLS = (FIXED, ADAPTIVE, REOPEN)
+
+CAPACITY = 12
+LOBBY = 0
+
+################################################################################
+
+
+class Passenger:
+
+    __slots__ = ('id', 'arrival', 'origin', 'destination', 'boarded', 'delivered', 'lift')
+
+    def __init__(self, i, arrival, origin, destination):
+        self.id = i
+        self.arrival = arrival
+        self.origin = origin
+        self.destination = destination
+        self.boarded = None
+        self.delivered = None
+        self.lift = None
+
+    @property
+    def direction(self):
+        return DIRECTION_UP if self.destination > self.origin else DIRECTION_DOWN
+
+    def __repr__(self):
+        return '<Passenger %d %d->%d @%.1f>' % (self.id, self.origin, self.destination, self.arrival)
+
+
+def generate(rng, n, pattern, rate, duration):
+    """Passengers arriving during `duration` seconds, ordered by arrival."""
+    passengers = []
+    t = rng.expovariate(rate / 60)
+    while t < duration:
+        if pattern == UP_PEAK:
+            origin, destination = LOBBY, rng.randrange(1, n)
+        elif pattern == DOWN_PEAK:
+            origin, destination = rng.randrange(1, n), LOBBY
+        else:
+            origin, destination = rng.sample(range(n), 2)
+        passengers.append(Passenger(len(passengers), t, origin, destination))
+        t += rng.expovariate(rate / 60)
+    return passengers
+
+
+class TrafficDriver:
+    """Feeds passengers to a simulator, one control tick at a time."""
+
+    def __init__(self, sim, passengers, capacity=CAPACITY):
+        self.sim = sim
+        self.capacity = capacity
+        self.passengers = list(passengers)
+        self.arrivals = deque(self.passengers)
+        self.waiting = [[[], []] for _ in range(sim.config.floors)]
+        self.riding = [[] for _ in range(sim.config.lifts)]
+        self.delivered = []
+
+        self.ticks = 0
+        self.now = 0
+
+    def run(self, duration):
+        while self.now < duration:
+            self.tick()
+
+    def tick(self):
+        self.move_passengers()
+        self.control()
+
+    def move_passengers(self):
+        """The passengers' part of a tick: arrivals call, passengers at open
+        doors get off and on."""
+        sim = self.sim
+
+        while self.arrivals and self.arrivals[0].arrival <= self.now:
+            passenger = self.arrivals.popleft()
+            self.waiting[passenger.origin][passenger.direction].append(passenger)
+            self.call(passenger.origin, passenger.direction)
+
+        open_floors = set()
+        for elevator in sim.elevators:
+            if elevator.doors == DOORS_OPEN:
+                open_floors.add(elevator.position)
+                self.exchange(elevator)
+
+        # Whoever was left behind presses the button again once the doors close
+        for floor, queues in enumerate(self.waiting):
+            if floor not in open_floors:
+                for d, queue in enumerate(queues):
+                    if queue and not sim.requests[d][floor]:
+                        self.call(floor, d)
+
+    def control(self):
+        """The controller's part of a tick."""
+        self.sim.control_loop()
+        self.advance()
+
+    def advance(self):
+        self.ticks += 1
+        self.now = self.ticks * self.sim.config.control_interval
+
+    def exchange(self, elevator):
+        floor = elevator.position
+        riding = self.riding[elevator.id]
+
+        if any(passenger.destination == floor for passenger in riding):
+            for passenger in riding:
+                if passenger.destination == floor:
+                    passenger.delivered = self.now
+                    self.delivered.append(passenger)
+                    if self.sim.tracer is not None:
+                        self.sim.tracer.passenger(passenger)
+            riding[:] = [passenger for passenger in riding if passenger.destination != floor]
+
+        for d in (DIRECTION_UP, DIRECTION_DOWN):
+            if elevator.direction not in (d, DIRECTION_NONE):
+                continue
+            queue = self.waiting[floor][d]
+            for passenger in list(queue):
+                if len(riding) >= self.capacity:
+                    return
+                if not elevator.serves[passenger.destination]:
+                    continue
+                queue.remove(passenger)
+                passenger.boarded = self.now
+                passenger.lift = elevator.id
+                riding.append(passenger)
+                self.sim.car_call(elevator.id, passenger.destination)
+
+    def call(self, floor, d):
+        self.sim.handle_event(Event(EVENT_HALL_UP if d == DIRECTION_UP else EVENT_HALL_DOWN, floor, None, self.now))
+
+    # Snapshots
+
+    def snapshot(self):
+        """Where every passenger is, as nested tuples of passenger ids and
+        times. It restores into any driver given equal passengers with the
+        same ids, which must be their indices."""
+        return (self.ticks, len(self.passengers) - len(self.arrivals),
+                tuple(tuple(tuple(p.id for p in queue) for queue in queues) for queues in self.waiting),
+                tuple(tuple((p.id, p.boarded) for p in riding) for riding in self.riding),
+                tuple((p.id, p.lift, p.boarded, p.delivered) for p in self.delivered))
+
+    def restore(self, snapshot):
+        ticks, arrived, waiting, riding, delivered = snapshot
+        passengers = self.passengers
+
+        self.ticks = ticks
+        self.now = ticks * self.sim.config.control_interval
+        self.arrivals = deque(passengers[arrived:])
+        self.waiting = [[[passengers[i] for i in queue] for queue in queues] for queues in waiting]
+        for p in self.arrivals:
+            p.lift = p.boarded = p.delivered = None
+        for queues in self.waiting:
+            for queue in queues:
+                for p in queue:
+                    p.lift = p.boarded = p.delivered = None
+
+        self.riding = [[] for _ in riding]
+        for lift, riders in enumerate(riding):
+            for i, boarded in riders:
+                p = passengers[i]
+                p.lift, p.boarded, p.delivered = lift, boarded, None
+                self.riding[lift].append(p)
+        self.delivered = []
+        for i, lift, boarded, delivered_at in delivered:
+            p = passengers[i]
+            p.lift, p.boarded, p.delivered = lift, boarded, delivered_at
+            self.delivered.append(p)
+
+    # Statistics
+
+    def stats(self):
+        waits = sorted(p.boarded - p.arrival for p in self.delivered)
+        journeys = sorted(p.delivered - p.arrival for p in self.delivered)
+        pick = lambda xs, q: xs[min(int(q * len(xs)), len(xs) - 1)] if xs else 0
+        return {
+            'delivered': len(self.delivered),
+            'waiting': sum(len(queue) for queues in self.waiting for queue in queues),
+            'riding': sum(len(riding) for riding in self.riding),
+            'wait_mean': sum(waits) / len(waits) if waits else 0,
+            'wait_p90': pick(waits, 0.9),
+            'journey_mean': sum(journeys) / len(journeys) if journeys else 0,
+            'per_5min': len(self.delivered) / self.now * 300 if self.now else 0,
+            'distance': sum(elevator.odometer.distance for elevator in self.sim.elevators),
+            'starts': sum(elevator.odometer.starts for elevator in self.sim.elevators),
+            'energy': sum(elevator.odometer.energy for elevator in self.sim.elevators),
+        }
+
+
+def simulate(config, pattern, rate, duration, seed, tracer=None, dispatch=GREEDY):
+    """Runs one building, returns the driver and the wall time in seconds."""
+    sim = LiftSimulator(ui=False, config=config)
+    sim.tracer = tracer
+    dispatcher = None
+    if dispatch == ROLLOUT:
+        from rollout import RolloutDispatcher
+        dispatcher = RolloutDispatcher(sim, seed=seed).install()
+    driver = TrafficDriver(sim, generate(random.Random(seed), config.floors, pattern, rate, duration))
+    started = time.perf_counter()
+    driver.run(duration)
+    if tracer is not None:
+        tracer.close()
+    if dispatcher is not None:
+        dispatcher.uninstall()
+    return driver, time.perf_counter() - started
+
+
+################################################################################
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Passenger traffic for the lift simulator.')
+    parser.add_argument('-n', type=int, default=16, help='number of floors')
+    parser.add_argument('-m', type=int, default=4, help='number of lifts')
+    parser.add_argument('--pattern', choices=PATTERNS, default=UP_PEAK)
+    parser.add_argument('--rate', type=float, default=30, help='arrivals per minute')
+    parser.add_argument('--duration', type=float, default=1800, help='simulated seconds')
+    parser.add_argument('--zones', nargs='+', choices=sorted(zoning.PRESETS), default=['single'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--motion', action='store_true', help='jerk-limited trips instead of half-floor steps')
+    parser.add_argument('--trace', default=None, metavar='DIR', help='write a trace per zoning to DIR/ZONES')
+    parser.add_argument('--dispatch', nargs='+', choices=DISPATCHERS, default=[GREEDY],
+                        help='hall call dispatchers to compare (rollout: see rollout.py)')
+    parser.add_argument('--dwell', nargs='+', choices=DWELLS, default=[FIXED],
+                        help='door dwell times to compare (adaptive: see dwell.py)')
+    args = parser.parse_args()
+
+    print('%-22s %9s %7s %6s %9s %8s %11s %9s %8s %6s %8s %7s' %
+          ('zones', 'delivered', 'waiting', 'riding', 'wait avg', 'wait p90', 'journey avg', 'per 5 min',
+           'distance', 'starts', 'energy', 'wall'))
+    runs = [(name, dispatch, dwell) for name in args.zones for dispatch in args.dispatch for dwell in args.dwell]
+    for name, dispatch, dwell in runs:
+        config = Config(floors=args.n, lifts=args.m, zones=zoning.PRESETS[name](args.n, args.m),
+                        motion=MotionProfile() if args.motion else None,
+                        dwell=None if dwell == FIXED else DwellPolicy(reopen=dwell == REOPEN))
+        label = '/'.join([name] + ([dispatch] if len(args.dispatch) > 1 else []) +
+                         ([dwell] if len(args.dwell) > 1 else []))
+        tracer = None if args.trace is None else TraceWriter(os.path.join(args.trace, label.replace('/', '-')))
+        driver, wall = simulate(config, args.pattern, args.rate, args.duration, args.seed, tracer, dispatch)
+        stats = driver.stats()
+        print('%-22s %9d %7d %6d %8.1fs %7.1fs %10.1fs %9.1f %7.0fm %6d %6.0fkJ %6.2fs' %
+              (label, stats['delivered'], stats['waiting'], stats['riding'], stats['wait_mean'],
+               stats['wait_p90'], stats['journey_mean'], stats['per_5min'],
+               stats['distance'], stats['starts'], stats['energy'] / 1000, wall))
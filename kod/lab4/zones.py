@@ -0,0 +1,68 @@
+"""Zones of a lift group: which lifts answer hall calls and car calls at which
+floors. A zone is a set of floors served by a set of lifts; a lift may belong
+to several zones and floors outside all of its zones are passed without
+stopping (express). Floors and lifts are numbered from 0.
+
+The presets take the building size and return a list of zones:
+
+    single      every lift serves every floor (the default)
+    banks       low-rise and high-rise banks sharing the lobby, the high-rise
+                bank runs express through the low-rise floors
+    shuttle     the last lift shuttles between the lobby and the top floor,
+                the others serve everything
+"""
+
+
+class Zone:
+
+    def __init__(self, name, floors, lifts):
+        self.name = name
+        self.floors = frozenset(floors)
+        self.lifts = tuple(lifts)
+
+    def __repr__(self):
+        return '<Zone %s: floors %s, lifts %s>' % (self.name, sorted(self.floors), list(self.lifts))
+
+
+def single(n, m):
+    return [Zone('all', range(n), range(m))]
+
+
+def banks(n, m, split=None, lobby=0):
+    """Lifts [0, m/2) serve the lobby and the floors below `split`, the rest
+    the lobby and the floors from `split` up."""
+    if m < 2:
+        raise ValueError('Banks need at least 2 lifts')
+    split = (n + 1) // 2 if split is None else split
+    half = m // 2
+    return [Zone('low', {lobby} | set(range(split)), range(half)),
+            Zone('high', {lobby} | set(range(split, n)), range(half, m))]
+
+
+def shuttle(n, m, lobby=0):
+    if m < 2:
+        raise ValueError('A shuttle needs at least 2 lifts')
+    return [Zone('all', range(n), range(m - 1)),
+            Zone('shuttle', (lobby, n - 1), (m - 1,))]
+
+
+PRESETS = {'single': single, 'banks': banks, 'shuttle': shuttle}
+
+
+def candidates(zones, n, m):
+    """Precomputes ([lifts per floor], [served floor flags per lift]). Hall
+    calls at a floor are only offered to its candidate lifts; every floor
+    needs at least one."""
+    serves = [[False] * n for _ in range(m)]
+    for zone in zones:
+        if not zone.floors <= set(range(n)) or not set(zone.lifts) <= set(range(m)):
+            raise ValueError('Zone %s does not fit %d floors and %d lifts' % (zone.name, n, m))
+        for lift in zone.lifts:
+            for floor in zone.floors:
+                serves[lift][floor] = True
+
+    per_floor = [[lift for lift in range(m) if serves[lift][floor]] for floor in range(n)]
+    for floor, lifts in enumerate(per_floor):
+        if not lifts:
+            raise ValueError('Floor %d is not served by any lift' % (floor + 1))
+    return per_floor, serves